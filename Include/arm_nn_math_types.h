@@ -1,8 +1,8 @@
 /******************************************************************************
  * @file     arm_nn_math_types.h
  * @brief    Compiler include and basic types
- * @version  V1.1.0
- * @date     09 March 2022
+ * @version  V1.1.1
+ * @date     18 October 2026
  * Target Processor: Cortex-M
  ******************************************************************************/
 /*
@@ -83,6 +83,9 @@ extern "C" {
 #ifndef __STATIC_INLINE
 #define __STATIC_INLINE static inline
 #endif
+#ifndef __RESTRICT
+#define __RESTRICT __restrict
+#endif
 
 #else
 #include "cmsis_compiler.h"
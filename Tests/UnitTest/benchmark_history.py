@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2010-2022 Arm Limited or its affiliates.
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the License); you may
+# not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an AS IS BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import sys
+import json
+import sqlite3
+import argparse
+import datetime
+import subprocess
+import numpy as np
+
+HISTORY_DB = 'benchmark_history.db'
+
+# Number of bootstrap resamples of the confidence interval of a comparison.
+BOOTSTRAP_RESAMPLES = 2000
+# Minimum number of runs of each revision for a change to be significant, as the variance between runs, e.g. from
+# the frequency and the load of the machine, cannot be estimated from the samples of a single run.
+MIN_RUNS = 2
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    revision TEXT NOT NULL,
+    dirty INTEGER NOT NULL,
+    compiler TEXT NOT NULL,
+    flags TEXT NOT NULL,
+    machine TEXT NOT NULL,
+    date TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS results (
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    kernel TEXT NOT NULL,
+    name TEXT NOT NULL,
+    params TEXT NOT NULL,
+    ok INTEGER NOT NULL,
+    median_ns REAL NOT NULL,
+    variance_ns2 REAL NOT NULL,
+    samples_ns TEXT NOT NULL,
+    throughput REAL NOT NULL,
+    unit TEXT NOT NULL,
+    scratch_size INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS runs_key ON runs(revision, dirty, compiler, flags, machine);
+CREATE INDEX IF NOT EXISTS results_run ON results(run_id);
+"""
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="History of the results of cmsis_nn_benchmark.py, by git revision,"
+                                     " compiler, compiler flags, machine, kernel and shape, and comparison of two"
+                                     " revisions.")
+    parser.add_argument('--db', type=str, default=HISTORY_DB, help="SQLite database of the history.")
+    parser.add_argument('--add', type=str, nargs='+', default=[], metavar='FILE', help="Add the results of"
+                        " cmsis_nn_benchmark.py written to FILE to the history.")
+    parser.add_argument('--list', action='store_true', help="List the runs in the history.")
+    parser.add_argument('--compare', type=str, nargs=2, default=None, metavar=('BASE', 'NEW'), help="Compare the"
+                        " results of two revisions, e.g. HEAD~1 HEAD, for each compiler, compiler flags and machine"
+                        " that both have results for. Only results without local changes are used, unless the"
+                        " revision is followed by +, e.g. HEAD HEAD+ compares HEAD with local changes of it.")
+    parser.add_argument('--compiler', type=str, default=None, help="Only compare results of this compiler, e.g."
+                        " 'GNU 12.2.0'.")
+    parser.add_argument('--flags', type=str, default=None, help="Only compare results built with these compiler"
+                        " flags, e.g. '-DARM_MATH_LOOPUNROLL'.")
+    parser.add_argument('--confidence', type=float, default=0.95, help="Confidence level of the intervals.")
+    parser.add_argument('--threshold', type=float, default=0.05, help="Relative change of the median time that is"
+                        " significant, if the whole confidence interval is beyond it.")
+    parser.add_argument('--report', type=str, default=None, help="Write the Markdown report of --compare to this"
+                        " file instead of printing it.")
+    return parser.parse_args()
+
+
+def normalize_flags(flags):
+    """
+    Compiler flags in a canonical order, so that e.g. the same CMSIS_FLAGS of unittest_targets.py given in another
+    order are the same key.
+    """
+    return ' '.join(sorted((flags or '').split()))
+
+
+def parse_revision(revision):
+    """
+    Return (SHA, dirty) of a revision of --compare, where a trailing + selects the results with local changes, as
+    marked by --list.
+    """
+    dirty = revision.endswith('+')
+    return (resolve_revision(revision[:-1] if dirty else revision), dirty)
+
+
+def resolve_revision(revision):
+    """
+    Full SHA of a git revision, e.g. HEAD~1 or a tag. Revisions that git does not know, e.g. of another clone, are
+    returned as given and matched as a SHA prefix in the history.
+    """
+    result = subprocess.run(['git', 'rev-parse', '--verify', '--quiet', revision + '^{commit}'],
+                            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, universal_newlines=True)
+    return result.stdout.strip() if result.returncode == 0 else revision
+
+
+class BenchmarkHistory:
+    """
+    The results of cmsis_nn_benchmark.py in an SQLite database. A run is one results file, keyed by the git revision
+    of the library, whether it had local changes, its compiler, its compiler flags and the machine, and it has a
+    result per benchmark, i.e. per kernel and shape. The runs of the same key are combined when comparing, see
+    get_median_ratio_interval(). A revision is given as (SHA, dirty), where dirty selects the runs with local changes.
+    """
+
+    def __init__(self, filepath):
+        self.connection = sqlite3.connect(filepath)
+        self.connection.executescript(SCHEMA)
+
+    def add(self, report):
+        """
+        Add the results of cmsis_nn_benchmark.py, as written to its JSON file, and return the id of the run.
+        """
+        if not report.get('revision'):
+            raise RuntimeError("Results have no git revision, they were not run in a git checkout")
+        with self.connection:
+            cursor = self.connection.execute(
+                "INSERT INTO runs (revision, dirty, compiler, flags, machine, date) VALUES (?, ?, ?, ?, ?, ?)",
+                (report['revision'], report['dirty'], report['compiler'], normalize_flags(report['c_flags']),
+                 report['machine'], report.get('date') or datetime.datetime.now().isoformat(timespec='seconds')))
+            run_id = cursor.lastrowid
+            self.connection.executemany(
+                "INSERT INTO results (run_id, kernel, name, params, ok, median_ns, variance_ns2, samples_ns, "
+                "throughput, unit, scratch_size) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(run_id, result['kernel'], result['name'], json.dumps(result['params']), result['ok'],
+                  result['median_ns'], result['variance_ns2'], json.dumps(result['samples_ns']),
+                  result['throughput'], result['unit'], result['scratch_size']) for result in report['benchmarks']])
+        return run_id
+
+    def get_runs(self):
+        return self.connection.execute("SELECT id, revision, dirty, compiler, flags, machine, date FROM runs "
+                                       "ORDER BY id").fetchall()
+
+    def get_configs(self, revision):
+        """
+        The (compiler, flags, machine) keys that a revision, with a SHA prefix, has results for.
+        """
+        (sha, dirty) = revision
+        return set(self.connection.execute("SELECT compiler, flags, machine FROM runs WHERE revision LIKE ? AND "
+                                            "dirty = ?", (sha + '%', dirty)).fetchall())
+
+    def get_samples(self, revision, config):
+        """
+        The samples of the results of a revision and (compiler, flags, machine), by (kernel, name), as a list of the
+        samples of each run of them.
+        """
+        (sha, dirty) = revision
+        samples = {}
+        for kernel, name, samples_ns in self.connection.execute(
+                "SELECT kernel, name, samples_ns FROM results JOIN runs ON results.run_id = runs.id WHERE "
+                "revision LIKE ? AND dirty = ? AND compiler = ? AND flags = ? AND machine = ? AND ok ORDER BY run_id",
+                (sha + '%', dirty) + config):
+            samples.setdefault((kernel, name), []).append(json.loads(samples_ns))
+        return samples
+
+
+def get_bootstrap_medians(runs, rng):
+    """
+    Medians of hierarchical bootstrap resamples of the samples of several runs. The runs are resampled first and
+    then the samples of each resampled run, so that the variance between runs is part of the variance of the medians.
+    """
+    sizes = np.array([len(samples) for samples in runs])
+    values = np.full((len(runs), sizes.max()), np.nan)
+    for (index, samples) in enumerate(runs):
+        values[index, :len(samples)] = samples
+    chosen = rng.integers(len(runs), size=(BOOTSTRAP_RESAMPLES, len(runs)))
+    chosen_sizes = sizes[chosen][..., np.newaxis]
+    positions = (rng.random((BOOTSTRAP_RESAMPLES, len(runs), sizes.max())) * chosen_sizes).astype(int)
+    # Only the first samples of each resampled run, as many as the run has, are used.
+    resamples = np.where(np.arange(sizes.max()) < chosen_sizes, values[chosen[..., np.newaxis], positions], np.nan)
+    return np.nanmedian(resamples.reshape(BOOTSTRAP_RESAMPLES, -1), axis=1)
+
+
+def get_median_ratio_interval(base, new, confidence, rng):
+    """
+    Ratio of the median of the new samples to the median of the base samples and its confidence interval, from a
+    percentile bootstrap. base and new are the samples of each run, see get_samples(). The two revisions are
+    resampled independently, as they are timed in different runs.
+    """
+    base_medians = get_bootstrap_medians(base, rng)
+    new_medians = get_bootstrap_medians(new, rng)
+    tail = (1 - confidence) / 2 * 100
+    (low, high) = np.percentile(new_medians / base_medians, [tail, 100 - tail])
+    return (np.median(np.concatenate(new)) / np.median(np.concatenate(base)), low, high)
+
+
+def compare(history, base, new, args):
+    """
+    Compare the results of two revisions for each (compiler, flags, machine) that both have results for. Returns a
+    list of (config, rows), where each row is (kernel, name, base median, new median, ratio, low, high, verdict,
+    base runs, new runs) and verdict is 'slower' or 'faster' if the confidence interval of the ratio is beyond the
+    threshold and both revisions have at least MIN_RUNS runs.
+    """
+    configs = sorted(history.get_configs(base) & history.get_configs(new))
+    if args.compiler:
+        configs = [config for config in configs if config[0] == args.compiler]
+    if args.flags is not None:
+        configs = [config for config in configs if config[1] == normalize_flags(args.flags)]
+    if not configs:
+        raise RuntimeError("No results of the same compiler, flags and machine for both {} and {} in the history"
+                           .format(format_revision(base), format_revision(new)))
+    # Seeded, so that the same history gives the same report.
+    rng = np.random.default_rng(0)
+    comparisons = []
+    for config in configs:
+        base_samples = history.get_samples(base, config)
+        new_samples = history.get_samples(new, config)
+        rows = []
+        for key in sorted(set(base_samples) & set(new_samples)):
+            (ratio, low, high) = get_median_ratio_interval(base_samples[key], new_samples[key], args.confidence, rng)
+            runs = (len(base_samples[key]), len(new_samples[key]))
+            significant = min(runs) >= MIN_RUNS
+            verdict = ''
+            if significant and low > 1 + args.threshold:
+                verdict = 'slower'
+            elif significant and high < 1 - args.threshold:
+                verdict = 'faster'
+            rows.append(key + (float(np.median(np.concatenate(base_samples[key]))),
+                               float(np.median(np.concatenate(new_samples[key]))), ratio, low, high, verdict) + runs)
+        comparisons.append((config, rows))
+    return comparisons
+
+
+def format_revision(revision):
+    (sha, dirty) = revision
+    return sha[:12] + ('+' if dirty else '')
+
+
+def format_report(base, new, comparisons, args):
+    """
+    Markdown report of compare(), with a table per compiler, flags and machine and the significant slowdowns
+    first.
+    """
+    lines = ["# Benchmark comparison", "",
+             "Base `{}` and new `{}`, with {:.0f}% confidence intervals of the change of the median time, from a "
+             "bootstrap over the runs and their samples. Changes with the whole interval beyond {:.0f}% are "
+             "significant, if both revisions have at least {} runs. A + marks results with local changes of the "
+             "revision.".format(format_revision(base), format_revision(new), args.confidence * 100,
+                                args.threshold * 100, MIN_RUNS)]
+    for (config, rows) in comparisons:
+        (compiler, flags, machine) = config
+        slower = [row for row in rows if row[7] == 'slower']
+        faster = [row for row in rows if row[7] == 'faster']
+        lines += ["", "## {}, flags `{}`, {}".format(compiler, flags or 'none', machine), "",
+                  "{} benchmarks, {} significantly slower, {} significantly faster.".format(
+                      len(rows), len(slower), len(faster)), "",
+                  "| Kernel | Benchmark | Base (us) | New (us) | Change | CI | Runs | |",
+                  "|---|---|---:|---:|---:|---:|---:|---|"]
+        for (kernel, name, base_median, new_median, ratio, low, high, verdict, base_runs, new_runs) in \
+                slower + [row for row in rows if row[7] != 'slower']:
+            lines.append("| {} | {} | {:.3f} | {:.3f} | {:+.1f}% | {:+.1f}% .. {:+.1f}% | {}/{} | {} |".format(
+                kernel, name, base_median / 1000, new_median / 1000, (ratio - 1) * 100, (low - 1) * 100,
+                (high - 1) * 100, base_runs, new_runs, {'slower': '**slower**', 'faster': 'faster'}.get(verdict, '')))
+    return '\n'.join(lines) + '\n'
+
+
+if __name__ == '__main__':
+    args = parse_args()
+
+    history = BenchmarkHistory(args.db)
+    for filepath in args.add:
+        with open(filepath) as f:
+            report = json.load(f)
+        run_id = history.add(report)
+        print("Added {} results of {} as run {}".format(len(report['benchmarks']), filepath, run_id))
+    if args.list:
+        print("{:>5} {:<14} {:<20} {:<40} {:<10} {}".format("Run", "Revision", "Compiler", "Flags", "Machine",
+                                                            "Date"))
+        for (run_id, revision, dirty, compiler, flags, machine, date) in history.get_runs():
+            print("{:>5} {:<14} {:<20} {:<40} {:<10} {}".format(run_id, revision[:12] + ('+' if dirty else ''),
+                                                                compiler, flags, machine, date))
+    if args.compare:
+        (base, new) = [parse_revision(revision) for revision in args.compare]
+        comparisons = compare(history, base, new, args)
+        report = format_report(base, new, comparisons, args)
+        if args.report:
+            with open(args.report, 'w') as f:
+                f.write(report)
+            print("Report written to {}".format(args.report))
+        else:
+            print(report)
+        if any(row[7] == 'slower' for (config, rows) in comparisons for row in rows):
+            sys.exit(1)
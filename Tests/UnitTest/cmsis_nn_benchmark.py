@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2010-2022 Arm Limited or its affiliates.
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the License); you may
+# not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an AS IS BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import gc
+import os
+import ctypes
+import re
+import sys
+import glob
+import json
+import time
+import shutil
+import argparse
+import datetime
+import platform
+import tempfile
+import traceback
+import subprocess
+import statistics
+import numpy as np
+
+import generate_test_data
+import cmsis_nn_host
+import benchmark_history
+
+BENCHMARK_SETS_FILE = 'benchmark_sets.json'
+BENCHMARK_OUTPUT = 'benchmark.json'
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the CMSIS-NN kernels of a host build of the library over"
+                                     " the shapes of {}.".format(BENCHMARK_SETS_FILE))
+    parser.add_argument('--library', type=str, default=None, help="Path of the library, see cmsis_nn_host.py.")
+    parser.add_argument('--build', action='store_true', help="Build the library in {} first.".format(
+        cmsis_nn_host.HOST_BUILD_DIR))
+    parser.add_argument('--c-flags', type=str, default='', help="Compiler flags of --build, e.g."
+                        " -DARM_MATH_LOOPUNROLL.")
+    parser.add_argument('-t', '--testtype', type=str, default=None, choices=list(generate_test_data.SETTINGS_CLASSES),
+                        help='Only benchmark kernels of this type of test.')
+    parser.add_argument('--filter', type=str, default=None, help="Only run the benchmarks with a name matching this"
+                        " regular expression, e.g. 'conv_s8/'.")
+    parser.add_argument('--list', action='store_true', help="List the benchmarks and exit.")
+    parser.add_argument('--repeat', type=int, default=21, help="Number of timed samples of each benchmark.")
+    parser.add_argument('--min-time', type=float, default=0.005, help="Minimum time of a sample in seconds, the"
+                        " kernel is run as many times as needed for it.")
+    parser.add_argument('--seed', type=int, default=0, help="Seed of the data of the benchmarks.")
+    parser.add_argument('--output', type=str, default=BENCHMARK_OUTPUT, help="JSON file the results are written"
+                        " to.")
+    parser.add_argument('--history', type=str, nargs='?', default=None, const=benchmark_history.HISTORY_DB,
+                        help="Also add the results to this benchmark history database, by default {}, see"
+                        " benchmark_history.py.".format(benchmark_history.HISTORY_DB))
+    return parser.parse_args()
+
+
+class BenchmarkSets:
+    """
+    The benchmarks of a benchmark set file, in order. Each set names a test type and a kernel, the parameters shared
+    by its shapes and the shapes, which are constructor parameters of the settings class of the test type the same as
+    in testdata_sets.json. A benchmark is named after its set and shape, e.g. conv_s8/in_ch=8,out_ch=16.
+    """
+
+    def __init__(self, filepath):
+        with open(filepath, 'r') as f:
+            sets = json.load(f)
+        self.benchmarks = []
+        for set_name, spec in sets.items():
+            test_type = spec.get('type')
+            if test_type not in generate_test_data.SETTINGS_CLASSES:
+                raise RuntimeError("Invalid test type {} of benchmark set {} in {}".format(test_type, set_name,
+                                                                                          filepath))
+            common = {key: self.get_value(value) for key, value in spec.items()
+                      if key not in ('type', 'kernel', 'shapes')}
+            for index, shape in enumerate(spec['shapes']):
+                shape = {key: self.get_value(value) for key, value in shape.items()}
+                name = '{}/{}'.format(set_name, ','.join('{}={}'.format(key, value) for key, value in shape.items()))
+                self.benchmarks.append({'name': name, 'testset': '{}_{}'.format(set_name, index), 'type': test_type,
+                                        'kernel': spec['kernel'], 'params': dict(common, **shape)})
+
+    @staticmethod
+    def get_value(value):
+        return generate_test_data.TestDataSets.CONSTANTS.get(value, value) if isinstance(value, str) else value
+
+    def select(self, test_type=None, pattern=None):
+        return [benchmark for benchmark in self.benchmarks
+                if (not test_type or benchmark['type'] == test_type)
+                and (not pattern or re.search(pattern, benchmark['name']))]
+
+
+def get_operations(data):
+    """
+    Number of operations of one kernel run on the test set and their unit, which is multiply-accumulates for the
+    convolutions, fully connected and SVDF and input elements for the other kernels.
+    """
+    if data.test_type in ('conv', 'depthwise_conv'):
+        macs = data['INPUT_BATCHES'] * data['OUTPUT_H'] * data['OUTPUT_W'] * data['OUT_CH'] * data['FILTER_X'] * \
+            data['FILTER_Y']
+        return (macs * data['IN_CH'] if data.test_type == 'conv' else macs, 'MAC')
+    if data.test_type == 'fully_connected':
+        return (data['INPUT_BATCHES'] * data['ACCUMULATION_DEPTH'] * data['OUT_CH'], 'MAC')
+    if data.test_type == 'svdf':
+        # One input frame: the feature weights, then the time weights over the state.
+        return (data['INPUT_BATCHES'] * data['FEATURE_BATCHES'] * (data['INPUT_SIZE'] + data['TIME_BATCHES']), 'MAC')
+    if data.test_type in ('avgpool', 'maxpool'):
+        return (data['INPUT_BATCHES'] * data['INPUT_H'] * data['INPUT_W'] * data['IN_CH'], 'element')
+    if data.test_type == 'softmax':
+        return (data['NUM_ROWS'] * data['ROW_SIZE'], 'element')
+    return (data['DST_SIZE'], 'element')
+
+
+def time_call(function, arguments, repeat, min_time):
+    """
+    Time repeated calls of a function and return (number, samples), where each of the repeat samples is the mean time
+    in ns of number calls and number is chosen so that a sample takes at least min_time seconds. The garbage
+    collector is disabled while timing, as in timeit.
+    """
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        number = 1
+        while True:
+            start = time.perf_counter_ns()
+            for _ in range(number):
+                function(*arguments)
+            if time.perf_counter_ns() - start >= min_time * 1e9:
+                break
+            number *= 2
+        samples = []
+        for _ in range(repeat):
+            start = time.perf_counter_ns()
+            for _ in range(number):
+                function(*arguments)
+            samples.append((time.perf_counter_ns() - start) / number)
+    finally:
+        if gc_enabled:
+            gc.enable()
+    return (number, samples)
+
+
+def get_call_overhead(host, function, arguments, args):
+    """
+    Median time in ns of calling an empty C function through ctypes with the same argument types and arguments as a
+    kernel, i.e. the part of the time of a kernel call that is spent in Python and ctypes. The empty function is
+    arm_fully_connected_s8_get_buffer_size, which ignores its arguments, called through a prototype of the kernel. The
+    extra arguments are removed by the caller in the C calling convention.
+    """
+    address = ctypes.cast(host.library.arm_fully_connected_s8_get_buffer_size, ctypes.c_void_p).value
+    empty_function = ctypes.CFUNCTYPE(function.restype, *function.argtypes)(address)
+    (number, samples) = time_call(empty_function, arguments, args.repeat, args.min_time)
+    return statistics.median(samples)
+
+
+def run_benchmark(host, benchmark, args):
+    """
+    Generate the data of a benchmark, check the output of the kernel against the reference output and time the
+    kernel. Only the first call of the kernel is timed for kernels called more than once per test set, i.e. one
+    input frame of SVDF. The times include the overhead of the call through ctypes, which is timed separately. The
+    throughput is computed from the time of the kernel itself, the median less the overhead, and the throughput at
+    the median is kept as throughput_raw.
+    """
+    settings = generate_test_data.SETTINGS_CLASSES[benchmark['type']](benchmark['testset'], benchmark['type'],
+                                                                      generate_test_data.args, **benchmark['params'])
+    data = cmsis_nn_host.generate_testset(settings)
+    error = cmsis_nn_host.compare_output(data, host.run(data, benchmark['kernel']))
+
+    timings = []
+
+    def profiler(kernel, function, arguments):
+        if not timings:
+            timings.append(time_call(function, arguments, args.repeat, args.min_time) +
+                           (get_call_overhead(host, function, arguments, args), ))
+
+    host.profiler = profiler
+    try:
+        host.run(data, benchmark['kernel'])
+    finally:
+        host.profiler = None
+    (number, samples, overhead) = timings[0]
+    (operations, unit) = get_operations(data)
+    median = statistics.median(samples)
+    # The overhead is the median of other samples, so it can exceed the median of a kernel that does next to nothing.
+    kernel = max(median - overhead, 1.0)
+    return {
+        'name': benchmark['name'],
+        'type': benchmark['type'],
+        'kernel': benchmark['kernel'],
+        'params': benchmark['params'],
+        'ok': error is None,
+        'error': error,
+        'median_ns': median,
+        'mean_ns': statistics.mean(samples),
+        'min_ns': min(samples),
+        'max_ns': max(samples),
+        'variance_ns2': statistics.variance(samples) if len(samples) > 1 else 0.0,
+        'stdev_ns': statistics.stdev(samples) if len(samples) > 1 else 0.0,
+        'calls_per_sample': number,
+        'samples_ns': samples,
+        'overhead_ns': overhead,
+        'kernel_ns': kernel,
+        'operations': operations,
+        'unit': unit,
+        'throughput': operations / (kernel * 1e-9),
+        'throughput_raw': operations / (median * 1e-9),
+        'scratch_size': host.buffer_size,
+    }
+
+
+def get_revision():
+    """
+    Return (SHA, dirty) of the git checkout that the library is built from, where dirty is whether its sources have
+    local changes, or (None, False) outside of a git checkout.
+    """
+    source_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..')
+    result = subprocess.run(['git', '-C', source_dir, 'rev-parse', 'HEAD'], stdout=subprocess.PIPE,
+                            stderr=subprocess.DEVNULL, universal_newlines=True)
+    if result.returncode != 0:
+        return (None, False)
+    status = subprocess.run(['git', '-C', source_dir, 'status', '--porcelain', '--', 'Source', 'Include',
+                             'CMakeLists.txt'], stdout=subprocess.PIPE, universal_newlines=True)
+    return (result.stdout.strip(), bool(status.stdout.strip()))
+
+
+def get_build_info(library):
+    """
+    Return (compiler, C flags) of the library, from the CMake cache of its build directory, or ('unknown', '') if
+    it was not built with CMake.
+    """
+    build_dir = os.path.dirname(os.path.dirname(os.path.abspath(library)))
+    try:
+        with open(os.path.join(build_dir, 'CMakeCache.txt')) as f:
+            cache = dict(re.findall(r'^(\w+):\w+=(.*)$', f.read(), re.MULTILINE))
+    except OSError:
+        return ('unknown', '')
+    compiler = cache.get('CMAKE_C_COMPILER', 'unknown')
+    for filepath in glob.glob(os.path.join(build_dir, 'CMakeFiles', '*', 'CMakeCCompiler.cmake')):
+        with open(filepath) as f:
+            text = f.read()
+        compiler_id = re.search(r'set\(CMAKE_C_COMPILER_ID "([^"]*)"\)', text)
+        version = re.search(r'set\(CMAKE_C_COMPILER_VERSION "([^"]*)"\)', text)
+        if compiler_id and version:
+            compiler = '{} {}'.format(compiler_id.group(1), version.group(1))
+    return (compiler, cache.get('CMAKE_C_FLAGS', '').strip())
+
+
+def format_throughput(throughput, unit):
+    for prefix, scale in (('G', 1e9), ('M', 1e6), ('k', 1e3)):
+        if throughput >= scale:
+            return "{:.2f} {}{}/s".format(throughput / scale, prefix, unit)
+    return "{:.2f} {}/s".format(throughput, unit)
+
+
+def run_benchmarks(host, benchmarks, args):
+    """
+    Run the benchmarks and print a line per benchmark. Returns the results of the benchmarks that could be run and
+    the number of benchmarks that failed, i.e. that could not be run or whose output is not the reference output.
+    """
+    results = []
+    failed = 0
+    # The random data of the benchmarks is written to a temporary directory, not to PregeneratedData.
+    pregenerated_data_dir = tempfile.mkdtemp()
+    generate_test_data.TestSettings.PREGEN = pregenerated_data_dir + '/'
+    width = max([len("Benchmark")] + [len(benchmark['name']) for benchmark in benchmarks])
+    print("{:<{}} {:>12} {:>8} {:>14} {:>12} {:>18} {:>12}".format("Benchmark", width, "Median (us)", "Stdev %",
+                                                                   "Overhead (us)", "Kernel (us)", "Throughput",
+                                                                   "Scratch (B)"))
+    try:
+        for benchmark in benchmarks:
+            try:
+                result = run_benchmark(host, benchmark, args)
+            except Exception:
+                failed += 1
+                print("ERROR: Benchmark {} failed:\n{}".format(benchmark['name'], traceback.format_exc()))
+                continue
+            results.append(result)
+            print("{:<{}} {:>12.3f} {:>8.2f} {:>14.3f} {:>12.3f} {:>18} {:>12}".format(
+                result['name'], width, result['median_ns'] / 1000, 100 * result['stdev_ns'] / result['mean_ns'],
+                result['overhead_ns'] / 1000, result['kernel_ns'] / 1000,
+                format_throughput(result['throughput'], result['unit']), result['scratch_size']))
+            if result['error']:
+                failed += 1
+                print("ERROR: Output of benchmark {} differs from the reference output: {}".format(
+                    result['name'], result['error']))
+    finally:
+        shutil.rmtree(pregenerated_data_dir, ignore_errors=True)
+    return (results, failed)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+
+    benchmarks = BenchmarkSets(BENCHMARK_SETS_FILE).select(args.testtype, args.filter)
+    if args.list:
+        for benchmark in benchmarks:
+            print("{:<64} {}".format(benchmark['name'], benchmark['kernel']))
+        sys.exit(0)
+
+    library = args.library
+    if args.build:
+        library = cmsis_nn_host.build_library(c_flags=args.c_flags)
+    host = cmsis_nn_host.CmsisNNHost(library)
+
+    cmsis_nn_host.init_generator(args.seed)
+    (results, failed) = run_benchmarks(host, benchmarks, args)
+
+    (revision, dirty) = get_revision()
+    (compiler, c_flags) = get_build_info(host.library._name)
+    report = {'revision': revision, 'dirty': dirty, 'date': datetime.datetime.now().isoformat(timespec='seconds'),
+              'library': host.library._name, 'compiler': compiler, 'c_flags': c_flags, 'machine': platform.machine(),
+              'processor': platform.processor(), 'python': platform.python_version(), 'numpy': np.__version__,
+              'seed': args.seed, 'repeat': args.repeat, 'min_time': args.min_time, 'benchmarks': results}
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print("Results of {} benchmarks written to {}".format(len(results), args.output))
+    if args.history:
+        run_id = benchmark_history.BenchmarkHistory(args.history).add(report)
+        print("Results added to {} as run {}".format(args.history, run_id))
+    if failed:
+        sys.exit(1)
@@ -0,0 +1,525 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2010-2022 Arm Limited or its affiliates.
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the License); you may
+# not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an AS IS BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import datetime
+import tempfile
+import collections
+import multiprocessing
+import concurrent.futures
+import numpy as np
+
+import generate_test_data
+import cmsis_nn_host
+
+FUZZ_FAILURES_FILE = 'fuzz_failures.json'
+
+# Wrapper kernels that are fuzzed, by test type, and the kernels they dispatch to.
+FUZZ_KERNELS = {
+    'conv': 'arm_convolve_wrapper_s8',
+    'depthwise_conv': 'arm_depthwise_conv_wrapper_s8',
+}
+FUZZ_PATHS = {
+    'conv': ['arm_convolve_1x1_s8_fast', 'arm_convolve_1_x_n_s8', 'arm_convolve_s8'],
+    'depthwise_conv': ['arm_depthwise_conv_3x3_s8', 'arm_depthwise_conv_s8_opt', 'arm_depthwise_conv_s8'],
+}
+
+# Number of cases a worker runs per task.
+CHUNK_SIZE = 50
+
+# Parameters of a case in the order they are shrunk, with their minimum.
+SHRINK_PARAMS = [('batches', 1), ('in_ch', 1), ('out_ch', 1), ('y_in', 1), ('x_in', 1), ('w_y', 1), ('w_x', 1),
+                 ('stride_y', 1), ('stride_x', 1), ('dilation_y', 1), ('dilation_x', 1)]
+
+# Maximum number of cases run to shrink a failing case.
+MAX_SHRINK_CASES = 300
+
+# Every this many cases, the kernel that the wrapper dispatches to is checked, see check_path().
+PATH_CHECK_INTERVAL = 10
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Differential fuzzing of the convolution wrappers of a host build of"
+                                     " the library against the reference, see cmsis_nn_host.py. Failing cases are"
+                                     " shrunk and written out as test sets of testdata_sets.json.")
+    parser.add_argument('--library', type=str, default=None, help="Path of the library, see cmsis_nn_host.py.")
+    parser.add_argument('--build', action='store_true', help="Build the library in {} first.".format(
+        cmsis_nn_host.HOST_BUILD_DIR))
+    parser.add_argument('-t', '--testtype', type=str, default=None, choices=list(FUZZ_KERNELS),
+                        help="Only fuzz the wrapper of this type of test.")
+    parser.add_argument('--jobs', type=int, default=os.cpu_count() or 1, help="Number of worker processes.")
+    parser.add_argument('--duration', type=float, default=0, help="Stop after this many seconds. By default the"
+                        " fuzzing runs until it is interrupted, or until --cases or --max-failures is reached.")
+    parser.add_argument('--cases', type=int, default=0, help="Stop after about this many cases.")
+    parser.add_argument('--max-failures', type=int, default=10, help="Stop after this many distinct failures.")
+    parser.add_argument('--seed', type=int, default=0, help="Seed of the random cases. The data of a case is"
+                        " generated with the default seed of generate_test_data.py, so that a failure written out"
+                        " is reproduced by generating it.")
+    parser.add_argument('--failures', type=str, default=FUZZ_FAILURES_FILE, help="File the shrunk failing cases are"
+                        " added to, in the format of testdata_sets.json.")
+    parser.add_argument('--report-interval', type=float, default=60, help="Seconds between progress reports.")
+    return parser.parse_args()
+
+
+def get_path(data):
+    """
+    Kernel that the wrapper of the test type dispatches the test set to, the same as arm_convolve_wrapper_s8() and
+    arm_depthwise_conv_wrapper_s8() do in a build without ARM_MATH_MVEI.
+    """
+    no_dilation = data['DILATION_X'] == 1 and data['DILATION_Y'] == 1
+    if data.test_type == 'conv':
+        if data['PAD_X'] == 0 and data['PAD_Y'] == 0 and data['IN_CH'] % 4 == 0 and data['STRIDE_X'] == 1 and \
+           data['STRIDE_Y'] == 1 and data['FILTER_X'] == 1 and data['FILTER_Y'] == 1 and no_dilation:
+            return 'arm_convolve_1x1_s8_fast'
+        if data['OUTPUT_H'] == 1 and data['INPUT_H'] == 1 and data['FILTER_Y'] == 1 and data['OUTPUT_W'] % 4 == 0 \
+           and data['INPUT_BATCHES'] == 1 and no_dilation:
+            return 'arm_convolve_1_x_n_s8'
+        return 'arm_convolve_s8'
+    if data['CH_MULT'] == 1 and data['INPUT_BATCHES'] == 1 and no_dilation:
+        if data['FILTER_X'] == 3 and data['FILTER_Y'] == 3 and data['PAD_X'] <= 1 and data['PAD_Y'] <= 1:
+            return 'arm_depthwise_conv_3x3_s8'
+        return 'arm_depthwise_conv_s8_opt'
+    return 'arm_depthwise_conv_s8'
+
+
+def is_valid(test_type, params):
+    """
+    Whether the parameters are a valid test set of the test type, i.e. whether the dilated filter fits in the input
+    and the output channels of a depthwise convolution are a multiple of its input channels.
+    """
+    if any(params[name] < minimum for name, minimum in SHRINK_PARAMS):
+        return False
+    if params['x_in'] < (params['w_x'] - 1) * params['dilation_x'] + 1 or \
+       params['y_in'] < (params['w_y'] - 1) * params['dilation_y'] + 1:
+        return False
+    if test_type == 'depthwise_conv' and params['out_ch'] % params['in_ch'] != 0:
+        return False
+    return params.get('out_activation_min', 0) <= params.get('out_activation_max', 0)
+
+
+def get_fuzz_params(test_type, rng):
+    """
+    Random parameters of a valid test set of the test type. The parameters are first drawn from the whole parameter
+    space and then, for most cases, restricted to those of one of the kernels that the wrapper dispatches to, so
+    that the optimized kernels are covered as well as the generic one.
+    """
+    def randint(low, high):
+        return int(rng.integers(low, high + 1))
+
+    params = {'batches': randint(1, 3), 'in_ch': randint(1, 17), 'stride_x': randint(1, 3), 'stride_y': randint(1, 3),
+              'dilation_x': randint(1, 3), 'dilation_y': randint(1, 3), 'w_x': randint(1, 5), 'w_y': randint(1, 5),
+              'pad': bool(rng.integers(2)), 'generate_bias': bool(rng.integers(2))}
+    params['out_ch'] = params['in_ch'] * randint(1, 3) if test_type == 'depthwise_conv' else randint(1, 17)
+    if rng.integers(2):
+        params['out_activation_min'] = randint(generate_test_data.INT8_MIN, generate_test_data.INT8_MAX)
+        params['out_activation_max'] = randint(params['out_activation_min'], generate_test_data.INT8_MAX)
+
+    path = FUZZ_PATHS[test_type][randint(0, len(FUZZ_PATHS[test_type]) - 1)] if rng.integers(4) else None
+    if path in ('arm_convolve_1x1_s8_fast', 'arm_convolve_1_x_n_s8', 'arm_depthwise_conv_3x3_s8',
+                'arm_depthwise_conv_s8_opt'):
+        params.update({'dilation_x': 1, 'dilation_y': 1})
+    if path == 'arm_convolve_1x1_s8_fast':
+        params.update({'in_ch': 4 * randint(1, 5), 'w_x': 1, 'w_y': 1, 'stride_x': 1, 'stride_y': 1, 'pad': False})
+    elif path == 'arm_convolve_1_x_n_s8':
+        params.update({'batches': 1, 'y_in': 1, 'w_y': 1})
+        # The output width must be a multiple of 4.
+        output_w = 4 * randint(1, 4)
+        if params['pad']:
+            params['x_in'] = randint((output_w - 1) * params['stride_x'] + 1, output_w * params['stride_x'])
+            params['w_x'] = randint(1, min(params['x_in'], 7))
+        else:
+            params['w_x'] = randint(1, 7)
+            params['x_in'] = (output_w - 1) * params['stride_x'] + params['w_x'] + randint(0, params['stride_x'] - 1)
+    elif path in ('arm_depthwise_conv_3x3_s8', 'arm_depthwise_conv_s8_opt'):
+        params.update({'batches': 1, 'out_ch': params['in_ch']})
+        if path == 'arm_depthwise_conv_3x3_s8':
+            params.update({'w_x': 3, 'w_y': 3})
+    params.setdefault('x_in', randint((params['w_x'] - 1) * params['dilation_x'] + 1,
+                                      (params['w_x'] - 1) * params['dilation_x'] + 12))
+    params.setdefault('y_in', randint((params['w_y'] - 1) * params['dilation_y'] + 1,
+                                      (params['w_y'] - 1) * params['dilation_y'] + 12))
+    return params
+
+
+def init_worker(library, pregenerated_data_dir):
+    """
+    Initializer of the worker processes, which each load the library and generate test sets in memory, with their
+    random data in their own directory.
+    """
+    global host, case_file
+    host = cmsis_nn_host.CmsisNNHost(library)
+    cmsis_nn_host.init_generator(0)
+    generate_test_data.TestSettings.PREGEN = os.path.join(pregenerated_data_dir, str(os.getpid())) + '/'
+    # The case the worker is running, to find the case that crashed a worker.
+    case_file = os.path.join(pregenerated_data_dir, '{}.json'.format(os.getpid()))
+
+
+def generate_case(test_type, params, name):
+    """
+    Generate the test set of a case in memory. Raises an exception if it can not be generated.
+    """
+    # Replaced at once, as the worker may be terminated while writing it when another worker crashes.
+    with open(case_file + '.tmp', 'w') as f:
+        json.dump({'name': name, 'type': test_type, 'params': params}, f)
+    os.replace(case_file + '.tmp', case_file)
+    settings = generate_test_data.SETTINGS_CLASSES[test_type](name, test_type, generate_test_data.args, **params)
+    try:
+        return cmsis_nn_host.generate_testset(settings)
+    finally:
+        shutil.rmtree(os.path.join(generate_test_data.TestSettings.PREGEN, name), ignore_errors=True)
+
+
+def run_case(test_type, params, name):
+    """
+    Generate a test set and run the wrapper on it. Returns (path, error), where path is the kernel the wrapper
+    dispatches to and error is None if the output is the reference output. Raises an exception if the test set can
+    not be generated.
+    """
+    data = generate_case(test_type, params, name)
+    (error, seconds) = cmsis_nn_host.check_testset(host, data, FUZZ_KERNELS[test_type])
+    return (get_path(data), error)
+
+
+def check_path(data, path):
+    """
+    Check that get_path() is the kernel that the wrapper dispatched a passing test set to, by running that kernel
+    directly. Its output must be identical to the output of the wrapper, i.e. the reference output, which catches
+    get_path() being out of date with the dispatch of the wrapper in C, as far as the kernels differ on the test set.
+    """
+    try:
+        error = cmsis_nn_host.compare_output(data, host.run(data, path))
+    except RuntimeError as e:
+        error = str(e)
+    if error:
+        raise RuntimeError("The output of {} differs from the output of {} for test set {}, get_path() does not match "
+                           "the dispatch of the wrapper: {}".format(path, FUZZ_KERNELS[data.test_type], data.name,
+                                                                    error))
+
+
+def get_output_size(input_size, stride, filter_size, dilation, pad):
+    """
+    Output size along one dimension, see TestSettings.get_output_dims().
+    """
+    if pad:
+        return -(-input_size // stride)
+    return -(-(input_size - (filter_size - 1) * dilation) // stride)
+
+
+def get_input_size(output_size, stride, filter_size, dilation, pad):
+    """
+    Smallest valid input size along one dimension with the given output size, or a larger output size if the dilated
+    filter does not fit in it.
+    """
+    dilated_filter_size = (filter_size - 1) * dilation + 1
+    if pad:
+        return max((output_size - 1) * stride + 1, dilated_filter_size)
+    return (output_size - 1) * stride + dilated_filter_size
+
+
+def get_size(params):
+    """
+    Size of the parameters of a case, which a shrunk case is smaller in.
+    """
+    return sum(params[name] for name, minimum in SHRINK_PARAMS) + params['pad'] + params['generate_bias'] + \
+        ('out_activation_min' in params)
+
+
+def get_shrink_candidates(test_type, params):
+    """
+    Smaller variants of the parameters of a case, the smallest first. Besides changing one parameter, the input size
+    is shrunk together with the stride, filter size and dilation, to the output size or to a smaller one in steps that
+    keep it a multiple of 4, so that the kernels that depend on them are kept.
+    """
+    candidates = []
+    for name, minimum in SHRINK_PARAMS:
+        value = params[name]
+        for smaller in {minimum, 4, value - 4, (value + minimum) // 2, value - 1}:
+            if minimum <= smaller < value:
+                candidate = dict(params, **{name: smaller})
+                if test_type == 'depthwise_conv' and name == 'in_ch':
+                    # Keep the channel multiplier.
+                    candidate['out_ch'] = smaller * (params['out_ch'] // params['in_ch'])
+                candidates.append(candidate)
+    if test_type == 'depthwise_conv':
+        for ch_mult in range(1, params['out_ch'] // params['in_ch']):
+            candidates.append(dict(params, out_ch=params['in_ch'] * ch_mult))
+    for (size, filter_size, stride, dilation) in (('x_in', 'w_x', 'stride_x', 'dilation_x'),
+                                                  ('y_in', 'w_y', 'stride_y', 'dilation_y')):
+        output_size = get_output_size(params[size], params[stride], params[filter_size], params[dilation],
+                                      params['pad'])
+        for change in ({}, {stride: 1}, {dilation: 1}, {filter_size: 1}, {filter_size: params[filter_size] - 1},
+                       {stride: 1, dilation: 1, filter_size: 1}):
+            for smaller in {output_size, 1, 4, output_size - 4, output_size // 2, output_size - 1}:
+                if 1 <= smaller <= output_size:
+                    candidate = dict(params, **change)
+                    candidate[size] = get_input_size(smaller, candidate[stride], candidate[filter_size],
+                                                     candidate[dilation], candidate['pad'])
+                    candidates.append(candidate)
+    for name in ('pad', 'generate_bias'):
+        if params[name]:
+            candidates.append(dict(params, **{name: False}))
+    if 'out_activation_min' in params:
+        candidates.append({key: value for key, value in params.items()
+                           if key not in ('out_activation_min', 'out_activation_max')})
+    candidates = [candidate for candidate in candidates
+                  if is_valid(test_type, candidate) and get_size(candidate) < get_size(params)]
+    unique = {json.dumps(candidate, sort_keys=True): candidate for candidate in candidates}
+    return sorted(unique.values(), key=get_size)
+
+
+def shrink(test_type, params, name, path):
+    """
+    Greedily shrink a failing case to a case that still fails in the same kernel, taking the smallest variant that
+    fails until none does. The case keeps its name, so that its data is generated the same when it is added to
+    testdata_sets.json.
+    """
+    runs = 0
+    shrunk = True
+    while shrunk and runs < MAX_SHRINK_CASES:
+        shrunk = False
+        for candidate in get_shrink_candidates(test_type, params):
+            runs += 1
+            try:
+                (candidate_path, error) = run_case(test_type, candidate, name)
+            except Exception:
+                continue
+            if error and candidate_path == path:
+                params = candidate
+                shrunk = True
+                break
+            if runs >= MAX_SHRINK_CASES:
+                break
+    return params
+
+
+def fuzz_chunk(seed, chunk, test_types):
+    """
+    Run a chunk of CHUNK_SIZE random cases in a worker. Returns the cases that could not be generated, the number
+    of cases per kernel the wrappers dispatched to, and the failures, which are shrunk separately. The kernel of
+    every PATH_CHECK_INTERVAL-th passing case is checked with check_path().
+    """
+    rng = np.random.default_rng([seed, chunk])
+    paths = collections.Counter()
+    skipped = []
+    failures = []
+    for index in range(chunk * CHUNK_SIZE, (chunk + 1) * CHUNK_SIZE):
+        test_type = test_types[int(rng.integers(len(test_types)))]
+        params = get_fuzz_params(test_type, rng)
+        name = 'fuzz_{}_{}_{}'.format(test_type, seed, index)
+        try:
+            data = generate_case(test_type, params, name)
+        except Exception as e:
+            skipped.append((name, test_type, params, repr(e)))
+            continue
+        path = get_path(data)
+        (error, seconds) = cmsis_nn_host.check_testset(host, data, FUZZ_KERNELS[test_type])
+        paths[path] += 1
+        if error:
+            failures.append({'name': name, 'type': test_type, 'path': path, 'error': error, 'params': params})
+        elif index % PATH_CHECK_INTERVAL == 0:
+            check_path(data, path)
+    return {'skipped': skipped, 'paths': paths, 'failures': failures}
+
+
+def create_executor(library, pregenerated_data_dir, jobs):
+    # Spawned, so that no TensorFlow state is inherited from this process.
+    return concurrent.futures.ProcessPoolExecutor(max_workers=jobs, mp_context=multiprocessing.get_context('spawn'),
+                                                  initializer=init_worker,
+                                                  initargs=(library, pregenerated_data_dir))
+
+
+def find_crashes(library, pregenerated_data_dir):
+    """
+    After a worker crashed, e.g. on a segmentation fault in a kernel, run the cases that the workers were running
+    again, each in a worker of its own, and return the cases that crash it as failures. They are not shrunk.
+    """
+    cases = []
+    for filename in os.listdir(pregenerated_data_dir):
+        if filename.endswith('.json'):
+            with open(os.path.join(pregenerated_data_dir, filename)) as f:
+                cases.append(json.load(f))
+        if filename.endswith(('.json', '.tmp')):
+            os.remove(os.path.join(pregenerated_data_dir, filename))
+    crashes = []
+    for case in cases:
+        with create_executor(library, pregenerated_data_dir, 1) as executor:
+            try:
+                executor.submit(run_case, case['type'], case['params'], case['name']).result()
+            except concurrent.futures.process.BrokenProcessPool:
+                crashes.append({'name': case['name'], 'type': case['type'], 'path': FUZZ_KERNELS[case['type']],
+                                'error': "The worker crashed", 'params': case['params'], 'shrunk': case['params']})
+            except Exception:
+                pass
+    return crashes
+
+
+def get_failure_key(failure):
+    """
+    Key of a failure that failures of the same bug are likely to share, i.e. the kernel and the shrunk shape, without
+    the activation range and bias.
+    """
+    shape = {name: value for name, value in failure['shrunk'].items()
+             if name not in ('out_activation_min', 'out_activation_max', 'generate_bias')}
+    return (failure['path'], json.dumps(shape, sort_keys=True))
+
+
+def write_failures(filepath, failures):
+    """
+    Add the shrunk failing cases to a file in the format of testdata_sets.json, skipping cases that are in it
+    already. Returns the number of cases that were added.
+    """
+    testsets = {}
+    if os.path.exists(filepath):
+        with open(filepath) as f:
+            testsets = json.load(f)
+    added = 0
+    for failure in failures:
+        spec = dict({'type': failure['type']}, **failure['shrunk'])
+        if spec not in testsets.values():
+            testsets[failure['name']] = spec
+            added += 1
+    with open(filepath, 'w') as f:
+        f.write('{\n' + ',\n'.join('    "{}": {}'.format(name, json.dumps(spec)) for name, spec in testsets.items()) +
+                '\n}\n')
+    return added
+
+
+def print_progress(test_types, start, stats):
+    seconds = time.monotonic() - start
+    cases = sum(stats['paths'].values())
+    coverage = ', '.join('{} {:.1f}%'.format(path, 100 * stats['paths'][path] / max(cases, 1))
+                         for test_type in test_types for path in FUZZ_PATHS[test_type])
+    print("{} {} cases, {:.1f} cases/s, {} failures of {} failing cases, {} skipped; {}".format(
+        datetime.timedelta(seconds=int(seconds)), cases, cases / seconds, len(stats['failures']),
+        stats['failing_cases'], len(stats['skipped']), coverage), flush=True)
+
+
+def fuzz(library, test_types, args):
+    """
+    Run random cases in a process pool until a stop condition of args is reached or the fuzzing is interrupted, and
+    write out the failures. Failing cases are shrunk in tasks of their own in the same pool, at most as many at a time
+    as there are failures left until --max-failures, and the shrunk cases of the same key are written once. Returns
+    the number of distinct failures.
+    """
+    start = time.monotonic()
+    stats = {'paths': collections.Counter(), 'skipped': [], 'failures': [], 'failing_cases': 0}
+    keys = set()
+    pregenerated_data_dir = tempfile.mkdtemp()
+    executor = create_executor(library, pregenerated_data_dir, args.jobs)
+    chunks = set()
+    # Futures of the failures being shrunk, and the failures waiting to be shrunk.
+    shrinking = {}
+    unshrunk = collections.deque()
+    chunk = 0
+    last_report = start
+
+    def add_failure(failure):
+        key = get_failure_key(failure)
+        if key in keys or len(stats['failures']) >= args.max_failures:
+            return
+        keys.add(key)
+        stats['failures'].append(failure)
+        print("ERROR: Case {} failed in {}:\n{}\n{}\nShrunk to {}".format(
+            failure['name'], failure['path'], failure['error'],
+            json.dumps(dict(type=failure['type'], **failure['params'])),
+            json.dumps(dict(type=failure['type'], **failure['shrunk']))), flush=True)
+        write_failures(args.failures, [failure])
+
+    try:
+        while True:
+            remaining = args.max_failures - len(stats['failures'])
+            stop = remaining <= 0 or (args.duration and time.monotonic() - start >= args.duration) or \
+                (args.cases and (sum(stats['paths'].values()) + len(stats['skipped']) + len(chunks) * CHUNK_SIZE
+                                 >= args.cases))
+            # A few chunks per worker are kept queued, so that the workers do not wait.
+            while not stop and len(chunks) < 2 * args.jobs:
+                chunks.add(executor.submit(fuzz_chunk, args.seed, chunk, test_types))
+                chunk += 1
+            while remaining > 0 and unshrunk and len(shrinking) < remaining:
+                failure = unshrunk.popleft()
+                shrinking[executor.submit(shrink, failure['type'], failure['params'], failure['name'],
+                                          failure['path'])] = failure
+            if remaining <= 0 or not (chunks or shrinking):
+                break
+            (done, _) = concurrent.futures.wait(
+                chunks | set(shrinking), timeout=max(last_report + args.report_interval - time.monotonic(), 0),
+                return_when=concurrent.futures.FIRST_COMPLETED)
+            try:
+                for future in done:
+                    if future in shrinking:
+                        shrunk = future.result()
+                        add_failure(dict(shrinking.pop(future), shrunk=shrunk))
+                        continue
+                    chunks.remove(future)
+                    result = future.result()
+                    stats['paths'].update(result['paths'])
+                    for (name, test_type, params, error) in result['skipped']:
+                        if not stats['skipped']:
+                            print("WARNING: Case {} could not be generated, cases that can not be generated are "
+                                  "skipped: {}\n{}".format(name, error, json.dumps(dict(type=test_type, **params))))
+                        stats['skipped'].append(name)
+                    stats['failing_cases'] += len(result['failures'])
+                    # Failing cases beyond those that can still be added are dropped, they are most likely of the
+                    # same bug.
+                    unshrunk.extend(result['failures'][:max(args.max_failures - len(unshrunk), 0)])
+            except concurrent.futures.process.BrokenProcessPool:
+                # The chunks that were queued are lost, the fuzzing goes on with a new pool. The failures being
+                # shrunk are added as they are, as shrinking them may have crashed the worker.
+                print("ERROR: A worker crashed, running the cases of the workers again to find the case")
+                executor.shutdown(wait=True)
+                chunks.clear()
+                for failure in shrinking.values():
+                    add_failure(dict(failure, shrunk=failure['params']))
+                shrinking.clear()
+                for failure in find_crashes(library, pregenerated_data_dir):
+                    add_failure(failure)
+                executor = create_executor(library, pregenerated_data_dir, args.jobs)
+            if time.monotonic() - last_report >= args.report_interval:
+                last_report = time.monotonic()
+                print_progress(test_types, start, stats)
+    except KeyboardInterrupt:
+        print("Interrupted, the failing cases that were not shrunk yet are added as they are")
+        for failure in list(shrinking.values()) + list(unshrunk):
+            add_failure(dict(failure, shrunk=failure['params']))
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+        shutil.rmtree(pregenerated_data_dir, ignore_errors=True)
+
+    print_progress(test_types, start, stats)
+    if stats['failures']:
+        print("{} failing cases written to {}".format(len(stats['failures']), args.failures))
+    return len(stats['failures'])
+
+
+if __name__ == '__main__':
+    args = parse_args()
+
+    library = args.library
+    if args.build:
+        library = cmsis_nn_host.build_library()
+    # Checked here, before the workers load it.
+    library = cmsis_nn_host.CmsisNNHost(library).library._name
+
+    test_types = [args.testtype] if args.testtype else list(FUZZ_KERNELS)
+    if fuzz(library, test_types, args):
+        sys.exit(1)
@@ -0,0 +1,745 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2010-2022 Arm Limited or its affiliates.
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the License); you may
+# not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an AS IS BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import io
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import ctypes
+import argparse
+import tempfile
+import traceback
+import subprocess
+import contextlib
+import numpy as np
+
+import generate_test_data
+from generate_test_data import INT16_MAX, INT16_MIN
+
+# Build directory of build_library(), the library is built as Source/libcmsis-nn.so in it.
+HOST_BUILD_DIR = 'Output/host'
+HOST_LIBRARY = 'Source/libcmsis-nn.so'
+
+# Environment variable with the path of the library, if it is not given with --library.
+HOST_LIBRARY_ENV = 'CMSIS_NN_HOST_LIBRARY'
+
+# Test types that have a NumPy reference, see generate_test_data.py --backend.
+NUMPY_TEST_TYPES = ['conv', 'depthwise_conv', 'fully_connected', 'avgpool', 'maxpool', 'softmax', 'svdf']
+
+STATUS = {0: 'ARM_CMSIS_NN_SUCCESS', -1: 'ARM_CMSIS_NN_ARG_ERROR', -2: 'ARM_CMSIS_NN_NO_IMPL_ERROR'}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Run the CMSIS-NN kernels of a host build of the library on test"
+                                     " sets and compare their output with the reference output.")
+    parser.add_argument('--library', type=str, default=None, help="Path of the library, built with"
+                        " -DBUILD_CMSIS_NN_HOST_LIBRARY=ON. By default ${} or {}.".format(
+                            HOST_LIBRARY_ENV, os.path.join(HOST_BUILD_DIR, HOST_LIBRARY)))
+    parser.add_argument('--build', action='store_true', help="Build the library in {} first.".format(HOST_BUILD_DIR))
+    parser.add_argument('--dataset', type=str, default=None, help="Name of the test set to run.")
+    parser.add_argument('--run-all-testsets', action='store_true', help="Run all test sets, or only those of the "
+                        "type given by -t.")
+    parser.add_argument('-t', '--testtype', type=str, default=None, choices=list(generate_test_data.SETTINGS_CLASSES),
+                        help='Type of test.')
+    parser.add_argument('--stress', action='store_true', help="Include the stress test sets in --run-all-testsets.")
+    parser.add_argument('--generate', action='store_true', help="Generate the test sets in memory from their"
+                        " pregenerated data, with the NumPy backend where there is one, instead of loading them from"
+                        " TestCases/TestData.")
+    parser.add_argument('--random', type=int, default=0, metavar='N', help="Run N test sets of random shapes and"
+                        " data, of the type given by -t or of all types with a NumPy reference, generated in memory.")
+    parser.add_argument('--seed', type=int, default=0, help="Seed of the random shapes and data.")
+    parser.add_argument('--kernel', type=str, default=None, help="Kernel to run instead of the one the unit tests"
+                        " use for the test type, e.g. arm_convolve_1x1_s8_fast.")
+    return parser.parse_args()
+
+
+class Tile(ctypes.Structure):
+    _fields_ = [('w', ctypes.c_int32), ('h', ctypes.c_int32)]
+
+
+class Context(ctypes.Structure):
+    _fields_ = [('buf', ctypes.c_void_p), ('size', ctypes.c_int32)]
+
+
+class Dims(ctypes.Structure):
+    _fields_ = [('n', ctypes.c_int32), ('h', ctypes.c_int32), ('w', ctypes.c_int32), ('c', ctypes.c_int32)]
+
+
+class PerChannelQuantParams(ctypes.Structure):
+    _fields_ = [('multiplier', ctypes.POINTER(ctypes.c_int32)), ('shift', ctypes.POINTER(ctypes.c_int32))]
+
+
+class PerTensorQuantParams(ctypes.Structure):
+    _fields_ = [('multiplier', ctypes.c_int32), ('shift', ctypes.c_int32)]
+
+
+class Activation(ctypes.Structure):
+    _fields_ = [('min', ctypes.c_int32), ('max', ctypes.c_int32)]
+
+
+class ConvParams(ctypes.Structure):
+    _fields_ = [('input_offset', ctypes.c_int32), ('output_offset', ctypes.c_int32), ('stride', Tile),
+                ('padding', Tile), ('dilation', Tile), ('activation', Activation)]
+
+
+class DwConvParams(ctypes.Structure):
+    _fields_ = [('input_offset', ctypes.c_int32), ('output_offset', ctypes.c_int32), ('ch_mult', ctypes.c_int32),
+                ('stride', Tile), ('padding', Tile), ('dilation', Tile), ('activation', Activation)]
+
+
+class PoolParams(ctypes.Structure):
+    _fields_ = [('stride', Tile), ('padding', Tile), ('activation', Activation)]
+
+
+class FcParams(ctypes.Structure):
+    _fields_ = [('input_offset', ctypes.c_int32), ('filter_offset', ctypes.c_int32),
+                ('output_offset', ctypes.c_int32), ('activation', Activation)]
+
+
+class SvdfParams(ctypes.Structure):
+    _fields_ = [('rank', ctypes.c_int32), ('input_offset', ctypes.c_int32), ('output_offset', ctypes.c_int32),
+                ('input_activation', Activation), ('output_activation', Activation)]
+
+
+class SoftmaxLutS16(ctypes.Structure):
+    _fields_ = [('exp_lut', ctypes.POINTER(ctypes.c_int16)), ('one_by_one_lut', ctypes.POINTER(ctypes.c_int16))]
+
+
+def get_conv_prototype(params):
+    return (ctypes.c_int32, [ctypes.POINTER(Context), ctypes.POINTER(params), ctypes.POINTER(PerChannelQuantParams),
+                             ctypes.POINTER(Dims), ctypes.c_void_p, ctypes.POINTER(Dims), ctypes.c_void_p,
+                             ctypes.POINTER(Dims), ctypes.c_void_p, ctypes.POINTER(Dims), ctypes.c_void_p])
+
+
+CONV_KERNELS = ['arm_convolve_wrapper_s8', 'arm_convolve_s8', 'arm_convolve_1x1_s8_fast', 'arm_convolve_1_x_n_s8',
+                'arm_convolve_wrapper_s16', 'arm_convolve_s16', 'arm_convolve_fast_s16']
+DW_CONV_KERNELS = ['arm_depthwise_conv_wrapper_s8', 'arm_depthwise_conv_s8', 'arm_depthwise_conv_s8_opt',
+                   'arm_depthwise_conv_3x3_s8', 'arm_depthwise_conv_wrapper_s16', 'arm_depthwise_conv_s16',
+                   'arm_depthwise_conv_fast_s16']
+FC_KERNELS = ['arm_fully_connected_s8', 'arm_fully_connected_s16']
+POOL_KERNELS = ['arm_avgpool_s8', 'arm_avgpool_s16', 'arm_max_pool_s8', 'arm_max_pool_s16']
+
+# Arguments of the function returning the size of the scratch buffer of a kernel, which is named as the kernel with
+# _get_buffer_size appended. Kernels that are not listed need no buffer.
+BUFFER_SIZE_ARGUMENTS = {
+    'arm_convolve_wrapper_s8': ('params', 'input_dims', 'filter_dims', 'output_dims'),
+    'arm_convolve_wrapper_s16': ('params', 'input_dims', 'filter_dims', 'output_dims'),
+    'arm_depthwise_conv_wrapper_s8': ('params', 'input_dims', 'filter_dims', 'output_dims'),
+    'arm_depthwise_conv_wrapper_s16': ('params', 'input_dims', 'filter_dims', 'output_dims'),
+    'arm_convolve_s8': ('input_dims', 'filter_dims'),
+    'arm_convolve_1_x_n_s8': ('input_dims', 'filter_dims'),
+    'arm_convolve_s16': ('input_dims', 'filter_dims'),
+    'arm_convolve_fast_s16': ('input_dims', 'filter_dims'),
+    'arm_depthwise_conv_s8_opt': ('input_dims', 'filter_dims'),
+    'arm_depthwise_conv_fast_s16': ('input_dims', 'filter_dims'),
+    'arm_convolve_1x1_s8_fast': ('input_dims', ),
+    'arm_fully_connected_s8': ('filter_dims', ),
+    'arm_fully_connected_s16': ('filter_dims', ),
+    'arm_avgpool_s8': ('output_w', 'in_ch'),
+    'arm_avgpool_s16': ('output_w', 'in_ch'),
+}
+
+# Kernels that take NULL for no bias, other than SVDF. The wrappers and the optimized depthwise convolutions read
+# the bias unconditionally.
+OPTIONAL_BIAS_KERNELS = ['arm_depthwise_conv_s8', 'arm_depthwise_conv_s16']
+
+# Return and argument types of the functions of the library that are used, by name.
+PROTOTYPES = {}
+PROTOTYPES.update({kernel: get_conv_prototype(ConvParams) for kernel in CONV_KERNELS})
+PROTOTYPES.update({kernel: get_conv_prototype(DwConvParams) for kernel in DW_CONV_KERNELS})
+PROTOTYPES.update({kernel: (ctypes.c_int32, [ctypes.POINTER(Context), ctypes.POINTER(FcParams),
+                                             ctypes.POINTER(PerTensorQuantParams), ctypes.POINTER(Dims),
+                                             ctypes.c_void_p, ctypes.POINTER(Dims), ctypes.c_void_p,
+                                             ctypes.POINTER(Dims), ctypes.c_void_p, ctypes.POINTER(Dims),
+                                             ctypes.c_void_p])
+                   for kernel in FC_KERNELS})
+PROTOTYPES.update({kernel: (ctypes.c_int32, [ctypes.POINTER(Context), ctypes.POINTER(PoolParams),
+                                             ctypes.POINTER(Dims), ctypes.c_void_p, ctypes.POINTER(Dims),
+                                             ctypes.POINTER(Dims), ctypes.c_void_p])
+                   for kernel in POOL_KERNELS})
+PROTOTYPES.update({kernel: (None, [ctypes.c_void_p] + [ctypes.c_int32] * 5 + [ctypes.c_void_p])
+                   for kernel in ['arm_softmax_s8', 'arm_softmax_s8_s16']})
+PROTOTYPES['arm_softmax_s16'] = (ctypes.c_int32, [ctypes.c_void_p] + [ctypes.c_int32] * 4 +
+                                 [ctypes.POINTER(SoftmaxLutS16), ctypes.c_void_p])
+PROTOTYPES['arm_svdf_state_s16_s8'] = (ctypes.c_int32, [ctypes.POINTER(Context), ctypes.POINTER(Context),
+                                                        ctypes.POINTER(SvdfParams),
+                                                        ctypes.POINTER(PerTensorQuantParams),
+                                                        ctypes.POINTER(PerTensorQuantParams)] +
+                                       [ctypes.POINTER(Dims), ctypes.c_void_p] * 6)
+PROTOTYPES.update({kernel: (ctypes.c_int32, [ctypes.c_void_p, ctypes.c_void_p] + [ctypes.c_int32] * 7 +
+                            [ctypes.c_void_p] + [ctypes.c_int32] * 6)
+                   for kernel in ['arm_elementwise_add_s8', 'arm_elementwise_add_s16']})
+PROTOTYPES.update({kernel: (ctypes.c_int32, [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_int32, ctypes.c_int32,
+                                             ctypes.c_void_p] + [ctypes.c_int32] * 6)
+                   for kernel in ['arm_elementwise_mul_s8', 'arm_elementwise_mul_s16']})
+for kernel, arguments in BUFFER_SIZE_ARGUMENTS.items():
+    params = DwConvParams if kernel in DW_CONV_KERNELS else ConvParams
+    PROTOTYPES[kernel + '_get_buffer_size'] = (ctypes.c_int32, [ctypes.c_int32 if argument in ('output_w', 'in_ch')
+                                                                else ctypes.POINTER(params) if argument == 'params'
+                                                                else ctypes.POINTER(Dims) for argument in arguments])
+
+
+def build_library(build_dir=HOST_BUILD_DIR, c_flags=''):
+    """
+    Build the library for the host with CMake and return its path. c_flags are added to the compiler flags, e.g.
+    -DARM_MATH_LOOPUNROLL. The CMSIS-DSP and CMSIS-Core headers are taken from the CMSIS_5 tree that CMSIS-NN is
+    in, the same as for the unit tests.
+    """
+    source_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..')
+    commands = [['cmake', '-S', source_dir, '-B', build_dir, '-DBUILD_CMSIS_NN_HOST_LIBRARY=ON',
+                 '-DCMAKE_C_FLAGS={}'.format(c_flags)],
+                ['cmake', '--build', build_dir, '--parallel', str(os.cpu_count() or 1)]]
+    for command in commands:
+        if subprocess.run(command).returncode != 0:
+            raise RuntimeError("Building the host library failed: {}".format(' '.join(command)))
+    return os.path.join(build_dir, HOST_LIBRARY)
+
+
+def get_dtype(datatype):
+    """
+    NumPy type of a C type of the generated arrays.
+    """
+    return np.dtype(generate_test_data.BINARY_DATA_TYPES[datatype])
+
+
+def get_pointer(array, ctype=None):
+    """
+    Pointer to the data of a C contiguous array, or NULL if it is None. The data is not copied, so the array must be
+    kept alive while the pointer is used.
+    """
+    if array is None:
+        return None
+    if not array.flags['C_CONTIGUOUS']:
+        raise RuntimeError("Array passed to a kernel must be C contiguous")
+    if ctype is None:
+        return array.ctypes.data
+    return array.ctypes.data_as(ctypes.POINTER(ctype))
+
+
+def get_bias(biases):
+    """
+    Bias data as passed by the unit tests to the kernels that take an optional bias, see OPTIONAL_BIAS_KERNELS, which
+    is NULL if it is all zero.
+    """
+    return biases if np.any(biases) else None
+
+
+class TestData:
+    """
+    A generated test set, with the values defined in its config_data.h, by name without the prefix of the test set,
+    and its arrays by name, e.g. input and output_ref, with the NumPy type of their C type.
+    """
+
+    def __init__(self, name, test_type, config, arrays):
+        self.name = name
+        self.test_type = test_type
+        self.config = config
+        self.arrays = arrays
+
+    def __getitem__(self, name):
+        return self.config[name]
+
+
+def parse_config(text, prefix):
+    return {name: int(value) for name, value in re.findall(r'#define {}_(\w+) (-?\d+)'.format(prefix), text)}
+
+
+def parse_arrays(text, directory):
+    """
+    The arrays defined in a generated header, by symbol. Arrays written with --binary-data are read from their .bin
+    file, which is in the test data directory.
+    """
+    arrays = {}
+    for datatype, symbol, values in re.findall(r'(\w+) (\w+)\[\w+\]\s*=\s*\{([^}]*)\}', text):
+        arrays[symbol] = np.array(values.replace(',', ' ').split(), dtype=np.int64).astype(get_dtype(datatype))
+    for datatype, symbol in re.findall(r'extern (?:const )?(\w+) (\w+)\[', text):
+        binary_file = re.search(r'CMSIS_NN_TEST_DATA_DIR "/([^"\\]+)', text).group(1)
+        arrays[symbol] = np.fromfile(os.path.join(directory, binary_file), dtype=get_dtype(datatype))
+    return arrays
+
+
+def load_header_arrays(filepath):
+    with open(filepath) as f:
+        return parse_arrays(f.read(), generate_test_data.TestSettings.OUTDIR)
+
+
+def load_testset(name, test_type, directory=generate_test_data.TestSettings.OUTDIR):
+    """
+    Load a test set from the headers generated by generate_test_data.py, including arrays written with
+    --binary-data or --dedup.
+    """
+    headers_dir = os.path.join(directory, name)
+    with open(os.path.join(headers_dir, 'test_data.h')) as f:
+        wrapper = f.read()
+    config = {}
+    symbols = {}
+    for header in re.findall(r'#include "([^"]+)"', wrapper):
+        with open(os.path.join(headers_dir, header)) as f:
+            text = f.read()
+        if header == 'config_data.h':
+            config = parse_config(text, name.upper())
+        else:
+            symbols.update(parse_arrays(text, directory))
+    aliases = dict(re.findall(r'#define (\w+) (\w+)', wrapper))
+    arrays = {symbol[len(name) + 1:]: symbols[aliases.get(symbol, symbol)]
+              for symbol in set(symbols) | set(aliases) if symbol.startswith(name + '_')}
+    return TestData(name, test_type, config, arrays)
+
+
+def generate_testset(settings):
+    """
+    Generate the test set of the settings in memory, see TestSettings.capture_output(). Nothing is written to
+    TestCases/TestData.
+    """
+    generate_test_data.import_reference(settings)
+    settings.capture_output()
+    with contextlib.redirect_stdout(io.StringIO()):
+        settings.generate_data()
+    arrays = {name: values.astype(get_dtype(datatype)) for name, (datatype, values) in settings.captured_arrays.items()}
+    config = parse_config(settings.captured_files[settings.config_data], settings.testdataset.upper())
+    return TestData(settings.testdataset, settings.test_type, config, arrays)
+
+
+def get_random_params(test_type, rng):
+    """
+    Random parameters of a test set of the test type, i.e. keyword arguments of its settings class. The shapes are
+    kept small, so that the reference output is quick to compute.
+    """
+    def randint(low, high):
+        return int(rng.integers(low, high + 1))
+
+    int16xint8 = bool(rng.integers(2))
+    params = {}
+    if test_type in ('conv', 'depthwise_conv'):
+        params = {'in_ch': randint(1, 8), 'w_x': randint(1, 5), 'w_y': randint(1, 5), 'stride_x': randint(1, 3),
+                  'stride_y': randint(1, 3), 'dilation_x': randint(1, 2), 'dilation_y': randint(1, 2),
+                  'pad': bool(rng.integers(2)), 'batches': randint(1, 2), 'int16xint8': int16xint8}
+        params['out_ch'] = params['in_ch'] * randint(1, 3) if test_type == 'depthwise_conv' else randint(1, 8)
+        # The dilated filter must fit in the input.
+        params['x_in'] = randint((params['w_x'] - 1) * params['dilation_x'] + 1, 12)
+        params['y_in'] = randint((params['w_y'] - 1) * params['dilation_y'] + 1, 12)
+    elif test_type == 'fully_connected':
+        params = {'in_ch': randint(1, 16), 'out_ch': randint(1, 16), 'x_in': randint(1, 4), 'y_in': randint(1, 4),
+                  'batches': randint(1, 3), 'int16xint8': int16xint8}
+    elif test_type in ('avgpool', 'maxpool'):
+        params = {'channels': randint(1, 16), 'x_in': randint(1, 12), 'y_in': randint(1, 12),
+                  'stride_x': randint(1, 3), 'stride_y': randint(1, 3), 'pad': bool(rng.integers(2)),
+                  'int16xint8': int16xint8}
+        params['w_x'] = randint(1, min(params['x_in'], 5))
+        params['w_y'] = randint(1, min(params['y_in'], 5))
+    elif test_type == 'softmax':
+        params = {'x_in': randint(1, 64), 'y_in': randint(1, 4)}
+        if int16xint8:
+            params['int16xint8'] = True
+        else:
+            params['inInt8outInt16'] = bool(rng.integers(2))
+    elif test_type == 'svdf':
+        params = {'batches': randint(1, 3), 'number_inputs': randint(1, 3), 'rank': randint(1, 3),
+                  'memory_size': randint(1, 4), 'input_size': randint(1, 8), 'number_units': randint(1, 6),
+                  'generate_bias': bool(rng.integers(2)), 'step_output': True}
+    elif test_type in ('add', 'mul'):
+        params = {'channels': randint(1, 8), 'x_in': randint(1, 4), 'y_in': randint(1, 4)}
+        if int16xint8:
+            params.update({'int16xint8': True, 'out_activation_min': INT16_MIN, 'out_activation_max': INT16_MAX})
+    if params.get('int16xint8') and test_type != 'fully_connected':
+        params.update({'randmin': INT16_MIN, 'randmax': INT16_MAX})
+    return params
+
+
+class CmsisNNHost:
+    """
+    The kernels of a host build of the library, see build_library(). Arrays are passed to the kernels without being
+    copied if they are C contiguous and of the type of the kernel argument. The scratch buffer of the kernels is
+    kept between calls.
+    """
+
+    def __init__(self, library=None):
+        if library is None:
+            library = os.environ.get(HOST_LIBRARY_ENV, os.path.join(HOST_BUILD_DIR, HOST_LIBRARY))
+        if not os.path.exists(library):
+            raise RuntimeError("Host library {} not found, build it with --build or with CMake and "
+                               "-DBUILD_CMSIS_NN_HOST_LIBRARY=ON".format(library))
+        self.library = ctypes.CDLL(os.path.abspath(library))
+        for name, (restype, argtypes) in PROTOTYPES.items():
+            function = getattr(self.library, name)
+            function.restype = restype
+            function.argtypes = argtypes
+        self.buffer = np.empty(0, dtype=np.int8)
+        self.softmax_lut_s16 = None
+        # Size of the scratch buffer of the last kernel run.
+        self.buffer_size = 0
+        # Called with the name, function and arguments of each kernel call, if set, see call().
+        self.profiler = None
+
+    def get_context(self, kernel, **arguments):
+        """
+        Context with a scratch buffer of the size that the kernel needs for the arguments, see
+        BUFFER_SIZE_ARGUMENTS.
+        """
+        if kernel not in BUFFER_SIZE_ARGUMENTS:
+            self.buffer_size = 0
+            return Context(None, 0)
+        size = getattr(self.library, kernel + '_get_buffer_size')(*[arguments[argument]
+                                                                     for argument in BUFFER_SIZE_ARGUMENTS[kernel]])
+        self.buffer_size = size
+        if size > self.buffer.size:
+            self.buffer = np.empty(size, dtype=np.int8)
+        return Context(get_pointer(self.buffer) if size > 0 else None, size)
+
+    def call(self, kernel, *arguments):
+        """
+        Call a kernel and check the status it returns, if it returns one. The profiler, if set, is called after the
+        kernel with the same arguments, while the arrays they point to are alive.
+        """
+        function = getattr(self.library, kernel)
+        status = function(*arguments)
+        if self.profiler is not None:
+            self.profiler(kernel, function, arguments)
+        if function.restype is not None and status != 0:
+            raise RuntimeError("{} returned {}".format(kernel, STATUS.get(status, status)))
+
+    def run(self, data, kernel=None):
+        """
+        Run a kernel, by default the one that the unit tests use for the type of the test set, on the test set and
+        return its output.
+        """
+        self.buffer_size = 0
+        if data.test_type == 'conv':
+            return self.convolve(data, kernel)
+        elif data.test_type == 'depthwise_conv':
+            return self.depthwise_convolve(data, kernel)
+        elif data.test_type == 'fully_connected':
+            return self.fully_connected(data, kernel)
+        elif data.test_type in ('avgpool', 'maxpool'):
+            return self.pool(data, kernel)
+        elif data.test_type == 'softmax':
+            return self.softmax(data, kernel)
+        elif data.test_type == 'svdf':
+            return self.svdf(data, kernel)
+        elif data.test_type == 'add':
+            return self.elementwise_add(data, kernel)
+        elif data.test_type == 'mul':
+            return self.elementwise_mul(data, kernel)
+        raise RuntimeError("Invalid test type {}".format(data.test_type))
+
+    def get_conv_arguments(self, data, depthwise):
+        input_dims = Dims(data['INPUT_BATCHES'], data['INPUT_H'], data['INPUT_W'], data['IN_CH'])
+        if depthwise:
+            filter_dims = Dims(1, data['FILTER_Y'], data['FILTER_X'], data['OUT_CH'])
+        else:
+            filter_dims = Dims(data['OUT_CH'], data['FILTER_Y'], data['FILTER_X'], data['IN_CH'])
+        output_dims = Dims(data['INPUT_BATCHES'], data['OUTPUT_H'], data['OUTPUT_W'], data['OUT_CH'])
+        conv_params = dict(input_offset=data['INPUT_OFFSET'], output_offset=data['OUTPUT_OFFSET'],
+                           stride=Tile(data['STRIDE_X'], data['STRIDE_Y']), padding=Tile(data['PAD_X'], data['PAD_Y']),
+                           dilation=Tile(data['DILATION_X'], data['DILATION_Y']),
+                           activation=Activation(data['OUT_ACTIVATION_MIN'], data['OUT_ACTIVATION_MAX']))
+        if depthwise:
+            conv_params = DwConvParams(ch_mult=data['CH_MULT'], **conv_params)
+        else:
+            conv_params = ConvParams(**conv_params)
+        return conv_params, input_dims, filter_dims, output_dims
+
+    def run_conv(self, data, kernel, depthwise):
+        arrays = data.arrays
+        input_data = arrays['input']
+        (conv_params, input_dims, filter_dims, output_dims) = self.get_conv_arguments(data, depthwise)
+        quant_params = PerChannelQuantParams(get_pointer(arrays['output_mult'], ctypes.c_int32),
+                                             get_pointer(arrays['output_shift'], ctypes.c_int32))
+        ctx = self.get_context(kernel, params=ctypes.byref(conv_params), input_dims=ctypes.byref(input_dims),
+                               filter_dims=ctypes.byref(filter_dims), output_dims=ctypes.byref(output_dims))
+        biases = get_bias(arrays['biases']) if kernel in OPTIONAL_BIAS_KERNELS else arrays['biases']
+        output = np.zeros(data['DST_SIZE'], dtype=input_data.dtype)
+        self.call(kernel, ctypes.byref(ctx), ctypes.byref(conv_params), ctypes.byref(quant_params),
+                  ctypes.byref(input_dims), get_pointer(input_data), ctypes.byref(filter_dims),
+                  get_pointer(arrays['weights']), ctypes.byref(Dims()), get_pointer(biases), ctypes.byref(output_dims),
+                  get_pointer(output))
+        return output
+
+    def convolve(self, data, kernel=None):
+        if kernel is None:
+            kernel = 'arm_convolve_wrapper_s16' if data.arrays['input'].dtype == np.int16 else \
+                'arm_convolve_wrapper_s8'
+        return self.run_conv(data, kernel, depthwise=False)
+
+    def depthwise_convolve(self, data, kernel=None):
+        if kernel is None:
+            kernel = 'arm_depthwise_conv_wrapper_s16' if data.arrays['input'].dtype == np.int16 else \
+                'arm_depthwise_conv_wrapper_s8'
+        return self.run_conv(data, kernel, depthwise=True)
+
+    def fully_connected(self, data, kernel=None):
+        arrays = data.arrays
+        input_data = arrays['input']
+        if kernel is None:
+            kernel = 'arm_fully_connected_s16' if input_data.dtype == np.int16 else 'arm_fully_connected_s8'
+        input_dims = Dims(data['INPUT_BATCHES'], data['INPUT_H'], data['INPUT_W'], data['IN_CH'])
+        filter_dims = Dims(data['ACCUMULATION_DEPTH'], 1, 1, data['OUT_CH'])
+        output_dims = Dims(data['INPUT_BATCHES'], 1, 1, data['OUT_CH'])
+        fc_params = FcParams(data['INPUT_OFFSET'], 0, data['OUTPUT_OFFSET'],
+                             Activation(data['OUT_ACTIVATION_MIN'], data['OUT_ACTIVATION_MAX']))
+        quant_params = PerTensorQuantParams(data['OUTPUT_MULTIPLIER'], data['OUTPUT_SHIFT'])
+        ctx = self.get_context(kernel, filter_dims=ctypes.byref(filter_dims))
+        output = np.zeros(data['DST_SIZE'], dtype=input_data.dtype)
+        self.call(kernel, ctypes.byref(ctx), ctypes.byref(fc_params), ctypes.byref(quant_params),
+                  ctypes.byref(input_dims), get_pointer(input_data), ctypes.byref(filter_dims),
+                  get_pointer(arrays['weights']), ctypes.byref(Dims()), get_pointer(arrays['biases']),
+                  ctypes.byref(output_dims), get_pointer(output))
+        return output
+
+    def pool(self, data, kernel=None):
+        input_data = data.arrays['input']
+        if kernel is None:
+            kernel = 'arm_avgpool' if data.test_type == 'avgpool' else 'arm_max_pool'
+            kernel += '_s16' if input_data.dtype == np.int16 else '_s8'
+        input_dims = Dims(data['INPUT_BATCHES'], data['INPUT_H'], data['INPUT_W'], data['IN_CH'])
+        filter_dims = Dims(1, data['FILTER_Y'], data['FILTER_X'], 1)
+        output_dims = Dims(data['INPUT_BATCHES'], data['OUTPUT_H'], data['OUTPUT_W'], data['OUT_CH'])
+        pool_params = PoolParams(Tile(data['STRIDE_X'], data['STRIDE_Y']), Tile(data['PAD_X'], data['PAD_Y']),
+                                 Activation(data['OUT_ACTIVATION_MIN'], data['OUT_ACTIVATION_MAX']))
+        ctx = self.get_context(kernel, output_w=data['OUTPUT_W'], in_ch=data['IN_CH'])
+        output = np.zeros(data['DST_SIZE'], dtype=input_data.dtype)
+        self.call(kernel, ctypes.byref(ctx), ctypes.byref(pool_params), ctypes.byref(input_dims),
+                  get_pointer(input_data), ctypes.byref(filter_dims), ctypes.byref(output_dims), get_pointer(output))
+        return output
+
+    def get_softmax_lut_s16(self):
+        if self.softmax_lut_s16 is None:
+            exp_lut = load_header_arrays(generate_test_data.SoftmaxSettings.EXP_LUT)['softmax_s16_exp_lut']
+            one_by_one_lut = load_header_arrays(generate_test_data.SoftmaxSettings.ONE_BY_ONE_LUT)[
+                'softmax_s16_one_by_one_lut']
+            # The arrays are kept with the struct pointing to them.
+            self.softmax_lut_s16 = (SoftmaxLutS16(get_pointer(exp_lut, ctypes.c_int16),
+                                                  get_pointer(one_by_one_lut, ctypes.c_int16)),
+                                    exp_lut, one_by_one_lut)
+        return self.softmax_lut_s16[0]
+
+    def softmax(self, data, kernel=None):
+        input_data = data.arrays['input']
+        output = np.zeros(data['DST_SIZE'], dtype=data.arrays['output_ref'].dtype)
+        if kernel is None:
+            if input_data.dtype == np.int16:
+                kernel = 'arm_softmax_s16'
+            elif output.dtype == np.int16:
+                kernel = 'arm_softmax_s8_s16'
+            else:
+                kernel = 'arm_softmax_s8'
+        arguments = (get_pointer(input_data), data['NUM_ROWS'], data['ROW_SIZE'], data['INPUT_MULT'],
+                     data['INPUT_LEFT_SHIFT'])
+        if kernel == 'arm_softmax_s16':
+            self.call(kernel, *arguments, ctypes.byref(self.get_softmax_lut_s16()), get_pointer(output))
+        else:
+            self.call(kernel, *arguments, data['DIFF_MIN'], get_pointer(output))
+        return output
+
+    def svdf(self, data, kernel=None):
+        """
+        Run the kernel on each input frame of the input sequence, with the state updated in place, and return the
+        output of the last frame, as the unit test does. Test sets generated with step_output are also checked
+        against the output and state of every frame.
+        """
+        kernel = kernel or 'arm_svdf_state_s16_s8'
+        arrays = data.arrays
+        batches = data['INPUT_BATCHES']
+        feature_batches = data['FEATURE_BATCHES']
+        frame_size = batches * data['INPUT_SIZE']
+        input_sequence = arrays['input_sequence']
+        state = arrays['state'].copy()
+        biases = get_bias(arrays['biases'])
+        input_buffer = np.empty(batches * feature_batches, dtype=np.int32)
+        output_buffer = np.empty(batches * (feature_batches // data['RANK']), dtype=np.int32)
+        input_ctx = Context(get_pointer(input_buffer), input_buffer.nbytes)
+        output_ctx = Context(get_pointer(output_buffer), output_buffer.nbytes)
+        self.buffer_size = input_buffer.nbytes + output_buffer.nbytes
+        svdf_params = SvdfParams(data['RANK'], data['INPUT_OFFSET'], data['OUTPUT_OFFSET'],
+                                 Activation(data['IN_ACTIVATION_MIN'], data['IN_ACTIVATION_MAX']),
+                                 Activation(data['OUT_ACTIVATION_MIN'], data['OUT_ACTIVATION_MAX']))
+        input_quant_params = PerTensorQuantParams(data['MULTIPLIER_IN'], data['SHIFT_1'])
+        output_quant_params = PerTensorQuantParams(data['MULTIPLIER_OUT'], data['SHIFT_2'])
+        input_dims = Dims(batches, data['INPUT_SIZE'], 0, 0)
+        weights_feature_dims = Dims(feature_batches, 0, 0, 0)
+        weights_time_dims = Dims(0, data['TIME_BATCHES'], 0, 0)
+        output = np.zeros(data['DST_SIZE'], dtype=np.int8)
+        frames = input_sequence.size // frame_size
+        for frame in range(frames):
+            self.call(kernel, ctypes.byref(input_ctx), ctypes.byref(output_ctx), ctypes.byref(svdf_params),
+                      ctypes.byref(input_quant_params), ctypes.byref(output_quant_params), ctypes.byref(input_dims),
+                      get_pointer(input_sequence[frame * frame_size:(frame + 1) * frame_size]),
+                      ctypes.byref(Dims()), get_pointer(state), ctypes.byref(weights_feature_dims),
+                      get_pointer(arrays['weights_feature']), ctypes.byref(weights_time_dims),
+                      get_pointer(arrays['weights_time']), ctypes.byref(Dims()), get_pointer(biases),
+                      ctypes.byref(Dims()), get_pointer(output))
+            if 'output_steps_ref' in arrays:
+                for (name, values) in (('output', output), ('state', state)):
+                    step_ref = arrays[name + '_steps_ref'].reshape(frames, -1)[frame]
+                    mismatches = np.flatnonzero(values != step_ref)
+                    if mismatches.size:
+                        raise RuntimeError("The {} after frame {} of {} differs from the reference at index {}: {} "
+                                           "instead of {}".format(name, frame, frames, mismatches[0],
+                                                                  values[mismatches[0]], step_ref[mismatches[0]]))
+        return output
+
+    def elementwise_add(self, data, kernel=None):
+        input1 = data.arrays['input1']
+        kernel = kernel or ('arm_elementwise_add_s16' if input1.dtype == np.int16 else 'arm_elementwise_add_s8')
+        output = np.zeros(data['DST_SIZE'], dtype=input1.dtype)
+        self.call(kernel, get_pointer(input1), get_pointer(data.arrays['input2']), data['INPUT1_OFFSET'],
+                  data['INPUT1_MULT'], data['INPUT1_SHIFT'], data['INPUT2_OFFSET'], data['INPUT2_MULT'],
+                  data['INPUT2_SHIFT'], data['LEFT_SHIFT'], get_pointer(output), data['OUTPUT_OFFSET'],
+                  data['OUTPUT_MULT'], data['OUTPUT_SHIFT'], data['OUT_ACTIVATION_MIN'], data['OUT_ACTIVATION_MAX'],
+                  data['DST_SIZE'])
+        return output
+
+    def elementwise_mul(self, data, kernel=None):
+        input1 = data.arrays['input1']
+        kernel = kernel or ('arm_elementwise_mul_s16' if input1.dtype == np.int16 else 'arm_elementwise_mul_s8')
+        output = np.zeros(data['DST_SIZE'], dtype=input1.dtype)
+        self.call(kernel, get_pointer(input1), get_pointer(data.arrays['input2']), data['INPUT1_OFFSET'],
+                  data['INPUT2_OFFSET'], get_pointer(output), data['OUTPUT_OFFSET'], data['OUTPUT_MULT'],
+                  data['OUTPUT_SHIFT'], data['OUT_ACTIVATION_MIN'], data['OUT_ACTIVATION_MAX'], data['DST_SIZE'])
+        return output
+
+
+def compare_output(data, output):
+    """
+    Compare the output of a kernel with the reference output of the test set. Returns None if they are the same and
+    a description of the difference otherwise.
+    """
+    output_ref = data.arrays['output_ref']
+    if output.shape == output_ref.shape and np.array_equal(output, output_ref):
+        return None
+    if output.shape != output_ref.shape:
+        return "Output has {} values, the reference output {}".format(output.size, output_ref.size)
+    diff = output.astype(np.int64) - output_ref
+    mismatches = np.flatnonzero(diff)
+    first = mismatches[0]
+    return "{} of {} values differ, by up to {}, the first at index {}: {} instead of {}".format(
+        mismatches.size, output.size, np.abs(diff).max(), first, output[first], output_ref[first])
+
+
+def check_testset(host, data, kernel=None):
+    """
+    Run the test set and return (error, seconds), where error is None if the output is the reference output.
+    """
+    start = time.monotonic()
+    try:
+        error = compare_output(data, host.run(data, kernel))
+    except Exception:
+        error = traceback.format_exc()
+    return (error, time.monotonic() - start)
+
+
+def init_generator(seed):
+    """
+    Set up generate_test_data.py for generating test sets in memory, with the NumPy backend and without the model
+    cache, which would only fill up with models of random test sets. TensorFlow is only imported by
+    generate_testset() for the test types without a NumPy reference.
+    """
+    generate_test_data.args = generate_test_data.parse_args(['--backend', 'numpy', '--no-cache', '--seed',
+                                                             str(seed)])
+
+
+def check_testsets(host, testset_names, args):
+    failed = 0
+    print("{:<40} {:<8} {:>10}".format("Testset", "Result", "Time (ms)"))
+    for testset_name in testset_names:
+        test_type = generate_test_data.TESTDATA_SETS.get_test_type(testset_name)
+        try:
+            if args.generate:
+                data = generate_testset(generate_test_data.TESTDATA_SETS[testset_name])
+            else:
+                data = load_testset(testset_name, test_type)
+            (error, seconds) = check_testset(host, data, args.kernel)
+        except Exception:
+            (error, seconds) = (traceback.format_exc(), 0)
+        print("{:<40} {:<8} {:>10.3f}".format(testset_name, "FAILED" if error else "OK", seconds * 1000))
+        if error:
+            failed += 1
+            print("ERROR: Testset {} failed:\n{}".format(testset_name, error))
+    return failed
+
+
+def check_random_testsets(host, test_types, count, args):
+    """
+    Run count test sets of random parameters and data of the test types. The parameters of a failing test set are
+    printed in the format of testdata_sets.json, so that it can be added there.
+    """
+    rng = np.random.default_rng(args.seed)
+    failed = 0
+    seconds = 0
+    # The random data of the test sets is written to a temporary directory, not to PregeneratedData.
+    pregenerated_data_dir = tempfile.mkdtemp()
+    generate_test_data.TestSettings.PREGEN = pregenerated_data_dir + '/'
+    try:
+        start = time.monotonic()
+        for index in range(count):
+            test_type = test_types[index % len(test_types)]
+            params = get_random_params(test_type, rng)
+            testset_name = 'random_{}_{}'.format(test_type, index)
+            try:
+                settings = generate_test_data.SETTINGS_CLASSES[test_type](testset_name, test_type,
+                                                                          generate_test_data.args, **params)
+                data = generate_testset(settings)
+                (error, kernel_seconds) = check_testset(host, data, args.kernel)
+                seconds += kernel_seconds
+            except Exception:
+                error = traceback.format_exc()
+            shutil.rmtree(os.path.join(pregenerated_data_dir, testset_name), ignore_errors=True)
+            if error:
+                failed += 1
+                print("ERROR: Testset {} failed:\n{}\n{}".format(testset_name, error,
+                                                                 json.dumps(dict(type=test_type, **params))))
+        total_seconds = time.monotonic() - start
+    finally:
+        shutil.rmtree(pregenerated_data_dir, ignore_errors=True)
+
+    print("{} random test sets, {} failed, {:.1f} test sets/s, {:.1f} kernel runs/s".format(
+        count, failed, count / total_seconds, count / seconds if seconds else 0))
+    return failed
+
+
+if __name__ == '__main__':
+    args = parse_args()
+
+    library = args.library
+    if args.build:
+        library = build_library()
+    host = CmsisNNHost(library)
+
+    generate_test_data.load_all_testdatasets()
+    if args.random:
+        init_generator(args.seed)
+        test_types = [args.testtype] if args.testtype else NUMPY_TEST_TYPES
+        failed = check_random_testsets(host, test_types, args.random, args)
+    else:
+        if args.run_all_testsets:
+            testset_names = [testset_name for testset_name in generate_test_data.TESTDATA_SETS
+                             if (not args.testtype
+                                 or generate_test_data.TESTDATA_SETS.get_test_type(testset_name) == args.testtype)
+                             and (args.stress or not generate_test_data.TESTDATA_SETS.is_stress(testset_name))]
+        elif args.dataset:
+            testset_names = [args.dataset]
+        else:
+            raise RuntimeError("Please select testdataset or use --run-all-testsets or --random")
+        if args.generate:
+            init_generator(args.seed)
+        failed = check_testsets(host, testset_names, args)
+    if failed:
+        sys.exit(1)
@@ -16,30 +16,57 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 #
+import io
 import os
+import re
 import sys
+import csv
 import json
 import math
+import time
+import copy
+import shutil
+import struct
+import hashlib
+import inspect
+import itertools
 import argparse
+import functools
+import tempfile
+import traceback
 import subprocess
+import multiprocessing
+import concurrent.futures
+import flatbuffers
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 
 from packaging import version
 from abc import ABC, abstractmethod
-from tensorflow.lite.python.interpreter import Interpreter
-from tensorflow.lite.python.interpreter import OpResolverType
-
-
-try:
-    import tensorflow as tf
-except Exception as e:
-    print(e)
-    sys.exit(1)
+from collections.abc import Mapping
+from contextlib import contextmanager
 
 REQUIRED_MINIMUM_TENSORFLOW_VERSION = version.parse("2.5")
-TESTDATA_SETS = {}
+
+# Imported by import_tensorflow(), only when a test set has a TFLite reference.
+tf = None
+TESTDATA_SETS_FILE = 'testdata_sets.json'
 CLANG_FORMAT = 'clang-format-9 -i'
 
+# Settings of the .clang-format file used by generate_c_array(), which formats arrays the same way as clang-format.
+CLANG_FORMAT_COLUMN_LIMIT = 120
+CLANG_FORMAT_CONTINUATION_INDENT = 4
+
+# Number of lines of a C array that generate_c_array() formats and writes at a time.
+C_ARRAY_LINES_PER_WRITE = 4096
+
+# Little-endian NumPy types of the C types of the arrays that --binary-data writes as .bin files.
+BINARY_DATA_TYPES = {'q7_t': '<i1', 'int8_t': '<i1', 'q15_t': '<i2', 'int16_t': '<i2', 'q31_t': '<i4',
+                     'int32_t': '<i4', 'int64_t': '<i8'}
+
+# Alignment in bytes of the arrays in .bin files, defined in the config_data.h of the test set.
+BINARY_DATA_ALIGNMENT = 16
+
 INT32_MAX = 2147483647
 INT32_MIN = -2147483648
 INT16_MAX = 32767
@@ -47,8 +74,18 @@ INT16_MIN = -32768
 INT8_MAX = 127
 INT8_MIN = -128
 
+# Upper bound in bytes of the input windows that the NumPy reference of a convolution gathers at a time. The output
+# is computed in chunks of output rows, so that large shapes do not need more memory.
+REFERENCE_CHUNK_SIZE = 16 * 1024 * 1024
+
+# Number of test sets and phases in the summary table printed by --profile.
+PROFILE_SUMMARY_ROWS = 10
 
-def parse_args():
+DEFAULT_CACHE_DIR = os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache')),
+                                 'cmsis_nn_test_data')
+
+
+def parse_args(argv=None):
     parser = argparse.ArgumentParser(description="Generate input and refererence output data for unittests."
                                      " It can regenerate all data, load all stored data or a combination of it.")
     parser.add_argument('--dataset', type=str, default=None, help="Name of generated test set.")
@@ -56,6 +93,9 @@ def parse_args():
     parser.add_argument('--regenerate-input', action='store_true', help="Regenerate and store new input.")
     parser.add_argument('--regenerate-biases', action='store_true', help="Regenerate and store new biases.")
     parser.add_argument('-a', '--regenerate-all', action='store_true', help="Regenerate and store all data.")
+    parser.add_argument('--seed', type=int, default=0, help="Seed of the regenerated data. The data of each test set"
+                        " and file is generated from its own random stream, seeded from the test set name, the file"
+                        " name and this seed, so regenerating with the same seed gives the same data.")
     parser.add_argument('-t', '--testtype', type=str, default=None, choices=['conv', 'depthwise_conv', 'avgpool',
                                                                              'maxpool', 'fully_connected', 'softmax',
                                                                              'svdf', 'add', 'mul'],
@@ -64,17 +104,543 @@ def parse_args():
                         "sets. Regenerate all, partially all or no input data (output may still change, depending on"
                         " changes in script) depending on regenerate flags. If used together with the -t flag, only"
                         " tests of that type will be run.")
-    parser.add_argument('--schema-file', type=str, help="Path to schema file. This may be needed for some tests.")
-
-    args = parser.parse_args()
+    parser.add_argument('--cache-dir', type=str, default=DEFAULT_CACHE_DIR, help="Directory of the cache of"
+                        " converted TFLite models and reference outputs.")
+    parser.add_argument('--cache-size', type=int, default=512, help="Maximum size of the cache in MB. The least"
+                        " recently used entries are removed when it is exceeded.")
+    parser.add_argument('--no-cache', action='store_true', help="Always convert the models and run the interpreter.")
+    parser.add_argument('-j', '--jobs', type=int, default=1, help="Number of test sets to generate in parallel when"
+                        " used together with --run-all-testsets. Each test set is generated in a separate process with"
+                        " its own TensorFlow state.")
+    parser.add_argument('--backend', type=str, default='tflite', choices=['tflite', 'numpy'], help="Engine computing"
+                        " the reference output. tflite converts a Keras model and runs the TFLite interpreter. numpy"
+                        " derives the quantization parameters the way the TFLite converter does and computes the"
+                        " output bit exact to the TFLite reference kernels, without the converter. Test types that"
+                        " have no NumPy reference always use tflite.")
+    parser.add_argument('--batch-models', action='store_true', help="Used together with --run-all-testsets. Convert"
+                        " the models of all test sets with the same input type as one multi-input, multi-output"
+                        " model, split it into a model per test set in the model cache and then generate the test"
+                        " sets from the cache.")
+    parser.add_argument('--incremental', action='store_true', help="Only generate the test sets that are out of date"
+                        " according to the manifest in TestCases/TestData, i.e. whose parameters, pregenerated data,"
+                        " generator source code or TensorFlow version have changed since they were generated.")
+    parser.add_argument('--list', action='store_true', help="List the test sets, or only those of the type given"
+                        " by -t, and exit.")
+    parser.add_argument('--stress', action='store_true', help="Include the stress test sets, with layers of the"
+                        " sizes of MobileNet and DS-CNN, in --run-all-testsets and --list. A stress test set can always"
+                        " be generated with --dataset.")
+    parser.add_argument('--dry-run', action='store_true', help="Print the parameters, the pregenerated data and the"
+                        " output directory of the test sets that would be generated, without generating them.")
+    parser.add_argument('--binary-data', action='store_true', help="Write the arrays as raw little-endian .bin "
+                        "files, that small headers pull in with .incbin, instead of as C arrays. This makes the unit "
+                        "tests faster to compile.")
+    parser.add_argument('--dedup', action='store_true', help="Store identical arrays of different test sets only "
+                        "once, in a pool of arrays shared by all test sets that the headers of the test sets refer to.")
+    parser.add_argument('--check-pool-link', action='store_true', help="Compile the test sets that share pooled "
+                        "arrays each as a separate object with the host C compiler, CC or cc by default, link them "
+                        "into one program, check that they refer to the same arrays and exit.")
+    parser.add_argument('--profile', type=str, nargs='?', const='profile.json', default=None, metavar='REPORT',
+                        help="Record the wall time and peak RSS of each phase of generating each test set, i.e. "
+                        "generating data, building and converting the model, running the interpreter or the NumPy "
+                        "reference and writing and formatting the headers. The report is written as CSV if REPORT "
+                        "ends with .csv and as JSON otherwise, by default to profile.json. A summary of the slowest "
+                        "test sets and phases is printed.")
+    parser.add_argument('--convert-pregenerated-data', action='store_true', help="Convert the .txt files in"
+                        " PregeneratedData of all test sets to .npy and exit.")
+
+    args = parser.parse_args(argv)
+    if args.batch_models and args.no_cache:
+        parser.error("--batch-models requires the model cache")
+    if args.incremental and (args.regenerate_weights or args.regenerate_input or args.regenerate_biases
+                             or args.regenerate_all):
+        parser.error("--incremental cannot be combined with the regenerate flags")
     return args
 
 
+def import_tensorflow():
+    """
+    Importing TensorFlow takes seconds, so it is only done when test data with a TFLite reference is actually
+    generated, see TestSettings.uses_numpy_reference. Importing it again does nothing.
+    """
+    global tf, Interpreter, OpResolverType, schema_fb
+    if tf is not None:
+        return
+    try:
+        import tensorflow as tf
+    except Exception as e:
+        print(e)
+        sys.exit(1)
+    from tensorflow.lite.python.interpreter import Interpreter
+    from tensorflow.lite.python.interpreter import OpResolverType
+    from tensorflow.lite.python import schema_py_generated as schema_fb
+
+    if version.parse(tf.__version__) < REQUIRED_MINIMUM_TENSORFLOW_VERSION:
+        print("Unsupported tensorflow version, ", version.parse(tf.__version__))
+        sys.exit(0)
+
+
+@functools.lru_cache(maxsize=None)
+def get_source_code(obj):
+    """
+    inspect.getsource() parses the whole file to find a class, so the result is kept.
+    """
+    return inspect.getsource(obj)
+
+
+def reset_peak_rss():
+    """
+    Reset the peak resident set size of the process. This is only supported by Linux, elsewhere the peak is the peak
+    since the process started.
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def get_peak_rss():
+    """
+    Peak resident set size of the process in bytes.
+    """
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class PhaseProfiler:
+    """
+    Wall time and peak RSS of the phases of generating each test set, recorded with --profile. The time of a phase
+    does not include the time of the phases nested in it. The peak RSS is reset when the outermost phase starts, so
+    it is the peak of the phase and the phases around it.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.records = {}
+        self.nested_seconds = []
+
+    @contextmanager
+    def phase(self, testset_name, phase):
+        if not self.enabled:
+            yield
+            return
+        if not self.nested_seconds:
+            reset_peak_rss()
+        self.nested_seconds.append(0.0)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            seconds = time.monotonic() - start
+            nested_seconds = self.nested_seconds.pop()
+            if self.nested_seconds:
+                self.nested_seconds[-1] += seconds
+            record = self.records.setdefault(testset_name, {}).setdefault(phase, {
+                'seconds': 0.0,
+                'peak_rss': 0,
+                'calls': 0
+            })
+            record['seconds'] += seconds - nested_seconds
+            record['peak_rss'] = max(record['peak_rss'], get_peak_rss())
+            record['calls'] += 1
+
+    def take(self, testset_name):
+        """
+        Returns the phases recorded for the test set and forgets them.
+        """
+        return self.records.pop(testset_name, {})
+
+
+PROFILER = PhaseProfiler()
+
+
+def profiled(phase):
+    """
+    Decorator recording the calls of a method of TestSettings as the given phase of the test set, see PhaseProfiler.
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with self.profile(phase):
+                return method(self, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+class ModelCache:
+    """
+    Persistent cache of converted TFLite models, their quantization parameters and reference outputs.
+    Entries are stored in a directory per key, where the key is a hash of everything the model depends on.
+    The least recently used entries are removed when the total size exceeds max_size bytes.
+    """
+
+    MODEL = 'model.tflite'
+    QUANTIZATION = 'quantization.json'
+    OUTPUT = 'output_ref.npy'
+
+    def __init__(self, directory, max_size):
+        self.directory = directory
+        self.max_size = max_size
+
+    def entry_dir(self, key):
+        return os.path.join(self.directory, key)
+
+    def load(self, key):
+        """
+        Returns (tflite_model, quantization, output_ref) or None if there is no entry for key.
+        output_ref is None if the reference output was not stored.
+        """
+        entry_dir = self.entry_dir(key)
+        try:
+            with open(os.path.join(entry_dir, self.MODEL), 'rb') as f:
+                tflite_model = f.read()
+            with open(os.path.join(entry_dir, self.QUANTIZATION), 'r') as f:
+                quantization = json.load(f)
+            output_file = os.path.join(entry_dir, self.OUTPUT)
+            output_ref = np.load(output_file) if os.path.exists(output_file) else None
+            # Mark as recently used.
+            os.utime(entry_dir)
+        except (OSError, ValueError):
+            return None
+        return (tflite_model, quantization, output_ref)
+
+    def store(self, key, tflite_model, quantization):
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_dir = tempfile.mkdtemp(dir=self.directory, prefix='.' + key + '.')
+        with open(os.path.join(tmp_dir, self.MODEL), 'wb') as f:
+            f.write(tflite_model)
+        with open(os.path.join(tmp_dir, self.QUANTIZATION), 'w') as f:
+            json.dump(quantization, f)
+        try:
+            os.replace(tmp_dir, self.entry_dir(key))
+        except OSError:
+            # Stored by someone else in the meantime.
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        self.evict()
+
+    def store_output(self, key, output_ref):
+        entry_dir = self.entry_dir(key)
+        if not os.path.isdir(entry_dir):
+            return
+        fd, tmp_file = tempfile.mkstemp(dir=entry_dir, suffix='.npy')
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, output_ref)
+        os.replace(tmp_file, os.path.join(entry_dir, self.OUTPUT))
+
+    def evict(self):
+        entries = []
+        total_size = 0
+        for entry in os.scandir(self.directory):
+            if not entry.is_dir() or entry.name.startswith('.'):
+                continue
+            try:
+                size = sum(f.stat().st_size for f in os.scandir(entry.path))
+                entries.append((entry.stat().st_mtime, size, entry.path))
+            except OSError:
+                continue
+            total_size += size
+        for mtime, size, path in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total_size -= size
+
+
+class TestDataManifest:
+    """
+    Record of what each generated test set was generated from. For every test set it holds a hash of the
+    parameters, of the pregenerated data, of the source code of the settings class and the reference version, as
+    returned by TestSettings.get_manifest_state(). A test set is out of date when any of them differs from the
+    current state or when its generated headers are missing.
+    """
+
+    FILE = 'manifest.json'
+
+    DESCRIPTIONS = {
+        'parameters': "parameters changed",
+        'pregenerated_data': "pregenerated data changed",
+        'source': "generator source changed",
+        'reference': "reference engine or version changed",
+    }
+
+    def __init__(self, directory):
+        self.path = os.path.join(directory, self.FILE)
+        try:
+            with open(self.path, 'r') as f:
+                self.testsets = json.load(f)
+        except (OSError, ValueError):
+            self.testsets = {}
+
+    def get_rebuild_reasons(self, testset_name, state, settings):
+        """
+        Returns why the test set needs to be generated, or an empty list if it is up to date.
+        """
+        if testset_name not in self.testsets:
+            return ["not in manifest"]
+        reasons = [description for name, description in self.DESCRIPTIONS.items()
+                   if self.testsets[testset_name].get(name) != state[name]]
+        if not os.path.exists(os.path.join(settings.headers_dir, 'test_data.h')):
+            reasons.append("output missing")
+        return reasons
+
+    def update(self, testset_name, state, settings):
+        """
+        Record a generated test set. The pregenerated data is hashed again, as it is written during generation.
+        """
+        self.testsets[testset_name] = dict(state, pregenerated_data=settings.get_pregenerated_data_hash())
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        fd, tmp_file = tempfile.mkstemp(dir=os.path.dirname(self.path), prefix='.' + self.FILE + '.')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(self.testsets, f, indent=4, sort_keys=True)
+            f.write('\n')
+        os.replace(tmp_file, self.path)
+
+
+class ModelRequest(Exception):
+    """
+    Raised by convert_and_interpret() instead of converting a model in the first pass of --batch-models.
+    """
+
+    def __init__(self, create_model, inttype, cache_key):
+        super().__init__("Model of cache entry {} requested".format(cache_key))
+        self.create_model = create_model
+        self.inttype = inttype
+        self.cache_key = cache_key
+
+
+class TFLiteModelBuilder:
+    """
+    Serializes a TFLite model to flatbuffer bytes in memory. The model is given as a dict in the json format of flatc,
+    i.e. the format of the json templates, with the buffer data as bytes. Only the part of the TFLite schema that the
+    templates use is supported.
+    """
+
+    FILE_IDENTIFIER = b'TFL3'
+    BUFFER_ALIGNMENT = 16
+
+    # Field slots and types of the tables in tensorflow/lite/schema/schema.fbs. Types ending with [] are vectors,
+    # types starting with an upper case letter are tables and the type of a union is the field that holds its type.
+    SCHEMA = {
+        'Model': {'version': (0, 'uint32'), 'operator_codes': (1, 'OperatorCode[]'), 'subgraphs': (2, 'SubGraph[]'),
+                  'description': (3, 'string'), 'buffers': (4, 'Buffer[]'), 'metadata': (6, 'Metadata[]')},
+        'OperatorCode': {'deprecated_builtin_code': (0, 'int8'), 'version': (2, 'int32'),
+                         'builtin_code': (3, 'int32')},
+        'SubGraph': {'tensors': (0, 'Tensor[]'), 'inputs': (1, 'int32[]'), 'outputs': (2, 'int32[]'),
+                     'operators': (3, 'Operator[]'), 'name': (4, 'string')},
+        'Tensor': {'shape': (0, 'int32[]'), 'type': (1, 'int8'), 'buffer': (2, 'uint32'), 'name': (3, 'string'),
+                   'quantization': (4, 'QuantizationParameters'), 'is_variable': (5, 'bool')},
+        'QuantizationParameters': {'min': (0, 'float32[]'), 'max': (1, 'float32[]'), 'scale': (2, 'float32[]'),
+                                   'zero_point': (3, 'int64[]'), 'quantized_dimension': (6, 'int32')},
+        'Operator': {'opcode_index': (0, 'uint32'), 'inputs': (1, 'int32[]'), 'outputs': (2, 'int32[]'),
+                     'builtin_options_type': (3, 'uint8'), 'builtin_options': (4, 'builtin_options_type'),
+                     'custom_options_format': (6, 'int8')},
+        'Buffer': {'data': (0, 'uint8[]')},
+        'Metadata': {'name': (0, 'string'), 'buffer': (1, 'uint32')},
+        'SVDFOptions': {'rank': (0, 'int32'), 'fused_activation_function': (1, 'int8')},
+        'SoftmaxOptions': {'beta': (0, 'float32')},
+    }
+
+    # Enum values of the schema that the templates refer to by name, per field.
+    ENUMS = {
+        'type': {'FLOAT32': 0, 'INT32': 2, 'UINT8': 3, 'INT64': 4, 'INT16': 7, 'INT8': 9},
+        'builtin_code': {'SOFTMAX': 25, 'SVDF': 27},
+        'builtin_options_type': {'NONE': 0, 'SVDFOptions': 6, 'SoftmaxOptions': 9},
+        'fused_activation_function': {'NONE': 0, 'RELU': 1, 'RELU_N1_TO_1': 2, 'RELU6': 3, 'TANH': 4},
+        'custom_options_format': {'FLEXBUFFERS': 0},
+    }
+
+    # Builder method and default value of the scalar types. The defaults are only there to make the builder accept
+    # the values, all values are written.
+    SCALAR_TYPES = {'bool': ('PrependBoolSlot', False), 'int8': ('PrependInt8Slot', 0),
+                    'uint8': ('PrependUint8Slot', 0), 'int32': ('PrependInt32Slot', 0),
+                    'uint32': ('PrependUint32Slot', 0), 'float32': ('PrependFloat32Slot', 0.0)}
+
+    def __init__(self):
+        self.builder = flatbuffers.Builder(1024)
+        # All values of the model are written, also the ones that are equal to the schema default.
+        self.builder.ForceDefaults(True)
+
+    def build(self, model):
+        self.builder.Finish(self.build_table('Model', model), file_identifier=self.FILE_IDENTIFIER)
+        return bytes(self.builder.Output())
+
+    def build_table(self, table, values):
+        fields = self.SCHEMA[table]
+        unknown_fields = set(values) - set(fields)
+        if unknown_fields:
+            raise RuntimeError("Fields not supported for {}: {}".format(table, ', '.join(sorted(unknown_fields))))
+
+        # Empty buffers are written without data, the same as the TFLite converter does. The interpreter does not
+        # accept a variable tensor with a buffer that has data, even if it is empty.
+        values = {name: value for name, value in values.items() if fields[name][1] != 'uint8[]' or len(value)}
+
+        # Strings, vectors and sub tables can not be created while building a table, so create those first.
+        offsets = {}
+        for name, value in values.items():
+            field_type = fields[name][1]
+            if field_type == 'string':
+                offsets[name] = self.builder.CreateString(value)
+            elif field_type.endswith('[]'):
+                offsets[name] = self.build_vector(field_type[:-2], value)
+            elif field_type in self.ENUMS:
+                union_type = values[field_type]
+                offsets[name] = self.build_table(union_type, value)
+            elif field_type not in self.SCALAR_TYPES:
+                offsets[name] = self.build_table(field_type, value)
+
+        self.builder.StartObject(max(slot for slot, _ in fields.values()) + 1)
+        for name, value in values.items():
+            (slot, field_type) = fields[name]
+            if name in offsets:
+                self.builder.PrependUOffsetTRelativeSlot(slot, offsets[name], 0)
+            else:
+                value = self.ENUMS[name][value] if name in self.ENUMS and isinstance(value, str) else value
+                (prepend, default) = self.SCALAR_TYPES[field_type]
+                getattr(self.builder, prepend)(slot, type(default)(value), default)
+        return self.builder.EndObject()
+
+    def build_vector(self, element_type, values):
+        if element_type in self.SCHEMA:
+            elements = [self.build_table(element_type, value) for value in values]
+            self.builder.StartVector(4, len(elements), 4)
+            for element in reversed(elements):
+                self.builder.PrependUOffsetTRelative(element)
+            return self.builder.EndVector(len(elements))
+
+        values = np.frombuffer(values, dtype=np.uint8) if isinstance(values, bytes) else values
+        values = np.asarray(values, dtype='<' + np.dtype(element_type).str[1:])
+        if element_type == 'uint8':
+            # Buffer data is aligned, the same as flatc does with the force_align attribute of the schema.
+            self.builder.Prep(self.BUFFER_ALIGNMENT, values.nbytes)
+        return self.builder.CreateNumpyVector(values)
+
+
+class TFLiteModelPatcher:
+    """
+    Overwrites tensor data and quantization parameters of a TFLite flatbuffer in place. Sizes can not be changed, so
+    the new data must have the same shape and type as the old, which is the case for models with the same topology.
+    """
+
+    TENSOR_TYPES = {np.dtype(np.int8): 9, np.dtype(np.int16): 7, np.dtype(np.int32): 2, np.dtype(np.int64): 4}
+
+    def __init__(self, tflite_model):
+        self.model = bytearray(tflite_model)
+        self.patched = set()
+
+        root = self.deref(0)
+        buffers = self.tables(root, 4)
+        subgraph = self.tables(root, 2)[0]
+        self.outputs = set(self.vector(subgraph, 2, '<i4'))
+        self.tensors = []
+        for tensor in self.tables(subgraph, 0):
+            data = self.vector(buffers[self.scalar(tensor, 2, '<u4')], 0, '<u1')
+            quantization = self.table(tensor, 4)
+            self.tensors.append({'shape': tuple(self.vector(tensor, 0, '<i4').tolist()),
+                                 'type': self.scalar(tensor, 1, '<i1'),
+                                 'data': data if data is not None and data.size else None,
+                                 'scales': self.vector(quantization, 2, '<f4') if quantization else None,
+                                 'zero_points': self.vector(quantization, 3, '<i8') if quantization else None})
+
+    def deref(self, position):
+        return position + struct.unpack_from('<I', self.model, position)[0]
+
+    def field(self, table, slot):
+        """
+        Position of a field of a table, or None if the field is not set.
+        """
+        vtable = table - struct.unpack_from('<i', self.model, table)[0]
+        vtable_size = struct.unpack_from('<H', self.model, vtable)[0]
+        if 4 + 2 * slot >= vtable_size:
+            return None
+        offset = struct.unpack_from('<H', self.model, vtable + 4 + 2 * slot)[0]
+        return table + offset if offset else None
+
+    def scalar(self, table, slot, dtype):
+        field = self.field(table, slot)
+        return 0 if field is None else np.frombuffer(self.model, dtype=dtype, count=1, offset=field)[0]
+
+    def table(self, table, slot):
+        field = self.field(table, slot)
+        return None if field is None else self.deref(field)
+
+    def vector(self, table, slot, dtype):
+        """
+        Writable view of a vector of scalars, or None if the field is not set.
+        """
+        field = self.field(table, slot)
+        if field is None:
+            return None
+        vector = self.deref(field)
+        length = struct.unpack_from('<I', self.model, vector)[0]
+        return np.frombuffer(self.model, dtype=dtype, count=length, offset=vector + 4)
+
+    def tables(self, table, slot):
+        field = self.field(table, slot)
+        vector = self.deref(field)
+        length = struct.unpack_from('<I', self.model, vector)[0]
+        return [self.deref(vector + 4 + 4 * i) for i in range(length)]
+
+    def set_quantization(self, index, scales, zero_points):
+        tensor = self.tensors[index]
+        scales = np.asarray(scales, dtype=np.float32).ravel()
+        zero_points = np.asarray(zero_points, dtype=np.int64).ravel()
+        if tensor['scales'] is None or tensor['scales'].size != scales.size or \
+           tensor['zero_points'] is None or tensor['zero_points'].size != zero_points.size:
+            raise RuntimeError("Quantization parameters of tensor {} can not be patched".format(index))
+        tensor['scales'][:] = scales
+        tensor['zero_points'][:] = zero_points
+
+    def patch_constant(self, data, scales, zero_points):
+        """
+        Overwrite the data and quantization parameters of the one constant tensor with the shape and type of data.
+        """
+        data = np.asarray(data)
+        matches = [index for index, tensor in enumerate(self.tensors) if tensor['data'] is not None and
+                   tensor['shape'] == data.shape and tensor['type'] == self.TENSOR_TYPES[data.dtype]]
+        if len(matches) != 1:
+            raise RuntimeError("Expected one constant tensor of shape {} and type {}, found {}".format(
+                data.shape, data.dtype, len(matches)))
+        index = matches[0]
+        self.tensors[index]['data'][:] = np.frombuffer(data.astype(data.dtype.newbyteorder('<')).tobytes(),
+                                                       dtype=np.uint8)
+        self.set_quantization(index, scales, zero_points)
+        self.patched.add(index)
+
+    def patch_output(self, scale, zero_point):
+        for index in self.outputs:
+            self.set_quantization(index, scale, zero_point)
+            self.patched.add(index)
+
+    def all_constants_patched(self):
+        return all(tensor['data'] is None or index in self.patched for index, tensor in enumerate(self.tensors))
+
+    def get_model(self):
+        return bytes(self.model)
+
+
 class TestSettings(ABC):
 
     # This is the generated test data used by the test cases.
     OUTDIR = 'TestCases/TestData/'
 
+    # Arrays that are shared by the test sets, see generate_pooled_array(). This is a directory in the OUTDIR.
+    POOL_DIR = 'Pool/'
+    # Version of the format of the pooled arrays. It is part of their hash, so arrays pooled in an older format are
+    # written again instead of being reused.
+    POOL_FORMAT = 2
+
     # This is input to the data generation. If everything or something is regenerated then it is overwritten.
     # So it always has the same data as the OUTDIR.
     # The purpose of the pregen is primarily for debugging, as it is enabling to change a single parameter and see how
@@ -82,14 +648,29 @@ class TestSettings(ABC):
     # It also convinient when tesing changes in the script, to be able to run all test sets again.
     PREGEN = 'PregeneratedData/'
 
+    # Attributes that do not affect the converted model, i.e. that are left out of the model cache key.
+    CACHE_KEY_EXCLUDE = ['testdataset', 'pregenerated_data_dir', 'config_data', 'kernel_table_file',
+                         'inputs_table_file', 'bias_table_file', 'time_table_file', 'regenerate_new_weights',
+                         'regenerate_new_input', 'regenerate_new_bias', 'headers_dir', 'model_path',
+                         'model_path_tflite', 'json_template', 'cache_key', 'backend', 'model_request_only', 'seed',
+                         'binary_data', 'dedup_data', 'captured_arrays', 'captured_files']
+
+    # Attributes that only affect the data, i.e. that are left out of the topology key of the model cache as well.
+    TOPOLOGY_KEY_EXCLUDE = ['mins', 'maxs', 'bias_mins', 'bias_maxs', 'decimal_input']
+
+    # Whether the test type has a NumPy reference, used with --backend numpy instead of TFLite.
+    NUMPY_REFERENCE = False
+
+    # Attributes that do not affect the generated test set, i.e. that are left out of the manifest.
+    MANIFEST_EXCLUDE = ['regenerate_new_weights', 'regenerate_new_input', 'regenerate_new_bias', 'model_cache',
+                        'cache_key', 'cached_output', 'backend', 'model_request_only', 'seed', 'captured_arrays',
+                        'captured_files']
+
     def __init__(self, dataset, testtype, args, in_ch, out_ch, x_in, y_in, w_x, w_y, stride_x=1, stride_y=1, pad=False,
                  randmin=INT8_MIN, randmax=INT8_MAX, batches=1, generate_bias=True, relu6=False,
                  out_activation_min=None, out_activation_max=None, int16xint8=False, bias_min=None, bias_max=None,
                  dilation_x=1, dilation_y=1):
 
-        self.tensor_flow_reference_version = ("// Generated by {} using TFL version {} as reference.\n".
-                                              format(os.path.basename(__file__), tf.__version__))
-
         # Randomization interval
         self.mins = randmin
         self.maxs = randmax
@@ -130,21 +711,28 @@ class TestSettings(ABC):
         self.generate_bias = generate_bias
 
         self.generated_header_files = []
+        # Name and size of the arrays written as .bin files, see generate_c_array().
+        self.binary_arrays = []
+        # Symbols of the test set and of the pool of the arrays that are pooled, see generate_pooled_array().
+        self.pooled_arrays = []
         self.pregenerated_data_dir = self.PREGEN
 
         self.config_data = "config_data.h"
 
         self.testdataset = dataset
 
-        self.kernel_table_file = self.pregenerated_data_dir + self.testdataset + '/' + 'kernel.txt'
-        self.inputs_table_file = self.pregenerated_data_dir + self.testdataset + '/' + 'input.txt'
-        self.bias_table_file = self.pregenerated_data_dir + self.testdataset + '/' + 'bias.txt'
+        self.kernel_table_file = self.pregenerated_data_dir + self.testdataset + '/' + 'kernel.npy'
+        self.inputs_table_file = self.pregenerated_data_dir + self.testdataset + '/' + 'input.npy'
+        self.bias_table_file = self.pregenerated_data_dir + self.testdataset + '/' + 'bias.npy'
 
         if self.has_padding:
             self.padding = 'SAME'
         else:
             self.padding = 'VALID'
 
+        self.seed = args.seed
+        self.binary_data = args.binary_data
+        self.dedup_data = args.dedup
         self.regenerate_new_weights = args.regenerate_weights
         self.regenerate_new_input = args.regenerate_input
         self.regenerate_new_bias = args.regenerate_biases
@@ -157,10 +745,116 @@ class TestSettings(ABC):
         self.model_path = "{}model_{}".format(self.headers_dir, self.testdataset)
         self.model_path_tflite = self.model_path + '.tflite'
 
-    def save_multiple_dim_array_in_txt(self, file, data):
-        header = ','.join(map(str, data.shape))
-        np.savetxt(file, data.reshape(-1, data.shape[-1]), header=header,
-                   delimiter=',')
+        self.model_cache = None if args.no_cache else ModelCache(args.cache_dir, args.cache_size * 1024 * 1024)
+        self.backend = args.backend
+        self.cache_key = None
+        self.cached_output = None
+        # Set by the first pass of --batch-models, see generate_batched_models().
+        self.model_request_only = False
+        # Set by capture_output().
+        self.captured_arrays = None
+        self.captured_files = None
+
+    def profile(self, phase):
+        return PROFILER.phase(self.testdataset, phase)
+
+    def capture_output(self):
+        """
+        Keep the generated test set in memory instead of writing it to the headers directory, e.g. for running it
+        in-process with cmsis_nn_host.py. The arrays are kept by name, as their C type and values, and the other
+        files, such as config_data.h, by file name.
+        """
+        self.captured_arrays = {}
+        self.captured_files = {}
+
+    @property
+    def uses_numpy_reference(self):
+        """
+        Whether the reference output is computed with NumPy, so that TensorFlow need not be imported.
+        """
+        return self.backend == 'numpy' and self.NUMPY_REFERENCE
+
+    def get_reference_version(self):
+        """
+        Engine computing the reference output and its version.
+        """
+        if self.uses_numpy_reference:
+            return ("NumPy", np.__version__)
+        return ("TFL", tf.__version__)
+
+    @property
+    def tensor_flow_reference_version(self):
+        return ("// Generated by {} using {} version {} as reference.\n".
+                format(os.path.basename(__file__), *self.get_reference_version()))
+
+    @contextmanager
+    def open_atomic(self, filepath, mode="w", format_output=False):
+        """
+        Write to a temporary file next to filepath and move it into place once complete. This way parallel runs or
+        an interrupted run never leave a partially written file behind. Append mode starts from the current content.
+        After capture_output() the file is kept in memory instead.
+        """
+        if self.captured_files is not None:
+            filename = os.path.basename(filepath)
+            f = io.BytesIO() if 'b' in mode else io.StringIO()
+            if 'a' in mode:
+                f.write(self.captured_files.get(filename, ''))
+            yield f
+            self.captured_files[filename] = f.getvalue()
+            return
+
+        directory = os.path.dirname(filepath)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_filepath = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(filepath) + '.',
+                                            suffix=os.path.splitext(filepath)[1])
+        try:
+            with os.fdopen(fd, mode.replace('a', 'w')) as f:
+                if 'a' in mode and os.path.exists(filepath):
+                    with open(filepath, mode.replace('a', 'r')) as current:
+                        f.write(current.read())
+                yield f
+            if format_output:
+                self.format_output_file(tmp_filepath)
+            umask = os.umask(0)
+            os.umask(umask)
+            os.chmod(tmp_filepath, 0o666 & ~umask)
+            os.replace(tmp_filepath, filepath)
+        finally:
+            if os.path.exists(tmp_filepath):
+                os.remove(tmp_filepath)
+
+    def get_legacy_txt_file(self, file):
+        return os.path.splitext(file)[0] + '.txt'
+
+    def pregenerated_data_exists(self, file):
+        return os.path.exists(file) or os.path.exists(self.get_legacy_txt_file(file))
+
+    def save_multiple_dim_array(self, file, data):
+        """
+        Store data as .npy with the smallest integer type that holds it, or as float32 if it is not integral.
+        A legacy .txt file with the same data is removed.
+        """
+        data = np.asarray(data)
+        if data.size and np.array_equal(data, np.round(data)):
+            for dtype in (np.int8, np.int16, np.int32, np.int64):
+                if data.min() >= np.iinfo(dtype).min and data.max() <= np.iinfo(dtype).max:
+                    break
+            data = data.astype(dtype)
+        else:
+            data = data.astype(np.float32)
+        with self.open_atomic(file, "wb") as f:
+            np.save(f, data)
+        legacy_file = self.get_legacy_txt_file(file)
+        if os.path.exists(legacy_file):
+            os.remove(legacy_file)
+
+    def load_multiple_dim_array(self, file):
+        print("Loading data from {}".format(file if os.path.exists(file) else self.get_legacy_txt_file(file)))
+        if os.path.exists(file):
+            data = np.load(file, mmap_mode='r')
+        else:
+            data = self.load_multiple_dim_array_from_txt(self.get_legacy_txt_file(file))
+        return data.astype(np.float32)
 
     def load_multiple_dim_array_from_txt(self, file):
         with open(file) as f:
@@ -168,8 +862,19 @@ class TestSettings(ABC):
             data = np.genfromtxt(f, delimiter=',').reshape(shape)
         return data.astype(np.float32)
 
+    def convert_pregenerated_data(self):
+        """
+        Convert the legacy .txt files of the test set to .npy.
+        """
+        for file in (self.kernel_table_file, self.inputs_table_file, self.bias_table_file,
+                     getattr(self, 'time_table_file', None)):
+            if file is None or os.path.exists(file) or not os.path.exists(self.get_legacy_txt_file(file)):
+                continue
+            print("Converting {} to {}".format(self.get_legacy_txt_file(file), file))
+            self.save_multiple_dim_array(file, self.load_multiple_dim_array_from_txt(self.get_legacy_txt_file(file)))
+
     def convert_tensor_np(self, tensor_in, converter, *qminmax):
-        w = tensor_in.numpy()
+        w = np.asarray(tensor_in)
         shape = w.shape
         w = w.ravel()
         if len(qminmax) == 2:
@@ -177,10 +882,10 @@ class TestSettings(ABC):
         else:
             fw = converter(w)
         fw.shape = shape
-        return tf.convert_to_tensor(fw)
+        return fw
 
     def convert_tensor(self, tensor_in, converter, *qminmax):
-        w = tensor_in.numpy()
+        w = np.asarray(tensor_in)
         shape = w.shape
         w = w.ravel()
         normal = np.array(w)
@@ -195,37 +900,48 @@ class TestSettings(ABC):
         np_float_array = np.asarray(float_normal)
         np_float_array.shape = shape
 
-        return tf.convert_to_tensor(np_float_array)
+        return np_float_array
 
+    @profiled('data')
     def get_randomized_data(self, dims, npfile, regenerate, decimals=0, minrange=None, maxrange=None):
         if not minrange:
             minrange = self.mins
         if not maxrange:
             maxrange = self.maxs
-        if not os.path.exists(npfile) or regenerate:
+        if not self.pregenerated_data_exists(npfile) or regenerate:
             regendir = os.path.dirname(npfile)
             os.makedirs(regendir, exist_ok=True)
+            rng = self.get_random_generator(npfile)
             if decimals == 0:
-                data = tf.Variable(tf.random.uniform(dims, minval=minrange, maxval=maxrange, dtype=tf.dtypes.int64))
-                data = tf.cast(data, dtype=tf.float32)
+                # Generated directly in the smallest integer type that holds the range, maxrange is exclusive.
+                dtype = next(dtype for dtype in (np.int8, np.int16, np.int32, np.int64)
+                             if minrange >= np.iinfo(dtype).min and maxrange - 1 <= np.iinfo(dtype).max)
+                data = rng.integers(minrange, maxrange, size=dims, dtype=dtype)
             else:
-                data = tf.Variable(tf.random.uniform(dims, minval=minrange, maxval=maxrange, dtype=tf.dtypes.float32))
-                data = np.around(data.numpy(), decimals)
-                data = tf.convert_to_tensor(data)
+                data = rng.random(dims, dtype=np.float32) * np.float32(maxrange - minrange) + np.float32(minrange)
+                data = np.around(data, decimals)
 
             print("Saving data to {}".format(npfile))
-            self.save_multiple_dim_array_in_txt(npfile, data.numpy())
+            self.save_multiple_dim_array(npfile, data)
+            data = data.astype(np.float32)
         else:
-            print("Loading data from {}".format(npfile))
-            data = tf.convert_to_tensor(self.load_multiple_dim_array_from_txt(npfile))
+            data = self.load_multiple_dim_array(npfile)
         return data
 
+    def get_random_generator(self, npfile):
+        """
+        Random number generator for a pregenerated data file, seeded from the test set name, the file name and
+        --seed. Regenerating data with the same seed gives the same data.
+        """
+        seed = hashlib.sha256("{}/{}/{}".format(self.testdataset, os.path.basename(npfile), self.seed).encode())
+        return np.random.default_rng(int.from_bytes(seed.digest()[:8], 'little'))
+
     def get_randomized_input_data(self, input_data, input_shape=None):
         # Generate or load saved input data unless hardcoded data provided
         if input_shape is None:
             input_shape = [self.batches, self.y_input, self.x_input, self.input_ch]
         if input_data is not None:
-            input_data = tf.reshape(input_data, input_shape)
+            input_data = np.reshape(input_data, input_shape)
         else:
             input_data = self.get_randomized_data(input_shape,
                                                   self.inputs_table_file,
@@ -235,9 +951,9 @@ class TestSettings(ABC):
     def get_randomized_bias_data(self, biases):
         # Generate or load saved bias data unless hardcoded data provided
         if not self.generate_bias:
-            biases = tf.reshape(np.full([self.output_ch], 0), [self.output_ch])
+            biases = np.reshape(np.full([self.output_ch], 0), [self.output_ch])
         elif biases is not None:
-            biases = tf.reshape(biases, [self.output_ch])
+            biases = np.reshape(biases, [self.output_ch])
         else:
             biases = self.get_randomized_data([self.output_ch],
                                               self.bias_table_file,
@@ -246,6 +962,7 @@ class TestSettings(ABC):
                                               maxrange=self.bias_maxs)
         return biases
 
+    @profiled('format')
     def format_output_file(self, file):
         command_list = CLANG_FORMAT.split(' ')
         command_list.append(file)
@@ -254,16 +971,20 @@ class TestSettings(ABC):
             print("ERROR: {} failed".format(command_list))
             sys.exit(1)
 
+    @profiled('write')
     def write_c_header_wrapper(self):
         filename = "test_data.h"
         filepath = self.headers_dir + filename
 
         print("Generating C header wrapper {}...".format(filepath))
-        with open(filepath, 'w+') as f:
+        with self.open_atomic(filepath, format_output=True) as f:
             f.write(self.tensor_flow_reference_version)
             while len(self.generated_header_files) > 0:
                 f.write('#include "{}"\n'.format(self.generated_header_files.pop()))
-        self.format_output_file(filepath)
+            if self.pooled_arrays:
+                f.write("\n")
+            while len(self.pooled_arrays) > 0:
+                f.write("#define {} {}\n".format(*self.pooled_arrays.pop(0)))
 
     def write_common_config(self, f, prefix):
         """
@@ -282,6 +1003,7 @@ class TestSettings(ABC):
         f.write(self.tensor_flow_reference_version)
         f.write("#pragma once\n")
 
+    @profiled('write')
     def write_c_config_header(self, write_common_parameters=True):
         filename = self.config_data
 
@@ -291,7 +1013,7 @@ class TestSettings(ABC):
         prefix = self.testdataset.upper()
 
         print("Writing C header with config data {}...".format(filepath))
-        with open(filepath, "w+") as f:
+        with self.open_atomic(filepath, format_output=True) as f:
             self.write_c_common_header(f)
             if (write_common_parameters):
                 f.write("#define {}_OUT_CH {}\n".format(prefix, self.output_ch))
@@ -304,38 +1026,255 @@ class TestSettings(ABC):
                 f.write("#define {}_OUT_ACTIVATION_MIN {}\n".format(prefix, self.out_activation_min))
                 f.write("#define {}_OUT_ACTIVATION_MAX {}\n".format(prefix, self.out_activation_max))
                 f.write("#define {}_INPUT_BATCHES {}\n".format(prefix, self.batches))
-        self.format_output_file(filepath)
+            if self.binary_arrays:
+                f.write("#define {}_BIN_ALIGNMENT {}\n".format(prefix, BINARY_DATA_ALIGNMENT))
+                for name, size in self.binary_arrays:
+                    f.write("#define {}_{}_BIN_SIZE {}\n".format(prefix, name.upper(), size))
 
+    def get_column_formats(self, item_lengths, end_of_line_lengths):
+        """
+        Returns the possible column layouts of a braced list as (columns, column_sizes, line_count, total_width),
+        following CommaSeparatedList::precomputeFormattingInformation() in clang-format.
+        """
+        formats = []
+        n_items = item_lengths.size
+        for columns in range(1, min(CLANG_FORMAT_COLUMN_LIMIT // 3, n_items) + 1):
+            line_count = -(-n_items // columns)
+            lengths = item_lengths.copy()
+            lengths[columns - 1::columns] = end_of_line_lengths[columns - 1::columns]
+            # One row per line, padded with empty items that do not affect the sizes.
+            padding = line_count * columns - n_items
+            column_sizes = np.pad(lengths, (0, padding)).reshape(line_count, columns).max(axis=0)
+            min_sizes = np.pad(lengths, (0, padding), constant_values=CLANG_FORMAT_COLUMN_LIMIT).reshape(
+                line_count, columns).min(axis=0)
+            total_width = columns - 1 + column_sizes.sum()
+            # Too much whitespace in a column or too wide.
+            if np.any(column_sizes[:-1] - min_sizes[:-1] > 10):
+                continue
+            if total_width > CLANG_FORMAT_COLUMN_LIMIT and columns > 1:
+                continue
+            formats.append((columns, column_sizes, line_count, total_width))
+        return formats
+
+    def get_column_format(self, formats, remaining_width):
+        """
+        Pick the column layout that clang-format would use, see CommaSeparatedList::getColumnFormat().
+        """
+        best_format = None
+        for column_format in reversed(formats):
+            (columns, column_sizes, line_count, total_width) = column_format
+            if total_width <= remaining_width or columns == 1:
+                if best_format and line_count > best_format[2]:
+                    break
+                best_format = column_format
+        return best_format
+
+    def get_item_lengths(self, items):
+        """
+        Number of characters of each integer of items when printed, without converting them to strings.
+        """
+        digits = np.searchsorted(10 ** np.arange(1, 19, dtype=np.int64), np.abs(items), side='right') + 1
+        return digits + (items < 0)
+
+    def format_c_array(self, declaration, array):
+        """
+        Format the array declaration and its values the way clang-format would, so that the generated headers do not
+        need to be formatted afterwards. The declaration should end with the opening brace. The text is yielded in
+        pieces of at most C_ARRAY_LINES_PER_WRITE lines, so that large arrays are never held as text in memory.
+        """
+        items = np.asarray(array).ravel().astype(np.int64)
+        n_items = items.size
+        lengths = self.get_item_lengths(items)
+
+        if len(declaration) + lengths.sum() + 2 * n_items <= CLANG_FORMAT_COLUMN_LIMIT:
+            yield declaration + ', '.join(items.astype(str).tolist()) + '};\n'
+            return
+
+        indent = ' ' * CLANG_FORMAT_CONTINUATION_INDENT
+        if n_items < 20:
+            items = items.astype(str)
+            wrapped = indent + '{' + ', '.join(items.tolist()) + '};'
+            aligned_fits = len(declaration) + lengths.max() + 2 <= CLANG_FORMAT_COLUMN_LIMIT
+            items = [item + ',' for item in items.tolist()]
+            items[-1] = items[-1][:-1] + '};'
+
+            # Short lists are not laid out in columns, but either wrapped after the assignment or one item per line.
+            if len(wrapped) <= CLANG_FORMAT_COLUMN_LIMIT and (n_items > 5 or not aligned_fits):
+                yield declaration[:-2] + '\n' + wrapped + '\n'
+            elif aligned_fits:
+                yield declaration + ('\n' + ' ' * len(declaration)).join(items) + '\n'
+            else:
+                yield declaration + '\n' + indent + ('\n' + indent).join(items) + '\n'
+            return
+
+        # The comma is part of the item. The closing brace and semicolon must stay on the same line as the last item.
+        item_lengths = lengths + 1
+        item_lengths[-1] -= 1
+        end_of_line_lengths = item_lengths.copy()
+        end_of_line_lengths[-1] += 2
+        formats = self.get_column_formats(item_lengths, end_of_line_lengths)
+
+        # Either continue on the line of the declaration or break after the opening brace, whichever has the fewest
+        # lines.
+        aligned_format = self.get_column_format(formats, CLANG_FORMAT_COLUMN_LIMIT - len(declaration))
+        indented_format = self.get_column_format(formats, CLANG_FORMAT_COLUMN_LIMIT - len(indent))
+        if aligned_format is not None and aligned_format[2] <= indented_format[2] + 1:
+            (columns, column_sizes, line_count, total_width) = aligned_format
+            first_line = declaration
+            indent = ' ' * len(declaration)
+        else:
+            (columns, column_sizes, line_count, total_width) = indented_format
+            first_line = declaration + '\n' + indent
+
+        yield first_line
+        block_size = columns * C_ARRAY_LINES_PER_WRITE
+        for start in range(0, n_items, block_size):
+            block = [item + ',' for item in items[start:start + block_size].astype(str).tolist()]
+            if start + block_size >= n_items:
+                block[-1] = block[-1][:-1] + '};'
+            cells = [cell.ljust(width) for cell, width in zip(block, itertools.cycle((column_sizes + 1).tolist()))]
+            rows = [''.join(cells[i:i + columns]).rstrip() for i in range(0, len(cells), columns)]
+            yield ('\n' + indent if start else '') + ('\n' + indent).join(rows)
+        yield '\n'
+
+    @profiled('write')
     def generate_c_array(self, name, array, datatype="q7_t", const="const "):
+        if self.captured_arrays is not None:
+            # The values as they are written to the header.
+            self.captured_arrays[name] = (datatype, np.asarray(array).ravel().astype(np.int64))
+            return
+
         os.makedirs(self.headers_dir, exist_ok=True)
 
-        w = None
-        if type(array) is list:
-            w = array
-            size = len(array)
-        elif type(array) is np.ndarray:
-            w = array
-            w = w.ravel()
-            size = w.size
-        else:
-            w = array.numpy()
-            w = w.ravel()
-            size = tf.size(array)
+        w = np.asarray(array).ravel()
+        size = w.size
         filename = name + "_data.h"
         filepath = self.headers_dir + filename
+        symbol = self.testdataset + '_' + name
+
+        # Only constant arrays are pooled, as the pooled array is shared by all test sets that use it.
+        pooled = self.dedup_data and const
+        binary_filepath = self.headers_dir + name + "_data.bin"
+        if os.path.exists(binary_filepath) and (pooled or not self.binary_data):
+            os.remove(binary_filepath)
+
+        if pooled:
+            if os.path.exists(filepath):
+                os.remove(filepath)
+            pooled_filename, pooled_symbol = self.generate_pooled_array(w, datatype, const)
+            self.generated_header_files.append("../" + self.POOL_DIR + pooled_filename)
+            self.pooled_arrays.append((symbol, pooled_symbol))
+            return
 
         self.generated_header_files.append(filename)
+        if self.binary_data:
+            prefix = self.testdataset.upper()
+            data = self.get_binary_data(name, w, datatype)
+            self.binary_arrays.append((name, size))
+            self.write_binary_array(self.headers_dir, name + "_data", symbol, data, datatype, const,
+                                    size="{}_{}_BIN_SIZE".format(prefix, name.upper()),
+                                    alignment="{}_BIN_ALIGNMENT".format(prefix),
+                                    config_data=self.config_data)
+        else:
+            self.write_c_array(filepath, symbol, w, datatype, const)
 
+    def write_c_array(self, filepath, symbol, array, datatype, const, weak=False):
         print("Generating C header {}...".format(filepath))
-        with open(filepath, "w+") as f:
-            self.write_c_common_header(f)
-            f.write("#include <stdint.h>\n\n")
-            f.write(const + datatype + " " + self.testdataset + '_' + name + "[%d] =\n{\n" % size)
-            for i in range(size - 1):
-                f.write("  %d,\n" % w[i])
-            f.write("  %d\n" % w[size - 1])
-            f.write("};\n")
-        self.format_output_file(filepath)
+        declaration = const + datatype + " " + symbol + "[%d] = {" % array.size
+        if weak:
+            declaration = "__attribute__((weak)) " + declaration
+        with self.open_atomic(filepath) as f:
+            f.write(self.tensor_flow_reference_version + "#pragma once\n#include <stdint.h>\n\n")
+            f.writelines(self.format_c_array(declaration, array))
+
+    def generate_pooled_array(self, array, datatype, const):
+        """
+        Write the array to the pool of arrays shared by all test sets, unless an identical array is already there.
+        Pooled arrays are named by a hash of their type and values, so identical arrays of different test sets end up
+        in the same header. The test_data.h of the test set includes it and defines the name of the array in the test
+        set as the pooled symbol. The pooled array is a weak symbol, and with --binary-data also in a COMDAT section,
+        so test sets sharing it can be compiled separately and linked into one image, see check_pooled_arrays_link().
+        Returns the file name and the symbol of the pooled array.
+        """
+        values = array.astype(np.int64)
+        key = hashlib.sha256()
+        key.update("{}{} {} {}".format(const, datatype, "binary" if self.binary_data else "text",
+                                       self.POOL_FORMAT).encode())
+        key.update(values.tobytes())
+        stem = key.hexdigest()[:16]
+        symbol = "cmsis_nn_pool_" + stem
+        directory = self.OUTDIR + self.POOL_DIR
+
+        filename = stem + "_data.h"
+        if not os.path.exists(directory + filename):
+            if self.binary_data:
+                data = self.get_binary_data(symbol, values, datatype)
+                self.write_binary_array(directory, stem + "_data", symbol, data, datatype, const, size=data.size,
+                                        alignment=BINARY_DATA_ALIGNMENT, weak=True)
+            else:
+                self.write_c_array(directory + filename, symbol, values, datatype, const, weak=True)
+        return filename, symbol
+
+    def get_binary_data(self, name, array, datatype):
+        if datatype not in BINARY_DATA_TYPES:
+            raise RuntimeError("Data type {} of {} cannot be written as binary data".format(datatype, name))
+        values = array.astype(np.int64)
+        data = values.astype(BINARY_DATA_TYPES[datatype])
+        if not np.array_equal(data, values):
+            raise RuntimeError("Array {} does not fit in {}".format(name, datatype))
+        return data
+
+    def write_binary_array(self, directory, stem, symbol, data, datatype, const, size, alignment, config_data=None,
+                           weak=False):
+        """
+        Write the array as a raw little-endian .bin file and a header declaring it, which pulls the file into the
+        object with the .incbin directive of the assembler. The size and alignment of the array are C expressions,
+        e.g. defined in config_data.h, and the directory of the .bin files is given by CMSIS_NN_TEST_DATA_DIR, which
+        the CMake build of the unit tests defines. This is supported by ELF targets only. A weak array is put in a
+        COMDAT section of its own, so the linker keeps one copy of it when several objects define it.
+        """
+        filename = stem + ".bin"
+        filepath = directory + filename
+        print("Generating binary data {}...".format(filepath))
+        with self.open_atomic(filepath, "wb") as f:
+            f.write(data.tobytes())
+
+        section = '.rodata' if const else '.data'
+        if weak:
+            section = '{}.{},"{}G",%progbits,{},comdat'.format(section, symbol, 'a' if const else 'aw', symbol)
+        header = directory + stem + ".h"
+        print("Generating C header {}...".format(header))
+        with self.open_atomic(header) as f:
+            f.write(self.tensor_flow_reference_version + "#pragma once\n#include <stdint.h>\n\n")
+            if config_data:
+                f.write('#include "{}"\n\n'.format(config_data))
+            f.write("#ifndef CMSIS_NN_TEST_DATA_DIR\n"
+                    "#error \"CMSIS_NN_TEST_DATA_DIR must be defined to include binary test data\"\n"
+                    "#endif\n"
+                    "#ifndef CMSIS_NN_TEST_DATA_STR\n"
+                    "#define CMSIS_NN_TEST_DATA_STR_(x) #x\n"
+                    "#define CMSIS_NN_TEST_DATA_STR(x) CMSIS_NN_TEST_DATA_STR_(x)\n"
+                    "#endif\n\n")
+            f.write("extern {}{} {}[{}];\n\n".format(const, datatype, symbol, size))
+            f.write('__asm__(".pushsection {}\\n"\n'.format(section.replace('"', '\\"')))
+            f.write('        ".{} {}\\n"\n'.format('weak' if weak else 'global', symbol))
+            f.write('        ".type {}, %object\\n"\n'.format(symbol))
+            f.write('        ".balign " CMSIS_NN_TEST_DATA_STR({}) "\\n"\n'.format(alignment))
+            f.write('        "{}:\\n"\n'.format(symbol))
+            f.write('        ".incbin \\"" CMSIS_NN_TEST_DATA_DIR "/{}\\"\\n"\n'.format(
+                os.path.relpath(filepath, self.OUTDIR)))
+            f.write('        ".size {0}, . - {0}\\n"\n'.format(symbol))
+            f.write('        ".popsection\\n");\n')
+
+    def get_output_dims(self):
+        """
+        Output width and height, same as TensorFlow for SAME and VALID padding.
+        """
+        if self.has_padding:
+            return -(-self.x_input // self.stride_x), -(-self.y_input // self.stride_y)
+        filter_x = (self.filter_x - 1) * self.dilation_x + 1
+        filter_y = (self.filter_y - 1) * self.dilation_y + 1
+        return -(-(self.x_input - filter_x + 1) // self.stride_x), -(-(self.y_input - filter_y + 1) // self.stride_y)
 
     def set_output_dims_and_padding(self, output_x, output_y):
         self.x_output = output_x
@@ -364,6 +1303,133 @@ class TestSettings(ABC):
         significand_q31 = round(significand * (1 << 31))
         return significand_q31, shift
 
+    def round_away_from_zero(self, data):
+        """
+        Round half away from zero like std::round(), unlike np.round() that rounds half to even.
+        """
+        data = np.asarray(data, dtype=np.float64)
+        return np.sign(data) * np.floor(np.abs(data) + 0.5)
+
+    def get_activation_quantization(self, rmin, rmax):
+        """
+        Scale and zero point of an activation tensor with the calibrated range [rmin, rmax], computed in float32 the
+        same way as the TFLite converter. Asymmetric for int8 and symmetric for int16.
+        """
+        rmin = np.float32(min(rmin, 0))
+        rmax = np.float32(max(rmax, 0))
+        if self.is_int16xint8:
+            return float(max(abs(rmin), abs(rmax)) / np.float32(INT16_MAX)), 0
+
+        scale = (rmax - rmin) / np.float32(INT8_MAX - INT8_MIN)
+        if scale == 0:
+            return 0.0, INT8_MIN
+        zero_point_from_min = np.float32(INT8_MIN) - rmin / scale
+        zero_point = int(np.clip(self.round_away_from_zero(zero_point_from_min), INT8_MIN, INT8_MAX))
+        return float(scale), zero_point
+
+    def get_inverse_scales(self, scales):
+        """
+        Like the TFLite converter, values are quantized by multiplying with the inverse of the scale as a float32,
+        or with zero if the scale is zero.
+        """
+        scales = np.asarray(scales, dtype=np.float64)
+        with np.errstate(divide='ignore'):
+            return np.where(scales > 0, 1.0 / scales, 0).astype(np.float32)
+
+    def quantize_per_channel(self, weights, biases=None):
+        """
+        Symmetric per channel quantization of weights to int8, with the channels in the last dimension.
+        Returns the quantized weights and the scale of each channel. Like the TFLite converter, the scale of a channel
+        is increased if its bias would not fit in the quantized bias otherwise, which requires self.input_scale.
+        """
+        weights = np.asarray(weights, dtype=np.float32)
+        scales = np.abs(weights.reshape(-1, weights.shape[-1])).max(axis=0) / np.float32(INT8_MAX)
+        if biases is not None:
+            abs_biases = np.abs(np.asarray(biases, dtype=np.float32))
+            input_scale = np.float32(self.input_scale)
+            # The adjusted scale is computed in double and stored as the range of the channel, from which the scale
+            # is then derived in float32.
+            adjusted_max = (2.0 * abs_biases.astype(np.float64) / (INT32_MAX * np.float64(input_scale)) *
+                            INT8_MAX).astype(np.float32)
+            # A channel of all zero weights has a zero scale, which is adjusted if it has a nonzero bias.
+            with np.errstate(divide='ignore', invalid='ignore'):
+                scales = np.where(abs_biases / (input_scale * scales) > 0.5 * INT32_MAX,
+                                  adjusted_max / np.float32(INT8_MAX), scales)
+        quantized = weights * self.get_inverse_scales(scales)
+        return np.clip(self.round_away_from_zero(quantized), -INT8_MAX, INT8_MAX).astype(np.int8), scales
+
+    def quantize_bias(self, biases, scales):
+        """
+        Quantize biases with the scale input_scale * weight scale of each channel, to int64 for int16 activations
+        and to int32 otherwise.
+        """
+        bias_scales = np.float32(self.input_scale) * scales
+        quantized = np.asarray(biases, dtype=np.float32) * self.get_inverse_scales(bias_scales)
+        return self.round_away_from_zero(quantized).astype(np.int64 if self.is_int16xint8 else np.int32)
+
+    def saturating_rounding_doubling_high_mul(self, a, b):
+        """
+        Vectorized SaturatingRoundingDoublingHighMul() of gemmlowp, on int32 values held in int64 arrays.
+        """
+        a = np.asarray(a, dtype=np.int64)
+        b = np.asarray(b, dtype=np.int64)
+        product = a * b
+        product = product + np.where(product >= 0, 1 << 30, 1 - (1 << 30))
+        # Division that rounds towards zero.
+        high = np.where(product >= 0, product >> 31, -((-product) >> 31))
+        return np.where((a == INT32_MIN) & (b == INT32_MIN), INT32_MAX, high)
+
+    def rounding_divide_by_pot(self, x, exponent):
+        """
+        Vectorized RoundingDivideByPOT() of gemmlowp.
+        """
+        x = np.asarray(x, dtype=np.int64)
+        exponent = np.asarray(exponent, dtype=np.int64)
+        mask = (np.int64(1) << exponent) - 1
+        threshold = (mask >> 1) + (x < 0)
+        return (x >> exponent) + ((x & mask) > threshold)
+
+    def saturating_left_shift(self, x, exponent):
+        """
+        Vectorized SaturatingRoundingMultiplyByPOT() of gemmlowp for a positive exponent.
+        """
+        x = np.asarray(x, dtype=np.int64)
+        threshold = (1 << (31 - exponent)) - 1
+        return np.where(x > threshold, INT32_MAX, np.where(x < -threshold, INT32_MIN, x << exponent))
+
+    def multiply_by_quantized_multiplier(self, acc, multiplier, shift):
+        """
+        Vectorized MultiplyByQuantizedMultiplier() of the TFLite reference kernels for int32 values.
+        """
+        acc = np.asarray(acc, dtype=np.int64) * (np.int64(1) << np.maximum(shift, 0))
+        return self.rounding_divide_by_pot(self.saturating_rounding_doubling_high_mul(acc, multiplier),
+                                           np.maximum(-np.asarray(shift, dtype=np.int64), 0))
+
+    def multiply_by_quantized_multiplier_int64(self, acc, multiplier, shift):
+        """
+        Vectorized MultiplyByQuantizedMultiplier() of the TFLite reference kernels for int64 values, which uses a
+        reduced multiplier.
+        """
+        acc = np.asarray(acc, dtype=np.int64)
+        multiplier = np.asarray(multiplier, dtype=np.int64)
+        reduced_multiplier = np.where(multiplier < 0x7FFF0000, (multiplier + (1 << 15)) >> 16, 0x7FFF)
+        total_shift = 15 - np.asarray(shift, dtype=np.int64)
+        return (acc * reduced_multiplier + (np.int64(1) << (total_shift - 1))) >> total_shift
+
+    def requantize(self, acc, scaling_factors):
+        """
+        Scale accumulators to the output with the per channel multipliers that
+        generate_quantize_per_channel_multiplier() emits, add the output offset and clamp to the output type. The
+        int64 accumulators of int16 activations use the 64 bit variant of MultiplyByQuantizedMultiplier().
+        """
+        effective_scales = self.input_scale * np.asarray(scaling_factors, dtype=np.float64) / self.output_scale
+        (multipliers, shifts) = zip(*map(self.quantize_scale, effective_scales))
+        if self.is_int16xint8:
+            output = self.multiply_by_quantized_multiplier_int64(acc, multipliers, shifts) + self.output_zero_point
+            return np.clip(output, INT16_MIN, INT16_MAX).astype(np.int16)
+        output = self.multiply_by_quantized_multiplier(acc, multipliers, shifts) + self.output_zero_point
+        return np.clip(output, INT8_MIN, INT8_MAX).astype(np.int8)
+
     def get_convolving_calib_data_func(self, n_inputs):
         def representative_data_gen():
             representative_testsets = []
@@ -377,34 +1443,120 @@ class TestSettings(ABC):
                                    format(self.test_type))
         return representative_data_gen
 
-    def convert_and_interpret(self, model, inttype, input_data=None):
+    def get_cache_key(self, inttype, input_data, cache_data, topology=False):
         """
-        Compile and convert a model to Tflite format, run interpreter and allocate tensors.
+        Hash of everything that the converted model and the reference output depend on: the settings, the data fed
+        to the model, the TensorFlow version and the source code creating the model. With topology set, only the
+        shapes of the data are included and the attributes that only affect the data are left out, so all models of
+        the same operator and shapes get the same key. The source code patching such a model is included instead.
         """
-        model.compile(loss=tf.keras.losses.categorical_crossentropy,
-                      optimizer=tf.keras.optimizers.Adam(),
-                      metrics=['accuracy'])
-        n_inputs = len(model.inputs)
+        exclude = self.CACHE_KEY_EXCLUDE + (self.TOPOLOGY_KEY_EXCLUDE if topology else [])
+        params = {name: value for name, value in vars(self).items()
+                  if name not in exclude and isinstance(value, (bool, int, float, str, type(None)))}
+
+        key = hashlib.sha256()
+        key.update(json.dumps(params, sort_keys=True).encode())
+        key.update(tf.__version__.encode())
+        key.update(tf.as_dtype(inttype).name.encode())
+        sources = (type(self), TestSettings.convert_and_interpret, TestSettings.convert_model,
+                   TestSettings.get_convolving_calib_data_func)
+        if topology:
+            sources += (TestSettings, TFLiteModelPatcher)
+        for source in sources:
+            key.update(get_source_code(source).encode())
+        for data in (input_data, ) + tuple(cache_data):
+            if data is None:
+                key.update(b'None')
+            else:
+                data = np.asarray(data, dtype=np.float32)
+                key.update(str(data.shape).encode())
+                if not topology:
+                    key.update(data.tobytes())
+        return ('topology_' if topology else '') + key.hexdigest()
 
-        converter = tf.lite.TFLiteConverter.from_keras_model(model)
-        converter.optimizations = [tf.lite.Optimize.DEFAULT]
-        converter.representative_dataset = self.get_convolving_calib_data_func(n_inputs)
-        if self.is_int16xint8:
-            converter.target_spec.supported_ops = [
-                tf.lite.OpsSet.EXPERIMENTAL_TFLITE_BUILTINS_ACTIVATIONS_INT16_WEIGHTS_INT8]
+    def get_pregenerated_data_hash(self):
+        """
+        Hash of the names and content of the pregenerated data files of the test set and of its model template.
+        """
+        files = []
+        directory = self.pregenerated_data_dir + self.testdataset
+        if os.path.isdir(directory):
+            files = [os.path.join(directory, name) for name in sorted(os.listdir(directory))]
+        if getattr(self, 'json_template', None):
+            files.append(self.json_template)
+        key = hashlib.sha256()
+        for file in files:
+            key.update(file.encode())
+            with open(file, 'rb') as f:
+                key.update(f.read())
+        return key.hexdigest()
+
+    def get_manifest_state(self):
+        """
+        What the generated test set depends on, see TestDataManifest. It must be called before generate_data(),
+        which adds attributes of its own.
+        """
+        params = {name: value for name, value in vars(self).items()
+                  if name not in self.MANIFEST_EXCLUDE and isinstance(value, (bool, int, float, str, type(None)))}
+        source = hashlib.sha256()
+        for cls in type(self).__mro__:
+            if issubclass(cls, TestSettings):
+                source.update(get_source_code(cls).encode())
+        return {
+            'parameters': hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest(),
+            'pregenerated_data': self.get_pregenerated_data_hash(),
+            'source': source.hexdigest(),
+            'reference': ' '.join(self.get_reference_version()),
+        }
+
+    def convert_and_interpret(self, create_model, inttype, input_data=None, cache_data=(), patch_model=None):
+        """
+        Compile and convert a model to Tflite format, run interpreter and allocate tensors.
+        create_model() should return the Keras model. It is not called if the converted model is found in the model
+        cache. Any data that the model depends on, e.g. weights and biases, should be passed in cache_data.
+        patch_model(patcher) should patch everything of the model that depends on the data with a TFLiteModelPatcher.
+        If given, a converted model is also cached by topology and models with the same topology but other data are
+        patched instead of converted.
+        """
+        cached = None
+        topology = None
+        topology_key = None
+        self.cached_output = None
+        if self.model_cache:
+            self.cache_key = self.get_cache_key(inttype, input_data, cache_data)
+            cached = self.model_cache.load(self.cache_key)
+            if not cached and patch_model:
+                topology_key = self.get_cache_key(inttype, input_data, cache_data, topology=True)
+                topology = self.model_cache.load(topology_key)
+
+        if cached:
+            print("Using cached model {}".format(self.model_cache.entry_dir(self.cache_key)))
+            (tflite_model, quantization, self.cached_output) = cached
+        elif topology:
+            print("Patching cached model {}".format(self.model_cache.entry_dir(topology_key)))
+            patcher = TFLiteModelPatcher(topology[0])
+            patch_model(patcher)
+            tflite_model = patcher.get_model()
+        elif self.model_request_only:
+            raise ModelRequest(create_model, inttype, self.cache_key)
         else:
-            converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
-        converter.inference_input_type = inttype
-        converter.inference_output_type = inttype
-        tflite_model = converter.convert()
+            with self.profile('model'):
+                model = create_model()
+            tflite_model = self.convert_model(model, inttype, self.get_convolving_calib_data_func(len(model.inputs)))
 
-        os.makedirs(os.path.dirname(self.model_path_tflite), exist_ok=True)
-        with open(self.model_path_tflite, "wb") as model:
+            if topology_key:
+                self.store_topology(topology_key, tflite_model, patch_model)
+
+        with self.open_atomic(self.model_path_tflite, "wb") as model:
             model.write(tflite_model)
 
-        interpreter = Interpreter(
-            model_path=str(self.model_path_tflite), experimental_op_resolver_type=OpResolverType.BUILTIN_REF)
-        interpreter.allocate_tensors()
+        with self.profile('interpret'):
+            interpreter = Interpreter(model_content=tflite_model,
+                                      experimental_op_resolver_type=OpResolverType.BUILTIN_REF)
+            interpreter.allocate_tensors()
+
+        if self.model_cache and not cached:
+            self.model_cache.store(self.cache_key, tflite_model, self.get_model_quantization(interpreter))
 
         output_details = interpreter.get_output_details()
         (self.output_scale, self.output_zero_point) = output_details[0]['quantization']
@@ -418,13 +1570,79 @@ class TestSettings(ABC):
 
         return interpreter
 
-    def generate_json_from_template(self, weights_feature_data=None, weights_time_data=None, bias_data=None):
+    @profiled('convert')
+    def convert_model(self, model, inttype, representative_dataset):
+        """
+        Compile a Keras model and convert it to a quantized TFLite model.
+        """
+        model.compile(loss=tf.keras.losses.categorical_crossentropy,
+                      optimizer=tf.keras.optimizers.Adam(),
+                      metrics=['accuracy'])
+
+        converter = tf.lite.TFLiteConverter.from_keras_model(model)
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = representative_dataset
+        if self.is_int16xint8:
+            converter.target_spec.supported_ops = [
+                tf.lite.OpsSet.EXPERIMENTAL_TFLITE_BUILTINS_ACTIVATIONS_INT16_WEIGHTS_INT8]
+        else:
+            converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+        converter.inference_input_type = tf.as_dtype(inttype)
+        converter.inference_output_type = tf.as_dtype(inttype)
+        return converter.convert()
+
+    def get_model_quantization(self, interpreter):
+        return {"inputs": [list(details['quantization']) for details in interpreter.get_input_details()],
+                "outputs": [list(details['quantization']) for details in interpreter.get_output_details()]}
+
+    def store_topology(self, topology_key, tflite_model, patch_model):
+        """
+        Cache a converted model by topology, if patching it with its own data gives exactly the converted model and
+        all its constant tensors are patched. That way a patched model is always the same as a converted one.
+        """
+        patcher = TFLiteModelPatcher(tflite_model)
+        try:
+            patch_model(patcher)
+        except RuntimeError as e:
+            print("Not caching model by topology: {}".format(e))
+            return
+        if patcher.get_model() != tflite_model or not patcher.all_constants_patched():
+            print("Not caching model by topology: patching does not reproduce the converted model")
+            return
+        self.model_cache.store(topology_key, tflite_model, {})
+
+    def get_filter_and_bias_details(self, interpreter):
+        """
+        Details of the filter and the bias tensor of a single layer model. These are the second and third tensor, in
+        an order that depends on the TensorFlow version and the type of the layer, and on whether the model was split
+        from a batched model, so the filter is told apart by having more dimensions.
+        """
+        (filter_layer, bias_layer) = interpreter.get_tensor_details()[1:3]
+        if len(filter_layer['shape']) < len(bias_layer['shape']):
+            return bias_layer, filter_layer
+        return filter_layer, bias_layer
+
+    @profiled('interpret')
+    def get_reference_output(self, interpreter):
         """
-        Takes a json template and parameters as input and creates a new json file.
+        Invoke the interpreter returned by convert_and_interpret() and return the first output tensor. The output is
+        taken from the model cache if available.
         """
-        generated_json_file = self.model_path + '.json'
+        if self.cached_output is not None:
+            return self.cached_output
 
-        with open(self.json_template, 'r') as in_file, open(generated_json_file, 'w') as out_file:
+        interpreter.invoke()
+        output_data = interpreter.get_tensor(interpreter.get_output_details()[0]["index"])
+        if self.model_cache:
+            self.model_cache.store_output(self.cache_key, output_data)
+        return output_data
+
+    @profiled('model')
+    def generate_model_from_template(self, weights_feature_data=None, weights_time_data=None, bias_data=None):
+        """
+        Takes a json template and parameters as input and returns the TFLite model as flatbuffer bytes.
+        """
+        with open(self.json_template, 'r') as in_file:
             # Update shapes, scales and zero points
             data = in_file.read()
             for item, to_replace in self.json_replacements.items():
@@ -432,52 +1650,33 @@ class TestSettings(ABC):
 
             data = json.loads(data)
 
-            # Update weights and bias data
-            if weights_feature_data is not None:
-                w_1_buffer_index = 1
-                data["buffers"][w_1_buffer_index]["data"] = self.to_bytes(weights_feature_data.numpy().ravel(), 1)
-            if weights_time_data is not None:
-                w_2_buffer_index = 2
-                data["buffers"][w_2_buffer_index]["data"] = self.to_bytes(weights_time_data.numpy().ravel(), 2)
-            if bias_data is not None:
-                bias_buffer_index = 3
-                data["buffers"][bias_buffer_index]["data"] = self.to_bytes(bias_data.numpy().ravel(), 4)
-
-            json.dump(data, out_file, indent=2)
-
-        return generated_json_file
-
-    def flatc_generate_tflite(self, json_input, schema):
-        flatc = 'flatc'
-        if schema is None:
-            raise RuntimeError("A schema file is required.")
-        command = "{} -o {} -c -b {} {}".format(flatc, self.headers_dir, schema, json_input)
-        command_list = command.split(' ')
-        process = subprocess.run(command_list)
-        if process.returncode != 0:
-            raise RuntimeError("The following command failed: {}. Did you install flatc?".format(command))
+        # Update weights and bias data
+        if weights_feature_data is not None:
+            w_1_buffer_index = 1
+            data["buffers"][w_1_buffer_index]["data"] = self.to_bytes(np.asarray(weights_feature_data).ravel(), 1)
+        if weights_time_data is not None:
+            w_2_buffer_index = 2
+            data["buffers"][w_2_buffer_index]["data"] = self.to_bytes(np.asarray(weights_time_data).ravel(), 2)
+        if bias_data is not None:
+            bias_buffer_index = 3
+            data["buffers"][bias_buffer_index]["data"] = self.to_bytes(np.asarray(bias_data).ravel(), 4)
+
+        return TFLiteModelBuilder().build(data)
 
     def to_bytes(self, tensor_data, type_size):
-        result_bytes = []
-
-        if type_size == 1:
-            tensor_type = np.uint8
-        elif type_size == 2:
-            tensor_type = np.uint16
-        elif type_size == 4:
-            tensor_type = np.uint32
-        else:
+        """
+        Returns the tensor data as little endian bytes, with each value wrapped to an unsigned type of type_size bytes.
+        """
+        if type_size not in (1, 2, 4):
             raise RuntimeError("Size not supported: {}".format(type_size))
 
-        for val in tensor_data:
-            for byte in int(tensor_type(val)).to_bytes(type_size, 'little'):
-                result_bytes.append(byte)
-
-        return result_bytes
+        return np.asarray(tensor_data).astype(np.int64).astype('<u{}'.format(type_size)).tobytes()
 
 
 class ConvSettings(TestSettings):
 
+    NUMPY_REFERENCE = True
+
     def __init__(self, dataset, testtype, args, in_ch=1, out_ch=1, x_in=7, y_in=7, w_x=3, w_y=3, stride_x=2, stride_y=2,
                  pad=True, randmin=INT8_MIN, randmax=INT8_MAX, batches=1, generate_bias=True, relu6=False,
                  out_activation_min=None, out_activation_max=None, int16xint8=False, bias_min=None,
@@ -504,7 +1703,7 @@ class ConvSettings(TestSettings):
         filepath = self.headers_dir + filename
         prefix = self.testdataset.upper()
 
-        with open(filepath, "a") as f:
+        with self.open_atomic(filepath, "a") as f:
             self.write_common_config(f, prefix)
             if self.test_type == 'depthwise_conv':
                 f.write("#define {}_CH_MULT {}\n".format(prefix, self.channel_multiplier))
@@ -522,7 +1721,8 @@ class ConvSettings(TestSettings):
             raise RuntimeError("Missing scaling factors")
 
         for i in range(num_channels):
-            effective_output_scale = self.input_scale * self.scaling_factors[i] / self.output_scale
+            # In double precision, same as the TFLite kernels.
+            effective_output_scale = float(self.input_scale) * float(self.scaling_factors[i]) / float(self.output_scale)
             (quantized_multiplier, shift) = self.quantize_scale(effective_output_scale)
 
             per_channel_multiplier.append(quantized_multiplier)
@@ -531,13 +1731,120 @@ class ConvSettings(TestSettings):
         self.generate_c_array("output_mult", per_channel_multiplier, datatype='int32_t')
         self.generate_c_array("output_shift", per_channel_shift, datatype='int32_t')
 
+    def get_patches(self, data, output_rows=slice(None)):
+        """
+        Returns the input window of every output position as an array of shape
+        [batches, output_y, output_x, filter_y, filter_x, channels], with zeros where the window is in the padding.
+        Only the output rows selected by the output_rows slice are included. set_output_dims_and_padding() must be
+        called first.
+        """
+        rows = (np.arange(self.y_output) * self.stride_y)[:, None] + np.arange(self.filter_y) * self.dilation_y
+        cols = (np.arange(self.x_output) * self.stride_x)[:, None] + np.arange(self.filter_x) * self.dilation_x
+
+        # Only the input rows of the selected output rows are padded. The rows are in padded coordinates.
+        rows = rows[output_rows]
+        (first, last) = (rows.min(), rows.max() + 1)
+        top = max(min(last, self.pad_y) - first, 0)
+        bottom = max(last - max(first, self.pad_y + self.y_input), 0)
+        start = min(max(first - self.pad_y, 0), self.y_input)
+        end = max(min(last - self.pad_y, self.y_input), start)
+        padded = np.pad(data[:, start:end], ((0, 0),
+                                             (top, bottom),
+                                             (self.pad_x, max(cols.max() + 1 - self.pad_x - self.x_input, 0)),
+                                             (0, 0)))
+        return padded[:, (rows - first)[:, None, :, None], cols[None, :, None, :], :]
+
+    def get_output_row_chunks(self):
+        """
+        Split the output rows into slices whose input windows, see get_patches(), take at most REFERENCE_CHUNK_SIZE
+        bytes per batch as int64.
+        """
+        row_size = self.x_output * self.filter_y * self.filter_x * self.input_ch * np.dtype(np.int64).itemsize
+        rows_per_chunk = max(REFERENCE_CHUNK_SIZE // row_size, 1)
+        return [slice(row, min(row + rows_per_chunk, self.y_output)) for row in range(0, self.y_output, rows_per_chunk)]
+
+    def convolve(self, data, weights, output_rows=slice(None)):
+        """
+        Convolve data with weights in the Keras layout, i.e. [filter_y, filter_x, input_ch, output_ch] for conv and
+        [filter_y, filter_x, input_ch, channel_multiplier] for depthwise conv. Only the output rows selected by the
+        output_rows slice are computed.
+        """
+        patches = self.get_patches(data, output_rows)
+        if self.test_type == 'depthwise_conv':
+            # Output channel i * channel_multiplier + m is input channel i convolved with filter m.
+            output = np.einsum('bhwyxi,yxim->bhwim', patches, weights)
+            return output.reshape(output.shape[:3] + (self.output_ch, ))
+        return np.tensordot(patches, weights, axes=([3, 4, 5], [0, 1, 2]))
+
+    def quantize_model(self, weights, biases):
+        """
+        Quantize the model with NumPy, bit exact to the TFLite converter. Returns the quantized weights in the Keras
+        layout and the quantized biases.
+        """
+        self.set_output_dims_and_padding(*self.get_output_dims())
+
+        # The representative dataset used for calibration is all ones, so one batch gives the same range as all.
+        calibration_data = np.ones((1, self.y_input, self.x_input, self.input_ch))
+        (calibration_min, calibration_max) = (np.inf, -np.inf)
+        for output_rows in self.get_output_row_chunks():
+            calibration_output = self.convolve(calibration_data, np.asarray(weights, dtype=np.float64),
+                                               output_rows) + np.asarray(biases)
+            calibration_min = min(calibration_min, calibration_output.min())
+            calibration_max = max(calibration_max, calibration_output.max())
+        (self.input_scale, self.input_zero_point) = self.get_activation_quantization(1.0, 1.0)
+        (self.output_scale, self.output_zero_point) = self.get_activation_quantization(calibration_min,
+                                                                                       calibration_max)
+
+        # Depthwise weights are quantized per output channel, i.e. with the input channels and the channel multiplier
+        # flattened, as in the [1, filter_y, filter_x, output_ch] filter of the TFLite model.
+        weights = np.asarray(weights)
+        (quantized_weights, self.scaling_factors) = self.quantize_per_channel(weights.reshape(-1, self.output_ch),
+                                                                              biases)
+        return quantized_weights.reshape(weights.shape), self.quantize_bias(biases, self.scaling_factors)
+
+    def get_tflite_weights(self, quantized_weights):
+        """
+        The quantized weights in the layout of the TFLite model, i.e. OHWI for conv and [1, filter_y, filter_x,
+        output_ch] for depthwise conv.
+        """
+        if self.test_type == 'depthwise_conv':
+            return quantized_weights.reshape((1, self.filter_y, self.filter_x, self.output_ch))
+        return quantized_weights.transpose(3, 0, 1, 2)
+
+    def patch_model(self, patcher, weights, biases):
+        (quantized_weights, quantized_biases) = self.quantize_model(weights, biases)
+        zero_points = np.zeros(self.output_ch, dtype=np.int64)
+        patcher.patch_constant(self.get_tflite_weights(quantized_weights), self.scaling_factors, zero_points)
+        patcher.patch_constant(quantized_biases, np.float32(self.input_scale) * self.scaling_factors, zero_points)
+        patcher.patch_output(self.output_scale, self.output_zero_point)
+
+    @profiled('reference')
+    def get_numpy_reference(self, input_data, weights, biases):
+        """
+        Quantize the model and compute the reference output with NumPy, bit exact to the TFLite converter and the
+        TFLite reference kernels. Returns the quantized weights and biases and the output.
+        """
+        (quantized_weights, quantized_biases) = self.quantize_model(weights, biases)
+
+        # Computed per batch and chunk of output rows, see get_output_row_chunks().
+        input_data = np.asarray(input_data)
+        output = np.empty((self.batches, self.y_output, self.x_output, self.output_ch),
+                          dtype=np.int16 if self.is_int16xint8 else np.int8)
+        for batch in range(self.batches):
+            batch_data = input_data[batch:batch + 1].astype(np.int64) - self.input_zero_point
+            for output_rows in self.get_output_row_chunks():
+                acc = self.convolve(batch_data, quantized_weights.astype(np.int64), output_rows) + quantized_biases
+                output[batch:batch + 1, output_rows] = self.requantize(acc, self.scaling_factors)
+
+        return self.get_tflite_weights(quantized_weights), quantized_biases, output
+
     def generate_data(self, input_data=None, weights=None, biases=None):
         if self.is_int16xint8:
-            inttype = tf.int16
+            inttype = np.int16
             datatype = "q15_t"
             bias_datatype = "int64_t"
         else:
-            inttype = tf.int8
+            inttype = np.int8
             datatype = "q7_t"
             bias_datatype = "int32_t"
 
@@ -549,7 +1856,7 @@ class ConvSettings(TestSettings):
             out_channel = self.channel_multiplier
 
         if weights is not None:
-            weights = tf.reshape(weights, [self.filter_y, self.filter_x, self.input_ch, out_channel])
+            weights = np.reshape(weights, [self.filter_y, self.filter_x, self.input_ch, out_channel])
         else:
             weights = self.get_randomized_data([self.filter_y, self.filter_x, self.input_ch, out_channel],
                                                self.kernel_table_file,
@@ -557,58 +1864,70 @@ class ConvSettings(TestSettings):
 
         biases = self.get_randomized_bias_data(biases)
 
-        # Create a one layer Keras model.
-        model = tf.keras.models.Sequential()
-        input_shape = (self.batches, self.y_input, self.x_input, self.input_ch)
-        model.add(tf.keras.layers.InputLayer(
-            input_shape=input_shape[1:], batch_size=self.batches))
-        if self.test_type == 'conv':
-            conv_layer = tf.keras.layers.Conv2D(self.output_ch, kernel_size=(self.filter_y, self.filter_x),
-                                                strides=(self.stride_y, self.stride_x),
-                                                padding=self.padding, input_shape=input_shape[1:],
-                                                dilation_rate=(self.dilation_y, self.dilation_x))
-            model.add(conv_layer)
-            conv_layer.set_weights([weights, biases])
-        elif self.test_type == 'depthwise_conv':
-            depthwise_layer = tf.keras.layers.DepthwiseConv2D(
-                kernel_size=(self.filter_y, self.filter_x),
-                strides=(self.stride_y, self.stride_x),
-                padding=self.padding, depth_multiplier=self.channel_multiplier,
-                input_shape=input_shape[1:], dilation_rate=(self.dilation_y, self.dilation_x))
-            model.add(depthwise_layer)
-            depthwise_layer.set_weights([weights, biases])
-        interpreter = self.convert_and_interpret(model, inttype, input_data)
-
-        all_layers_details = interpreter.get_tensor_details()
-        filter_layer = all_layers_details[1]
-        bias_layer = all_layers_details[2]
-        if weights.numpy().size != interpreter.get_tensor(filter_layer['index']).size or \
-           (self.generate_bias and biases.numpy().size != interpreter.get_tensor(bias_layer['index']).size):
-            raise RuntimeError("Dimension mismatch")
-
-        output_details = interpreter.get_output_details()
-        self.set_output_dims_and_padding(output_details[0]['shape'][2], output_details[0]['shape'][1])
+        if self.backend == 'numpy':
+            (weights, biases, output_data) = self.get_numpy_reference(input_data, weights, biases)
+        else:
+            (weights, biases, output_data) = self.get_tflite_reference(input_data, weights, biases, inttype)
 
         self.generate_c_array("input", input_data, datatype=datatype)
-        self.generate_c_array("weights", interpreter.get_tensor(filter_layer['index']))
-
-        self.scaling_factors = filter_layer['quantization_parameters']['scales']
+        self.generate_c_array("weights", weights)
         self.generate_quantize_per_channel_multiplier()
-
-        self.generate_c_array("biases", interpreter.get_tensor(bias_layer['index']), bias_datatype)
-
-        # Generate reference
-        interpreter.invoke()
-        output_data = interpreter.get_tensor(output_details[0]["index"])
+        self.generate_c_array("biases", biases, bias_datatype)
         self.generate_c_array("output_ref", np.clip(output_data, self.out_activation_min, self.out_activation_max),
                               datatype=datatype)
 
         self.write_c_config_header()
         self.write_c_header_wrapper()
 
+    def get_tflite_reference(self, input_data, weights, biases, inttype):
+        """
+        Convert a Keras model and run it with the TFLite interpreter. Returns the quantized weights and biases and
+        the output.
+        """
+        def create_model():
+            # Create a one layer Keras model.
+            model = tf.keras.models.Sequential()
+            input_shape = (self.batches, self.y_input, self.x_input, self.input_ch)
+            model.add(tf.keras.layers.InputLayer(
+                input_shape=input_shape[1:], batch_size=self.batches))
+            if self.test_type == 'conv':
+                conv_layer = tf.keras.layers.Conv2D(self.output_ch, kernel_size=(self.filter_y, self.filter_x),
+                                                    strides=(self.stride_y, self.stride_x),
+                                                    padding=self.padding, input_shape=input_shape[1:],
+                                                    dilation_rate=(self.dilation_y, self.dilation_x))
+                model.add(conv_layer)
+                conv_layer.set_weights([weights, biases])
+            elif self.test_type == 'depthwise_conv':
+                depthwise_layer = tf.keras.layers.DepthwiseConv2D(
+                    kernel_size=(self.filter_y, self.filter_x),
+                    strides=(self.stride_y, self.stride_x),
+                    padding=self.padding, depth_multiplier=self.channel_multiplier,
+                    input_shape=input_shape[1:], dilation_rate=(self.dilation_y, self.dilation_x))
+                model.add(depthwise_layer)
+                depthwise_layer.set_weights([weights, biases])
+            return model
+
+        interpreter = self.convert_and_interpret(create_model, inttype, input_data, cache_data=(weights, biases),
+                                                 patch_model=lambda patcher: self.patch_model(patcher, weights, biases))
+
+        (filter_layer, bias_layer) = self.get_filter_and_bias_details(interpreter)
+        if np.size(weights) != interpreter.get_tensor(filter_layer['index']).size or \
+           (self.generate_bias and np.size(biases) != interpreter.get_tensor(bias_layer['index']).size):
+            raise RuntimeError("Dimension mismatch")
+
+        output_details = interpreter.get_output_details()
+        self.set_output_dims_and_padding(output_details[0]['shape'][2], output_details[0]['shape'][1])
+
+        self.scaling_factors = filter_layer['quantization_parameters']['scales']
+
+        return (interpreter.get_tensor(filter_layer['index']), interpreter.get_tensor(bias_layer['index']),
+                self.get_reference_output(interpreter))
+
 
 class PoolingSettings(TestSettings):
 
+    NUMPY_REFERENCE = True
+
     def __init__(self, dataset, testtype, args, channels=8, x_in=4, y_in=4, w_x=4, w_y=4, stride_x=1, stride_y=1,
                  randmin=INT8_MIN, randmax=INT8_MAX, batches=1, pad=False, relu6=False, out_activation_min=None,
                  out_activation_max=None, int16xint8=False):
@@ -619,45 +1938,96 @@ class PoolingSettings(TestSettings):
     def generate_data(self, input_data=None):
         if self.is_int16xint8:
             datatype = "int16_t"
-            inttype = tf.int16
+            inttype = np.int16
         else:
             datatype = "int8_t"
-            inttype = tf.int8
+            inttype = np.int8
 
         input_data = self.get_randomized_input_data(input_data)
         self.generate_c_array("input", input_data, datatype=datatype)
 
-        input_data = tf.cast(input_data, tf.float32)
+        if self.backend == 'numpy':
+            output_data = self.get_numpy_reference(input_data)
+        else:
+            output_data = self.get_tflite_reference(input_data, inttype)
+
+        self.generate_c_array("output_ref", np.clip(output_data, self.out_activation_min, self.out_activation_max),
+                              datatype=datatype)
+
+        self.write_c_config_header()
+        self.write_c_header_wrapper()
+
+    @profiled('reference')
+    def get_numpy_reference(self, input_data):
+        """
+        Compute the reference output with NumPy, bit exact to the TFLite reference kernels. Input and output have the
+        same quantization, so the pooling is done directly on the quantized input. Only the part of the window that
+        is inside the input is pooled.
+        """
+        self.set_output_dims_and_padding(*self.get_output_dims())
+        data = np.asarray(input_data, dtype=np.int64)
 
-        # Create a one-layer Keras model
-        model = tf.keras.models.Sequential()
-        input_shape = (self.batches, self.y_input, self.x_input, self.input_ch)
-        model.add(tf.keras.layers.InputLayer(
-            input_shape=input_shape[1:], batch_size=self.batches))
         if self.test_type == 'avgpool':
-            model.add(tf.keras.layers.AveragePooling2D(pool_size=(self.filter_y, self.filter_x),
-                                                       strides=(self.stride_y, self.stride_x),
-                                                       padding=self.padding, input_shape=input_shape[1:]))
+            # Window sums from an integral image, so that the cost does not depend on the window size.
+            y_start = np.arange(self.y_output) * self.stride_y - self.pad_y
+            x_start = np.arange(self.x_output) * self.stride_x - self.pad_x
+            y_end = np.clip(y_start + self.filter_y, 0, self.y_input)[:, None]
+            x_end = np.clip(x_start + self.filter_x, 0, self.x_input)
+            y_start = np.clip(y_start, 0, self.y_input)[:, None]
+            x_start = np.clip(x_start, 0, self.x_input)
+
+            integral = np.pad(data.cumsum(axis=1).cumsum(axis=2), ((0, 0), (1, 0), (1, 0), (0, 0)))
+            acc = (integral[:, y_end, x_end] - integral[:, y_start, x_end] - integral[:, y_end, x_start] +
+                   integral[:, y_start, x_start])
+            count = ((y_end - y_start) * (x_end - x_start))[None, :, :, None]
+
+            # Round to the closest integer, with half away from zero and a division that truncates.
+            output = np.where(acc > 0, (acc + count // 2) // count, -((count // 2 - acc) // count))
         elif self.test_type == 'maxpool':
-            model.add(tf.keras.layers.MaxPooling2D(pool_size=(self.filter_y, self.filter_x),
-                                                   strides=(self.stride_y, self.stride_x),
-                                                   padding=self.padding, input_shape=input_shape[1:]))
+            pad_bottom = max((self.y_output - 1) * self.stride_y + self.filter_y - self.y_input - self.pad_y, 0)
+            pad_right = max((self.x_output - 1) * self.stride_x + self.filter_x - self.x_input - self.pad_x, 0)
+            padded = np.pad(data, ((0, 0), (self.pad_y, pad_bottom), (self.pad_x, pad_right), (0, 0)),
+                            constant_values=np.iinfo(np.int64).min)
+            windows = sliding_window_view(padded, (self.filter_y, self.filter_x), axis=(1, 2))
+            output = windows[:, ::self.stride_y, ::self.stride_x].max(axis=(-2, -1))
         else:
             raise RuntimeError("Wrong test type")
 
-        interpreter = self.convert_and_interpret(model, inttype, input_data)
+        if self.is_int16xint8:
+            return np.clip(output, INT16_MIN, INT16_MAX).astype(np.int16)
+        return np.clip(output, INT8_MIN, INT8_MAX).astype(np.int8)
+
+    def get_tflite_reference(self, input_data, inttype):
+        """
+        Convert a Keras model and run it with the TFLite interpreter. Returns the output.
+        """
+        input_data = tf.cast(input_data, tf.float32)
+
+        def create_model():
+            # Create a one-layer Keras model
+            model = tf.keras.models.Sequential()
+            input_shape = (self.batches, self.y_input, self.x_input, self.input_ch)
+            model.add(tf.keras.layers.InputLayer(
+                input_shape=input_shape[1:], batch_size=self.batches))
+            if self.test_type == 'avgpool':
+                model.add(tf.keras.layers.AveragePooling2D(pool_size=(self.filter_y, self.filter_x),
+                                                           strides=(self.stride_y, self.stride_x),
+                                                           padding=self.padding, input_shape=input_shape[1:]))
+            elif self.test_type == 'maxpool':
+                model.add(tf.keras.layers.MaxPooling2D(pool_size=(self.filter_y, self.filter_x),
+                                                       strides=(self.stride_y, self.stride_x),
+                                                       padding=self.padding, input_shape=input_shape[1:]))
+            else:
+                raise RuntimeError("Wrong test type")
+            return model
+
+        # Nothing of the model depends on the data, it is calibrated with all ones.
+        interpreter = self.convert_and_interpret(create_model, inttype, input_data, patch_model=lambda patcher: None)
 
         output_details = interpreter.get_output_details()
         self.set_output_dims_and_padding(output_details[0]['shape'][2], output_details[0]['shape'][1])
 
-        # Generate reference
-        interpreter.invoke()
-        output_data = interpreter.get_tensor(output_details[0]["index"])
-        self.generate_c_array("output_ref", np.clip(output_data, self.out_activation_min, self.out_activation_max),
-                              datatype=datatype)
-
-        self.write_c_config_header()
-        self.write_c_header_wrapper()
+        return self.get_reference_output(interpreter)
 
     def write_c_config_header(self):
         super().write_c_config_header()
@@ -666,12 +2036,14 @@ class PoolingSettings(TestSettings):
         filepath = self.headers_dir + filename
         prefix = self.testdataset.upper()
 
-        with open(filepath, "a") as f:
+        with self.open_atomic(filepath, "a") as f:
             self.write_common_config(f, prefix)
 
 
 class FullyConnectedSettings(TestSettings):
 
+    NUMPY_REFERENCE = True
+
     def __init__(self, dataset, testtype, args, in_ch=1, out_ch=1, x_in=1, y_in=1, w_x=1, w_y=1, stride_x=1, stride_y=1,
                  pad=False, randmin=INT8_MIN, randmax=INT8_MAX, batches=1, generate_bias=True, out_activation_min=None,
                  out_activation_max=None, int16xint8=False, bias_min=None, bias_max=None):
@@ -690,7 +2062,7 @@ class FullyConnectedSettings(TestSettings):
         filepath = self.headers_dir + filename
         prefix = self.testdataset.upper()
 
-        with open(filepath, "a") as f:
+        with self.open_atomic(filepath, "a") as f:
             f.write("#define {}_OUTPUT_MULTIPLIER {}\n".format(prefix, self.quantized_multiplier))
             f.write("#define {}_OUTPUT_SHIFT {}\n".format(prefix, self.quantized_shift))
             f.write("#define {}_ACCUMULATION_DEPTH {}\n".format(prefix, self.input_ch*self.x_input*self.y_input))
@@ -698,7 +2070,7 @@ class FullyConnectedSettings(TestSettings):
             f.write("#define {}_OUTPUT_OFFSET {}\n".format(prefix, self.output_zero_point))
 
     def quantize_multiplier(self):
-        input_product_scale = self.input_scale * self.weights_scale
+        input_product_scale = float(self.input_scale) * float(self.weights_scale)
         if input_product_scale < 0:
             raise RuntimeError("negative input product scale")
         real_multipler = input_product_scale / self.output_scale
@@ -709,18 +2081,18 @@ class FullyConnectedSettings(TestSettings):
                                                     [self.batches, self.input_ch * self.x_input * self.y_input])
 
         if self.is_int16xint8:
-            inttype = tf.int16
+            inttype = np.int16
             datatype = "q15_t"
             bias_datatype = "int64_t"
         else:
-            inttype = tf.int8
+            inttype = np.int8
             datatype = "q7_t"
             bias_datatype = "int32_t"
 
         fc_weights_format = [self.input_ch * self.y_input * self.x_input, self.output_ch]
 
         if weights is not None:
-            weights = tf.reshape(weights, fc_weights_format)
+            weights = np.reshape(weights, fc_weights_format)
         else:
             weights = self.get_randomized_data(fc_weights_format,
                                                self.kernel_table_file,
@@ -728,58 +2100,117 @@ class FullyConnectedSettings(TestSettings):
 
         biases = self.get_randomized_bias_data(biases)
 
-        # Create model with one fully_connected layer.
-        model = tf.keras.models.Sequential()
-        model.add(tf.keras.layers.InputLayer(
-            input_shape=(self.y_input * self.x_input * self.input_ch,), batch_size=self.batches))
-        fully_connected_layer = tf.keras.layers.Dense(self.output_ch, activation=None)
-        model.add(fully_connected_layer)
-        fully_connected_layer.set_weights([weights, biases])
-
-        interpreter = self.convert_and_interpret(model, inttype, input_data)
-
-        all_layers_details = interpreter.get_tensor_details()
-        if self.is_int16xint8:
-            filter_layer = all_layers_details[2]
-            bias_layer = all_layers_details[1]
-        else:
-            filter_layer = all_layers_details[1]
-            bias_layer = all_layers_details[2]
-        if weights.numpy().size != interpreter.get_tensor(filter_layer['index']).size or \
-           (self.generate_bias and biases.numpy().size != interpreter.get_tensor(bias_layer['index']).size):
-            raise RuntimeError("Dimension mismatch")
-
         # The generic destination size calculation for these tests are: self.x_output * self.y_output * self.output_ch
         # * self.batches.
         self.x_output = 1
         self.y_output = 1
-        output_details = interpreter.get_output_details()
-        if self.output_ch != output_details[0]['shape'][1] or self.batches != output_details[0]['shape'][0]:
-            raise RuntimeError("Fully connected out dimension mismatch")
 
-        self.weights_scale = filter_layer['quantization_parameters']['scales'][0]
+        if self.backend == 'numpy':
+            (quantized_weights, quantized_biases, output_data) = self.get_numpy_reference(input_data, weights, biases)
+        else:
+            (quantized_weights, quantized_biases, output_data) = self.get_tflite_reference(input_data, weights, biases,
+                                                                                           inttype)
         self.quantize_multiplier()
 
         self.generate_c_array("input", input_data, datatype=datatype)
-        self.generate_c_array("weights", interpreter.get_tensor(filter_layer['index']))
+        self.generate_c_array("weights", quantized_weights)
 
         if self.generate_bias:
-            self.generate_c_array("biases", interpreter.get_tensor(bias_layer['index']), bias_datatype)
+            self.generate_c_array("biases", quantized_biases, bias_datatype)
         else:
             self.generate_c_array("biases", biases, bias_datatype)
 
         # Generate reference
-        interpreter.invoke()
-        output_data = interpreter.get_tensor(output_details[0]["index"])
         self.generate_c_array("output_ref", np.clip(output_data, self.out_activation_min, self.out_activation_max),
                               datatype=datatype)
 
         self.write_c_config_header()
         self.write_c_header_wrapper()
 
+    def quantize_model(self, weights, biases):
+        """
+        Quantize the model with NumPy, bit exact to the TFLite converter. Returns the quantized weights in the Keras
+        layout, the quantized biases and the weight scale as a one element array.
+        """
+        weights = np.asarray(weights, dtype=np.float64)
+        biases = np.asarray(biases, dtype=np.float64)
+
+        # The representative dataset used for calibration is all ones.
+        calibration_output = np.ones((self.batches, weights.shape[0])) @ weights + biases
+        (self.input_scale, self.input_zero_point) = self.get_activation_quantization(1.0, 1.0)
+        (self.output_scale, self.output_zero_point) = self.get_activation_quantization(calibration_output.min(),
+                                                                                       calibration_output.max())
+
+        # The weights are quantized per tensor, the same as one channel with the largest bias.
+        (quantized_weights, scaling_factors) = self.quantize_per_channel(weights.reshape(-1, 1),
+                                                                         np.abs(biases).max(keepdims=True))
+        self.weights_scale = scaling_factors[0]
+        return quantized_weights.reshape(weights.shape), self.quantize_bias(biases, scaling_factors), scaling_factors
+
+    def patch_model(self, patcher, weights, biases):
+        (quantized_weights, quantized_biases, scaling_factors) = self.quantize_model(weights, biases)
+        # The weights of the TFLite model are in [output_ch, accumulation depth] format.
+        patcher.patch_constant(quantized_weights.T, scaling_factors, [0])
+        patcher.patch_constant(quantized_biases, np.float32(self.input_scale) * scaling_factors, [0])
+        patcher.patch_output(self.output_scale, self.output_zero_point)
+
+    @profiled('reference')
+    def get_numpy_reference(self, input_data, weights, biases):
+        """
+        Quantize the model and compute the reference output with NumPy, bit exact to the TFLite converter and the
+        TFLite reference kernels. All batches are computed with one int64 matmul. Returns the quantized weights and
+        biases and the output.
+        """
+        (quantized_weights, quantized_biases, scaling_factors) = self.quantize_model(weights, biases)
+
+        acc = (np.asarray(input_data, dtype=np.int64) - self.input_zero_point) @ quantized_weights.astype(np.int64)
+        output = self.requantize(acc + quantized_biases, scaling_factors)
+
+        # The weights of the TFLite model are in [output_ch, accumulation depth] format.
+        return quantized_weights.T, quantized_biases, output
+
+    def get_tflite_reference(self, input_data, weights, biases, inttype):
+        """
+        Convert a Keras model and run it with the TFLite interpreter. Returns the quantized weights and biases and
+        the output.
+        """
+        def create_model():
+            # Create model with one fully_connected layer.
+            model = tf.keras.models.Sequential()
+            model.add(tf.keras.layers.InputLayer(
+                input_shape=(self.y_input * self.x_input * self.input_ch,), batch_size=self.batches))
+            fully_connected_layer = tf.keras.layers.Dense(self.output_ch, activation=None)
+            model.add(fully_connected_layer)
+            fully_connected_layer.set_weights([weights, biases])
+            return model
+
+        interpreter = self.convert_and_interpret(create_model, inttype, input_data, cache_data=(weights, biases),
+                                                 patch_model=lambda patcher: self.patch_model(patcher, weights, biases))
+
+        (filter_layer, bias_layer) = self.get_filter_and_bias_details(interpreter)
+        if np.size(weights) != interpreter.get_tensor(filter_layer['index']).size or \
+           (self.generate_bias and np.size(biases) != interpreter.get_tensor(bias_layer['index']).size):
+            raise RuntimeError("Dimension mismatch")
+
+        output_details = interpreter.get_output_details()
+        if self.output_ch != output_details[0]['shape'][1] or self.batches != output_details[0]['shape'][0]:
+            raise RuntimeError("Fully connected out dimension mismatch")
+
+        self.weights_scale = filter_layer['quantization_parameters']['scales'][0]
+
+        return (interpreter.get_tensor(filter_layer['index']), interpreter.get_tensor(bias_layer['index']),
+                self.get_reference_output(interpreter))
+
 
 class SoftmaxSettings(TestSettings):
+    NUMPY_REFERENCE = True
+
     softmax_input_integer_bits = 5
+    softmax_accumulation_integer_bits = 12
+
+    # Lookup tables of the TFLite int16 softmax kernel, for exp(x) in [-10, 0] and 1 / (1 + x) in [0, 1].
+    EXP_LUT = 'TestCases/Common/Softmax/exp_lut_data.h'
+    ONE_BY_ONE_LUT = 'TestCases/Common/Softmax/one_by_one_lut_data.h'
 
     def __init__(self, dataset, testtype, args, x_in=5, y_in=1, randmin=INT8_MIN, randmax=INT8_MAX, int16xint8=False,
                  inInt8outInt16=False, input_scale=0.003922, input_zp=-128):
@@ -821,7 +2252,7 @@ class SoftmaxSettings(TestSettings):
         filepath = self.headers_dir + filename
         prefix = self.testdataset.upper()
 
-        with open(filepath, "a") as f:
+        with self.open_atomic(filepath, "a") as f:
             f.write("#define {}_NUM_ROWS {}\n".format(prefix, self.y_input))
             f.write("#define {}_ROW_SIZE {}\n".format(prefix, self.x_input))
             f.write("#define {}_INPUT_MULT {}\n".format(prefix, self.input_multiplier))
@@ -833,7 +2264,7 @@ class SoftmaxSettings(TestSettings):
     def get_softmax_randomized_input_data(self, input_data, input_shape):
         # Generate or load saved input data unless hardcoded data provided.
         if input_data is not None:
-            input_data = tf.reshape(input_data, input_shape)
+            input_data = np.reshape(input_data, input_shape)
         else:
             input_data = self.get_randomized_data(input_shape,
                                                   self.inputs_table_file,
@@ -844,67 +2275,208 @@ class SoftmaxSettings(TestSettings):
         input_data = self.get_softmax_randomized_input_data(input_data, [self.y_input, self.x_input])
 
         if self.is_int16xint8:
-            inttype = tf.int16
+            inttype = np.int16
             datatype = "q15_t"
         else:
-            inttype = tf.int8
+            inttype = np.int8
             datatype = "q7_t"
 
         self.generate_c_array("input", input_data, datatype=datatype)
 
-        # Generate reference.
         if self.inInt8outInt16:
             # Output is int16.
             datatype = "q15_t"
 
+        # Generate reference.
+        if self.backend == 'numpy':
+            output_data = self.get_numpy_reference(input_data)
+        else:
+            output_data = self.get_tflite_reference(input_data, inttype)
+
+        self.calc_softmax_params()
+        self.generate_c_array("output_ref", output_data, datatype=datatype)
+
+        self.write_c_config_header()
+        self.write_c_header_wrapper()
+
+    @profiled('reference')
+    def get_numpy_reference(self, input_data):
+        """
+        Compute the reference output with NumPy, bit exact to the TFLite reference kernels. All rows are computed at
+        once.
+        """
+        if not self.inInt8outInt16:
+            # The representative dataset used for calibration is all ones.
+            (self.input_scale, self.input_zero_point) = self.get_activation_quantization(1.0, 1.0)
+        self.calc_softmax_params()
+
+        data = np.asarray(input_data, dtype=np.int64)
+        if self.is_int16xint8:
+            return self.softmax_s16(data)
+        elif self.inInt8outInt16:
+            return self.softmax_s8(data, INT16_MIN, INT16_MAX).astype(np.int16)
+        return self.softmax_s8(data, INT8_MIN, INT8_MAX).astype(np.int8)
+
+    def softmax_s8(self, data, output_min, output_max):
+        """
+        Softmax of int8 input with the gemmlowp fixed point arithmetic of the TFLite reference kernel. The output has
+        the scale 1 / (output_max - output_min + 1) and the zero point output_min.
+        """
+        diff = data - data.max(axis=-1, keepdims=True)
+        in_range = diff >= -self.diff_min
+
+        scaled_diff = self.multiply_by_quantized_multiplier(np.where(in_range, diff, 0), self.input_multiplier,
+                                                            self.input_left_shift)
+        exp_in_0 = self.exp_on_negative_values(scaled_diff)
+        sum_of_exps = np.where(in_range, self.rounding_divide_by_pot(exp_in_0, self.softmax_accumulation_integer_bits),
+                               0).sum(axis=-1, keepdims=True)
+
+        # Reciprocal of the sum, see GetReciprocal().
+        headroom_plus_one = 32 - np.frexp(sum_of_exps)[1]
+        num_bits_over_unit = self.softmax_accumulation_integer_bits - headroom_plus_one
+        shifted_scale = self.one_over_one_plus_x_for_x_in_0_1((sum_of_exps << headroom_plus_one) - (1 << 31))
+
+        output_bits = int(np.log2(output_max - output_min + 1))
+        output = self.rounding_divide_by_pot(self.saturating_rounding_doubling_high_mul(shifted_scale, exp_in_0),
+                                             num_bits_over_unit + 31 - output_bits) + output_min
+        return np.where(in_range, np.clip(output, output_min, output_max), output_min)
+
+    def exp_on_negative_values(self, a):
+        """
+        exp_on_negative_values() of gemmlowp, from Q5.26 to Q0.31.
+        """
+        srdhm = self.saturating_rounding_doubling_high_mul
+        fractional_bits = 31 - self.softmax_input_integer_bits
+        one_quarter = 1 << (fractional_bits - 2)
+        a_mod_quarter_minus_one_quarter = (a & (one_quarter - 1)) - one_quarter
+
+        # exp_on_interval_between_negative_one_quarter_and_0_excl(), a Taylor expansion around -1/8.
+        x = self.saturating_left_shift(a_mod_quarter_minus_one_quarter, self.softmax_input_integer_bits) + (1 << 28)
+        x2 = srdhm(x, x)
+        x3 = srdhm(x2, x)
+        x4 = srdhm(x2, x2)
+        x4_over_4 = self.rounding_divide_by_pot(x4, 2)
+        x4_over_24_plus_x3_over_6_plus_x2_over_2 = self.rounding_divide_by_pot(srdhm(x4_over_4 + x3, 715827883) + x2,
+                                                                               1)
+        result = 1895147668 + srdhm(1895147668, x + x4_over_24_plus_x3_over_6_plus_x2_over_2)
+
+        # Multiply with exp(-2^exponent) for each bit set in the remainder.
+        remainder = a_mod_quarter_minus_one_quarter - a
+        for (exponent, multiplier) in zip(range(-2, 5), (1672461947, 1302514674, 790015084, 290630308, 39332535,
+                                                          720401, 242)):
+            result = np.where((remainder & (1 << (fractional_bits + exponent))) != 0, srdhm(result, multiplier),
+                              result)
+        return np.where(a == 0, INT32_MAX, result)
+
+    def one_over_one_plus_x_for_x_in_0_1(self, a):
+        """
+        one_over_one_plus_x_for_x_in_0_1() of gemmlowp, with Newton-Raphson division.
+        """
+        srdhm = self.saturating_rounding_doubling_high_mul
+        # RoundingHalfSum() with one.
+        total = a + INT32_MAX
+        total = total + np.where(total >= 0, 1, -1)
+        half_denominator = np.where(total >= 0, total // 2, -((-total) // 2))
+
+        x = 1515870810 + srdhm(half_denominator, -1010580540)
+        for i in range(3):
+            one_minus_half_denominator_times_x = (1 << 29) - srdhm(half_denominator, x)
+            x = x + self.saturating_left_shift(srdhm(x, one_minus_half_denominator_times_x), 2)
+        return self.saturating_left_shift(x, 1)
+
+    def load_lut(self, filepath):
+        with open(filepath) as f:
+            data = f.read()
+        return np.array([int(value) for value in data[data.index('{') + 1:data.index('}')].split(',')],
+                        dtype=np.int64)
+
+    def int16_table_lookup(self, value, lut):
+        """
+        generic_int16_table_lookup() of TFLite, with linear interpolation between the 513 entries of the table.
+        """
+        index = 256 + (value >> 7)
+        offset = value & 0x7f
+        base = lut[index]
+        slope = lut[index + 1] - base
+        return base + ((slope * offset + 64) >> 7)
+
+    def softmax_s16(self, data):
+        """
+        Softmax of int16 input with the lookup tables of the TFLite reference kernel.
+        """
+        exp_lut = self.load_lut(self.EXP_LUT)
+        one_by_one_lut = self.load_lut(self.ONE_BY_ONE_LUT)
+
+        # The input is scaled such that [-65535, 0] corresponds to [-10.0, 0.0].
+        diff = data - data.max(axis=-1, keepdims=True)
+        scaled_diff = self.multiply_by_quantized_multiplier(diff, self.input_multiplier, self.input_left_shift)
+        exp_result = self.int16_table_lookup(np.clip(scaled_diff + INT16_MAX, INT16_MIN, INT16_MAX), exp_lut)
+        sum_of_exps = exp_result.sum(axis=-1, keepdims=True)
+
+        headroom_plus_one = 32 - np.frexp(sum_of_exps)[1]
+        shifted_sum = ((sum_of_exps << (headroom_plus_one - 1)) + (1 << 13)) >> 14
+        # The table is for 1 / (1 + x), so subtract one, i.e. 1 << 16, and recenter from [0, 65535] to
+        # [-32768, 32767].
+        reciprocal_scale = self.int16_table_lookup(np.clip(shifted_sum - (1 << 16) - (1 << 15), INT16_MIN, INT16_MAX),
+                                                   one_by_one_lut)
+
+        right_shift = 31 - headroom_plus_one
+        output = (exp_result * reciprocal_scale + (np.int64(1) << (right_shift - 1))) >> right_shift
+        return np.clip(output, 0, INT16_MAX).astype(np.int16)
+
+    def get_tflite_reference(self, input_data, inttype):
+        """
+        Convert a Keras model, or the json template for int8 input and int16 output, and run it with the TFLite
+        interpreter. Returns the output.
+        """
+        if self.inInt8outInt16:
             # Keras does not support int8 input and int16 output for Softmax.
             # Using a template json instead.
-            generated_json = self.generate_json_from_template()
-            self.flatc_generate_tflite(generated_json, args.schema_file)
-
-            interpreter = Interpreter(
-                model_path=str(self.model_path_tflite), experimental_op_resolver_type=OpResolverType.BUILTIN_REF)
+            interpreter = Interpreter(model_content=self.generate_model_from_template(),
+                                      experimental_op_resolver_type=OpResolverType.BUILTIN_REF)
             interpreter.allocate_tensors()
             all_layers_details = interpreter.get_tensor_details()
             input_layer = all_layers_details[0]
             output_layer = all_layers_details[1]
 
             interpreter.set_tensor(input_layer["index"], tf.cast(input_data, tf.int8))
-            interpreter.invoke()
-            output_data = interpreter.get_tensor(output_layer["index"])
-        else:
+            with self.profile('interpret'):
+                interpreter.invoke()
+            return interpreter.get_tensor(output_layer["index"])
+
+        def create_model():
             # Create a one-layer Keras model.
             model = tf.keras.models.Sequential()
             input_shape = (self.y_input, self.x_input)
             model.add(tf.keras.layers.Softmax(input_shape=input_shape))
+            return model
 
-            interpreter = self.convert_and_interpret(model, inttype, tf.expand_dims(input_data, axis=0))
-            output_details = interpreter.get_output_details()
-            interpreter.invoke()
-            output_data = interpreter.get_tensor(output_details[0]["index"])
-
-        self.calc_softmax_params()
-        self.generate_c_array("output_ref", output_data, datatype=datatype)
-
-        self.write_c_config_header()
-        self.write_c_header_wrapper()
+        # Nothing of the model depends on the data, it is calibrated with all ones.
+        interpreter = self.convert_and_interpret(create_model, inttype, tf.expand_dims(input_data, axis=0),
+                                                 patch_model=lambda patcher: None)
+        return self.get_reference_output(interpreter)
 
 
 class SVDFSettings(TestSettings):
 
+    NUMPY_REFERENCE = True
+
     def __init__(self, dataset, testtype, args, batches=2, number_inputs=2, rank=8, memory_size=10, randmin=INT8_MIN,
                  randmax=INT8_MAX, input_size=3, number_units=4, generate_bias=True, input_scale=0.1, input_zp=0,
                  w_1_scale=0.005, w_1_zp=0, w_2_scale=0.005, w_2_zp=0, bias_scale=0.000001, bias_zp=0,
-                 state_scale=0.005, state_zp=0, output_scale=0.1, output_zp=0):
+                 state_scale=0.005, state_zp=0, output_scale=0.1, output_zp=0, step_output=False):
         super().__init__(dataset, testtype, args, 1, 1, 1, 1, 1, 1, 1, 1, False, randmin,
                          randmax, generate_bias=generate_bias)
         self.batches = batches
+        # Also write the output and the state after every input frame, as output_steps_ref and state_steps_ref, to
+        # check a kernel frame by frame on long input sequences.
+        self.step_output = step_output
         self.number_units = number_units
         self.input_size = input_size
         self.memory_size = memory_size
         self.rank = rank
         self.number_filters = self.number_units * self.rank
-        self.time_table_file = self.pregenerated_data_dir + self.testdataset + '/' + 'time_data.txt'
+        self.time_table_file = self.pregenerated_data_dir + self.testdataset + '/' + 'time_data.npy'
 
         self.number_inputs = number_inputs
         self.input_sequence_length = self.number_inputs * self.input_size * self.batches
@@ -946,7 +2518,7 @@ class SVDFSettings(TestSettings):
         filepath = self.headers_dir + filename
         prefix = self.testdataset.upper()
 
-        with open(filepath, "a") as f:
+        with self.open_atomic(filepath, "a") as f:
             f.write("#define {}_MULTIPLIER_IN {}\n".format(prefix, self.multiplier_in))
             f.write("#define {}_MULTIPLIER_OUT {}\n".format(prefix, self.multiplier_out))
             f.write("#define {}_SHIFT_1 {}\n".format(prefix, self.shift_1))
@@ -966,7 +2538,7 @@ class SVDFSettings(TestSettings):
 
     def generate_data(self, input_data=None, weights=None, biases=None, time_data=None, state_data=None):
         if input_data is not None:
-            input_data = tf.reshape(input_data, [self.input_sequence_length])
+            input_data = np.reshape(input_data, [self.input_sequence_length])
         else:
             input_data = self.get_randomized_data([self.input_sequence_length],
                                                   self.inputs_table_file,
@@ -974,14 +2546,14 @@ class SVDFSettings(TestSettings):
         self.generate_c_array("input_sequence", input_data)
 
         if weights is not None:
-            weights_feature_data = tf.reshape(weights, [self.number_filters, self.input_size])
+            weights_feature_data = np.reshape(weights, [self.number_filters, self.input_size])
         else:
             weights_feature_data = self.get_randomized_data([self.number_filters, self.input_size],
                                                             self.kernel_table_file,
                                                             regenerate=self.regenerate_new_weights)
 
         if time_data is not None:
-            weights_time_data = tf.reshape(time_data, [self.number_filters, self.memory_size])
+            weights_time_data = np.reshape(time_data, [self.number_filters, self.memory_size])
         else:
             weights_time_data = self.get_randomized_data([self.number_filters, self.memory_size],
                                                          self.time_table_file,
@@ -990,19 +2562,113 @@ class SVDFSettings(TestSettings):
         if not self.generate_bias:
             biases = [0] * self.number_units
         if biases is not None:
-            biases = tf.reshape(biases, [self.number_units])
+            biases = np.reshape(biases, [self.number_units])
         else:
             biases = self.get_randomized_data([self.number_units],
                                               self.bias_table_file,
                                               regenerate=self.regenerate_new_weights)
 
-        # Generate tflite model
-        generated_json = self.generate_json_from_template(weights_feature_data, weights_time_data, biases)
-        self.flatc_generate_tflite(generated_json, args.schema_file)
+        if self.backend == 'numpy':
+            (weights_feature, weights_time, biases, state, svdf_ref, steps) = self.get_numpy_reference(
+                input_data, weights_feature_data, weights_time_data, biases)
+        else:
+            (weights_feature, weights_time, biases, state, svdf_ref, steps) = self.get_tflite_reference(
+                input_data, weights_feature_data, weights_time_data, biases)
+
+        # Generate unit test C headers
+        self.generate_c_array("weights_feature", weights_feature)
+        self.generate_c_array("weights_time", weights_time, datatype='q15_t')
+        self.generate_c_array("biases", biases, "int32_t")
+        self.generate_c_array("state", state, "q15_t")
+        self.generate_c_array("output_ref", svdf_ref)
+        if self.step_output:
+            (output_steps, state_steps) = steps
+            self.generate_c_array("output_steps_ref", output_steps)
+            self.generate_c_array("state_steps_ref", state_steps, "q15_t")
+
+        self.write_c_config_header()
+        self.write_c_header_wrapper()
+
+    @profiled('reference')
+    def get_numpy_reference(self, input_data, weights_feature_data, weights_time_data, biases):
+        """
+        Compute the reference output with NumPy, bit exact to the TFLite reference kernel. The scales and zero points
+        are the ones of the json template, rounded to float32 as they are when stored in the model. Returns the
+        weights, biases, the initial state, the output of the last frame and, with step_output, the outputs and states
+        of all frames.
+        """
+        scales = {name: np.float32(self.json_replacements[name]) for name in
+                  ("input_scale", "w_1_scale", "w_2_scale", "state_scale", "output_scale")}
+        self.input_zero_point = self.json_replacements["input_zp"]
+        self.output_zero_point = self.json_replacements["output_zp"]
+        self.calc_multipliers_and_shifts(scales["input_scale"], scales["w_1_scale"], scales["w_2_scale"],
+                                         scales["state_scale"], scales["output_scale"])
+
+        weights_feature = np.asarray(weights_feature_data).astype(np.int8)
+        weights_time = np.asarray(weights_time_data).astype(np.int16)
+        biases = np.asarray(biases).astype(np.int32)
+        state = np.zeros([self.batches, self.memory_size * self.number_filters], dtype=np.int16)
+
+        frames = np.asarray(input_data).astype(np.int8).reshape(self.number_inputs, self.batches, self.input_size)
+        svdf_ref = None
+        steps = ([], []) if self.step_output else None
+        for step in self.svdf_steps(frames, weights_feature, weights_time, biases, state.copy(),
+                                    snapshots=self.step_output):
+            if self.step_output:
+                (svdf_ref, step_state) = step
+                steps[0].append(svdf_ref)
+                steps[1].append(step_state)
+            else:
+                svdf_ref = step
+
+        return weights_feature, weights_time, biases, state, svdf_ref, steps
+
+    def svdf_steps(self, frames, weights_feature, weights_time, biases, state, snapshots=False):
+        """
+        Generator that runs the SVDF layer over the input frames, one [batches, input_size] frame per step, the same
+        way as EvalIntegerSVDF() of the TFLite reference kernels. The state is updated in place, so memory use does
+        not depend on the number of frames. The state type selects the kernel: int16 for arm_svdf_state_s16_s8() and
+        int8 for arm_svdf_s8(). Yields the output of each step, or the output and a copy of the state if snapshots is
+        set.
+        """
+        number_units = biases.size
+        rank = weights_feature.shape[0] // number_units
+        memory_size = weights_time.shape[1]
+        state_info = np.iinfo(state.dtype)
+        flat_state = state.reshape(-1)
+        time_state = state.reshape(-1, weights_feature.shape[0], memory_size)
+        weights_feature = weights_feature.astype(np.int64).T
+        weights_time = weights_time.astype(np.int64)
+        biases = biases.astype(np.int64)
+
+        for frame in frames:
+            # Shift the whole state buffer one step, the oldest activation of each filter is overwritten by the
+            # newest one below.
+            flat_state[:-1] = flat_state[1:]
+
+            acc = (np.asarray(frame, dtype=np.int64) - self.input_zero_point) @ weights_feature
+            acc = self.multiply_by_quantized_multiplier(acc, self.multiplier_in, self.shift_1)
+            time_state[:, :, -1] = np.clip(acc, state_info.min, state_info.max)
+
+            acc = np.einsum('bfm,fm->bf', time_state.astype(np.int64), weights_time)
+            acc = acc.reshape(-1, number_units, rank).sum(axis=2) + biases
+            output = self.multiply_by_quantized_multiplier(acc, self.multiplier_out, self.shift_2)
+            output = np.clip(output + self.output_zero_point, INT8_MIN, INT8_MAX).astype(np.int8)
+
+            if snapshots:
+                yield output, state.copy()
+            else:
+                yield output
+
+    def get_tflite_reference(self, input_data, weights_feature_data, weights_time_data, biases):
+        """
+        Generate a TFLite model from the json template and run it with the TFLite interpreter, one frame per invoke.
+        Returns the same as get_numpy_reference().
+        """
+        model = self.generate_model_from_template(weights_feature_data, weights_time_data, biases)
 
         # Run TFL interpreter
-        interpreter = Interpreter(
-            model_path=str(self.model_path_tflite), experimental_op_resolver_type=OpResolverType.BUILTIN_REF)
+        interpreter = Interpreter(model_content=model, experimental_op_resolver_type=OpResolverType.BUILTIN_REF)
         interpreter.allocate_tensors()
 
         # Read back scales and zero points from tflite model
@@ -1022,26 +2688,28 @@ class SVDFSettings(TestSettings):
 
         self.calc_multipliers_and_shifts(input_scale, weights_1_scale, weights_2_scale, state_scale, output_scale)
 
-        # Generate unit test C headers
-        self.generate_c_array("weights_feature", interpreter.get_tensor(weights_1_layer['index']))
-        self.generate_c_array("weights_time", interpreter.get_tensor(weights_2_layer['index']), datatype='q15_t')
-        self.generate_c_array("biases", interpreter.get_tensor(bias_layer['index']), "int32_t")
-        self.generate_c_array("state", interpreter.get_tensor(state_layer['index']), "q15_t")
+        weights_feature = interpreter.get_tensor(weights_1_layer['index'])
+        weights_time = interpreter.get_tensor(weights_2_layer['index'])
+        biases = interpreter.get_tensor(bias_layer['index'])
+        state = interpreter.get_tensor(state_layer['index'])
 
         # Generate reference output
         svdf_ref = None
+        steps = ([], []) if self.step_output else None
         for i in range(self.number_inputs):
             start = i * self.input_size * self.batches
             end = i * self.input_size * self.batches + self.input_size * self.batches
             input_sequence = input_data[start:end]
             input_sequence = tf.reshape(input_sequence, [self.batches, self.input_size])
             interpreter.set_tensor(input_layer["index"], tf.cast(input_sequence, tf.int8))
-            interpreter.invoke()
+            with self.profile('interpret'):
+                interpreter.invoke()
             svdf_ref = interpreter.get_tensor(output_layer["index"])
-        self.generate_c_array("output_ref", svdf_ref)
+            if self.step_output:
+                steps[0].append(svdf_ref)
+                steps[1].append(interpreter.get_tensor(state_layer['index']))
 
-        self.write_c_config_header()
-        self.write_c_header_wrapper()
+        return weights_feature, weights_time, biases, state, svdf_ref, steps
 
     def get_scale_and_zp(self, layer):
         return (layer['quantization_parameters']['scales'][0], layer['quantization_parameters']['zero_points'][0])
@@ -1081,19 +2749,22 @@ class AddMulSettings(TestSettings):
             inttype = "int8_t"
             inttype_tf = tf.int8
 
-        # Create a one-layer functional Keras model as add/mul cannot use a sequntial Keras model.
-        input1 = tf.keras.layers.Input(shape=input_shape[1:])
-        input2 = tf.keras.layers.Input(shape=input_shape[1:])
-        if self.test_type == 'add':
-            layer = tf.keras.layers.Add()([input1, input2])
-        elif self.test_type == 'mul':
-            layer = tf.keras.layers.Multiply()([input1, input2])
-        else:
-            raise RuntimeError("Wrong test type")
-        out = tf.keras.layers.Lambda(function=lambda x: x)(layer)
-        model = tf.keras.models.Model(inputs=[input1, input2], outputs=out)
+        def create_model():
+            # Create a one-layer functional Keras model as add/mul cannot use a sequntial Keras model.
+            input1 = tf.keras.layers.Input(shape=input_shape[1:])
+            input2 = tf.keras.layers.Input(shape=input_shape[1:])
+            if self.test_type == 'add':
+                layer = tf.keras.layers.Add()([input1, input2])
+            elif self.test_type == 'mul':
+                layer = tf.keras.layers.Multiply()([input1, input2])
+            else:
+                raise RuntimeError("Wrong test type")
+            out = tf.keras.layers.Lambda(function=lambda x: x)(layer)
+            return tf.keras.models.Model(inputs=[input1, input2], outputs=out)
 
-        interpreter = self.convert_and_interpret(model, inttype_tf)
+        # Nothing of the model depends on the data, it is calibrated with all ones.
+        interpreter = self.convert_and_interpret(create_model, inttype_tf, cache_data=(input_data1, input_data2),
+                                                 patch_model=lambda patcher: None)
 
         input_details = interpreter.get_input_details()
         interpreter.set_tensor(input_details[0]["index"], tf.cast(input_data1, inttype_tf))
@@ -1115,9 +2786,7 @@ class AddMulSettings(TestSettings):
         (self.output_mult, self.output_shift) = self.quantize_scale(actual_output_scale)
 
         # Generate reference.
-        interpreter.invoke()
-        output_details = interpreter.get_output_details()
-        output_data = interpreter.get_tensor(output_details[0]["index"])
+        output_data = self.get_reference_output(interpreter)
         self.generate_c_array("input1", input_data1, datatype=inttype)
         self.generate_c_array("input2", input_data2, datatype=inttype)
         self.generate_c_array("output_ref", np.clip(output_data, self.out_activation_min, self.out_activation_max),
@@ -1133,7 +2802,7 @@ class AddMulSettings(TestSettings):
         filepath = self.headers_dir + filename
         prefix = self.testdataset.upper()
 
-        with open(filepath, "a") as f:
+        with self.open_atomic(filepath, "a") as f:
             f.write("#define {}_DST_SIZE {}\n".format(prefix,
                                                       self.batches * self.y_input * self.x_input * self.input_ch))
             f.write("#define {}_OUT_ACTIVATION_MIN {}\n".format(prefix, self.out_activation_min))
@@ -1151,335 +2820,531 @@ class AddMulSettings(TestSettings):
                 f.write("#define {}_INPUT2_MULT {}\n".format(prefix, self.input2_mult))
 
 
-def load_all_testdatasets():
+SETTINGS_CLASSES = {
+    'conv': ConvSettings,
+    'depthwise_conv': ConvSettings,
+    'avgpool': PoolingSettings,
+    'maxpool': PoolingSettings,
+    'fully_connected': FullyConnectedSettings,
+    'softmax': SoftmaxSettings,
+    'svdf': SVDFSettings,
+    'add': AddMulSettings,
+    'mul': AddMulSettings,
+}
+
+
+class TestDataSets(Mapping):
     """
-    Add all new testdata sets here
+    The test sets by name. The test set file only holds the test type and the constructor parameters of each test
+    set, the settings object of a test set is created the first time it is looked up. Parameter values may be given
+    as the name of one of the integer limits, e.g. "INT16_MIN". Stress test sets are marked with "stress": true.
     """
 
-    type_of_test = 'conv'
-    dataset = 'basic'
-    TESTDATA_SETS[dataset] = ConvSettings(dataset, type_of_test, args, in_ch=1, out_ch=1, x_in=5,
-                                          y_in=8, w_x=2, w_y=4, stride_x=1, stride_y=1, pad=False)
-    dataset = 'stride2pad1'
-    TESTDATA_SETS[dataset] = ConvSettings(dataset, type_of_test, args, in_ch=1, out_ch=1, x_in=7,
-                                          y_in=7, w_x=3, w_y=3, stride_x=2, stride_y=2, pad=True)
-    dataset = 'kernel1x1'
-    TESTDATA_SETS[dataset] = ConvSettings(dataset, type_of_test, args, in_ch=4, out_ch=17, x_in=15,
-                                          y_in=15, w_x=1, w_y=1, stride_x=1, stride_y=1, pad=False,
-                                          out_activation_min=-126, out_activation_max=127)
-    dataset = 'conv_3'
-    TESTDATA_SETS[dataset] = ConvSettings(dataset, type_of_test, args, in_ch=3, out_ch=1, x_in=10, y_in=49, w_x=4,
-                                          w_y=10, stride_x=1, stride_y=2, pad=True,
-                                          out_activation_min=-127, out_activation_max=127)
-    dataset = 'conv_1_x_n_1'
-    TESTDATA_SETS[dataset] = ConvSettings(dataset, type_of_test, args, in_ch=3, out_ch=3, x_in=5, y_in=5, w_x=2,
-                                          w_y=1, stride_x=2, stride_y=1, pad=False, out_activation_min=-127,
-                                          out_activation_max=127, batches=2)
-    dataset = 'conv_1_x_n_2'
-    TESTDATA_SETS[dataset] = ConvSettings(dataset, type_of_test, args, in_ch=3, out_ch=1, x_in=11, y_in=11, w_x=11,
-                                          w_y=1, stride_x=1, stride_y=1, pad=True,
-                                          out_activation_min=-111, out_activation_max=127)
-    dataset = 'conv_1_x_n_3'
-    TESTDATA_SETS[dataset] = ConvSettings(dataset, type_of_test, args, in_ch=1, out_ch=3, x_in=11, y_in=11, w_x=1,
-                                          w_y=11, stride_x=1, stride_y=1, pad=True,
-                                          out_activation_min=-88, out_activation_max=127)
-    dataset = 'conv_2'
-    TESTDATA_SETS[dataset] = ConvSettings(dataset, type_of_test, args, in_ch=2, out_ch=4, x_in=6, y_in=3, w_x=3,
-                                          w_y=3, stride_x=1, stride_y=1, pad=True, out_activation_min=-101,
-                                          out_activation_max=127)
-    dataset = 'conv_4'  # batches > 2
-    TESTDATA_SETS[dataset] = ConvSettings(dataset, type_of_test, args, in_ch=3, out_ch=3, x_in=5, y_in=5, w_x=2,
-                                          w_y=3, stride_x=2, stride_y=2, pad=False,
-                                          out_activation_min=-109, out_activation_max=127, batches=3)
-    dataset = 'conv_out_activation'
-    TESTDATA_SETS[dataset] = ConvSettings(dataset, type_of_test, args, in_ch=2, out_ch=2, x_in=3, y_in=3, w_x=3,
-                                          w_y=3, stride_x=1, stride_y=1, pad=True, out_activation_min=-61,
-                                          out_activation_max=107)
-    dataset = 'conv_dilation_golden'
-    TESTDATA_SETS[dataset] = ConvSettings(dataset, type_of_test, args, in_ch=1, batches=2, out_ch=3, x_in=6, y_in=4,
-                                          w_x=2, w_y=2, stride_x=1, stride_y=1, pad=True, out_activation_min=-128,
-                                          out_activation_max=127, dilation_x=3, dilation_y=2)
-    dataset = 'conv_2x2_dilation'
-    TESTDATA_SETS[dataset] = ConvSettings(dataset, type_of_test, args, in_ch=2, out_ch=2, x_in=10, y_in=10, w_x=3,
-                                          w_y=3, stride_x=1, stride_y=1, pad=False, out_activation_min=-61,
-                                          out_activation_max=107, dilation_x=2, dilation_y=2)
-    dataset = 'conv_2x3_dilation'
-    TESTDATA_SETS[dataset] = ConvSettings(dataset, type_of_test, args, in_ch=2, out_ch=2, x_in=3, y_in=3, w_x=3,
-                                          w_y=3, stride_x=1, stride_y=1, pad=True, out_activation_min=-61,
-                                          out_activation_max=107, dilation_x=2, dilation_y=2)
-    dataset = 'conv_3x2_dilation'
-    TESTDATA_SETS[dataset] = ConvSettings(dataset, type_of_test, args, in_ch=2, out_ch=2, x_in=3, y_in=3, w_x=3,
-                                          w_y=3, stride_x=1, stride_y=1, pad=True, out_activation_min=-61,
-                                          out_activation_max=107, dilation_x=3, dilation_y=2)
-    dataset = 'conv_2x2_dilation_5x5_input'
-    TESTDATA_SETS[dataset] = ConvSettings(dataset, type_of_test, args, in_ch=2, out_ch=2, x_in=5, y_in=5, w_x=3,
-                                          w_y=3, stride_x=1, stride_y=1, pad=True, out_activation_min=-61,
-                                          out_activation_max=107, dilation_x=2, dilation_y=2)
-    dataset = 'conv_3x3_dilation_5x5_input'
-    TESTDATA_SETS[dataset] = ConvSettings(dataset, type_of_test, args, in_ch=2, out_ch=2, x_in=9, y_in=11, w_x=3,
-                                          w_y=3, stride_x=1, stride_y=1, pad=True, out_activation_min=-61,
-                                          out_activation_max=107, dilation_x=2, dilation_y=2)
-    dataset = 'int16xint8'
-    TESTDATA_SETS[dataset] = ConvSettings(dataset, type_of_test, args, in_ch=3, out_ch=4, x_in=7,
-                                          y_in=8, w_x=2, w_y=4, stride_x=2, stride_y=3, pad=True,
-                                          randmin=INT16_MIN, randmax=INT16_MAX, out_activation_min=-13335,
-                                          out_activation_max=32767, int16xint8=True)
-    dataset = 'requantize_s64'
-    TESTDATA_SETS[dataset] = ConvSettings(dataset, type_of_test, args, in_ch=2, out_ch=2, x_in=3,
-                                          y_in=2, w_x=2, w_y=2, stride_x=1, stride_y=1, pad=False,
-                                          out_activation_min=INT16_MIN, out_activation_max=INT16_MAX,
-                                          int16xint8=True, bias_min=-0x300, bias_max=0x9fff)
-    dataset = 'int16xint8_dilation_1'
-    TESTDATA_SETS[dataset] = ConvSettings(dataset, type_of_test, args, in_ch=2, out_ch=2, x_in=32,
-                                          y_in=32, w_x=2, w_y=2, stride_x=1, stride_y=1, pad=False,
-                                          out_activation_min=INT16_MIN, out_activation_max=INT16_MAX,
-                                          int16xint8=True, bias_min=-0x300, dilation_x=2, dilation_y=2)
-    dataset = 'int16xint8_dilation_2'
-    TESTDATA_SETS[dataset] = ConvSettings(dataset, type_of_test, args, in_ch=3, out_ch=4, x_in=7,
-                                          y_in=8, w_x=2, w_y=4, stride_x=1, stride_y=1, pad=True,
-                                          randmin=INT16_MIN, randmax=INT16_MAX, out_activation_min=-13335,
-                                          out_activation_max=32767, int16xint8=True, dilation_x=2, dilation_y=2)
-    dataset = 'int16xint8_dilation_3'
-    TESTDATA_SETS[dataset] = ConvSettings(dataset, type_of_test, args, in_ch=3, out_ch=4, x_in=7,
-                                          y_in=8, w_x=2, w_y=4, stride_x=1, stride_y=1, pad=True,
-                                          randmin=INT16_MIN, randmax=INT16_MAX, out_activation_min=-13335,
-                                          out_activation_max=32767, int16xint8=True, dilation_x=2)
-
-    type_of_test = 'depthwise_conv'
-    dataset = 'depthwise_2'
-    TESTDATA_SETS[dataset] = ConvSettings(dataset, type_of_test, args, in_ch=3, out_ch=9, x_in=6, y_in=5, w_x=3,
-                                          w_y=4, stride_x=2, stride_y=2, pad=True,
-                                          out_activation_min=-73, out_activation_max=127)
-    dataset = 'depthwise_kernel_3x3'
-    TESTDATA_SETS[dataset] = ConvSettings(dataset, type_of_test, args, in_ch=5, out_ch=5, x_in=4, y_in=5, w_x=3,
-                                          w_y=3, stride_x=2, stride_y=2, pad=True,
-                                          out_activation_min=-104, out_activation_max=127)
-    dataset = 'depthwise_eq_in_out_ch'
-    TESTDATA_SETS[dataset] = ConvSettings(dataset, type_of_test, args, in_ch=6, out_ch=6, x_in=4, y_in=5, w_x=2,
-                                          w_y=3, stride_x=1, stride_y=1, pad=True,
-                                          out_activation_min=-86, out_activation_max=127)
-    dataset = 'depthwise_out_activation'
-    TESTDATA_SETS[dataset] = ConvSettings(dataset, type_of_test, args, in_ch=3, out_ch=3, x_in=6, y_in=5, w_x=3,
-                                          w_y=4, pad=False, out_activation_min=-45,
-                                          out_activation_max=103)
-    dataset = 'depthwise_mult_batches'
-    TESTDATA_SETS[dataset] = ConvSettings(dataset, type_of_test, args, in_ch=3, out_ch=3, x_in=3, y_in=5, w_x=2,
-                                          w_y=4, stride_x=2, stride_y=2, pad=True,
-                                          batches=2)
-    dataset = 'depthwise_null_bias_0'
-    TESTDATA_SETS[dataset] = ConvSettings(dataset, type_of_test, args, in_ch=2, out_ch=2, x_in=4, y_in=5, w_x=2,
-                                          w_y=2, stride_x=1, stride_y=1, pad=True, generate_bias=False,
-                                          batches=1)
-    dataset = 'depthwise_null_bias_1'
-    TESTDATA_SETS[dataset] = ConvSettings(dataset, type_of_test, args, in_ch=2, out_ch=8, x_in=4, y_in=5, w_x=2,
-                                          w_y=2, stride_x=1, stride_y=1, pad=True, generate_bias=False,
-                                          batches=1)
-    dataset = 'depthwise_dilation'
-    TESTDATA_SETS[dataset] = ConvSettings(dataset, type_of_test, args, in_ch=3, out_ch=9, x_in=6, y_in=5, w_x=3,
-                                          w_y=4, stride_x=2, stride_y=2, pad=True, out_activation_min=-70,
-                                          out_activation_max=127, dilation_x=2, dilation_y=3)
-    dataset = 'dw_int16xint8'
-    TESTDATA_SETS[dataset] = ConvSettings(dataset, type_of_test, args, in_ch=4, out_ch=8, x_in=9, y_in=5, w_x=3,
-                                          w_y=4, stride_x=3, stride_y=2, pad=True, randmin=INT16_MIN,
-                                          randmax=INT16_MAX, out_activation_min=-21111,
-                                          out_activation_max=32767, int16xint8=True)
-    dataset = 'dw_int16xint8_dilation'
-    TESTDATA_SETS[dataset] = ConvSettings(dataset, type_of_test, args, in_ch=4, out_ch=8, x_in=9, y_in=5, w_x=4,
-                                          w_y=4, stride_x=1, stride_y=1, pad=True, randmin=INT16_MIN,
-                                          randmax=INT16_MAX, out_activation_min=-32700, dilation_x=3, dilation_y=2,
-                                          out_activation_max=32767, int16xint8=True)
-    dataset = 'dw_int16xint8_mult4'
-    TESTDATA_SETS[dataset] = ConvSettings(dataset, type_of_test, args, in_ch=2, out_ch=8, x_in=4, y_in=5, w_x=3,
-                                          w_y=4, stride_x=3, stride_y=2, pad=False, randmin=INT16_MIN,
-                                          randmax=INT16_MAX, out_activation_min=-32767,
-                                          out_activation_max=32767, int16xint8=True)
-    dataset = 'dw_int16xint8_fast'
-    TESTDATA_SETS[dataset] = ConvSettings(dataset, type_of_test, args, in_ch=8, out_ch=8, x_in=4, y_in=4, w_x=2,
-                                          w_y=2, stride_x=1, stride_y=1, pad=False, randmin=INT16_MIN,
-                                          randmax=INT16_MAX, out_activation_min=-17000,
-                                          out_activation_max=32767, int16xint8=True)
-    dataset = 'dw_int16xint8_fast_stride'
-    TESTDATA_SETS[dataset] = ConvSettings(dataset, type_of_test, args, in_ch=8, out_ch=8, x_in=4, y_in=4, w_x=2,
-                                          w_y=2, stride_x=2, stride_y=2, pad=True, randmin=INT16_MIN,
-                                          randmax=INT16_MAX, batches=2, out_activation_min=INT16_MIN,
-                                          out_activation_max=16000, int16xint8=True)
-    dataset = 'dw_int16xint8_fast_spill'
-    TESTDATA_SETS[dataset] = ConvSettings(dataset, type_of_test, args, in_ch=5, out_ch=5, x_in=4, y_in=4, w_x=3,
-                                          w_y=3, stride_x=2, stride_y=1, pad=True, randmin=INT16_MIN,
-                                          randmax=INT16_MAX, batches=3, out_activation_min=-30000,
-                                          out_activation_max=32767, int16xint8=True)
-
-    type_of_test = 'fully_connected'
-    dataset = 'fully_connected'
-    TESTDATA_SETS[dataset] = FullyConnectedSettings(dataset, type_of_test, args, in_ch=10, out_ch=6, x_in=2, y_in=1,
-                                                    batches=3)
-    dataset = 'fully_connected_mve_0'
-    TESTDATA_SETS[dataset] = FullyConnectedSettings(dataset, type_of_test, args, in_ch=16, out_ch=9, x_in=1, y_in=1,
-                                                    batches=1)
-    dataset = 'fully_connected_mve_1'
-    TESTDATA_SETS[dataset] = FullyConnectedSettings(dataset, type_of_test, args, in_ch=20, out_ch=4, x_in=1, y_in=1,
-                                                    batches=1)
-    dataset = 'fully_connected_null_bias_0'
-    TESTDATA_SETS[dataset] = FullyConnectedSettings(dataset, type_of_test, args, in_ch=33, out_ch=5, batches=2,
-                                                    generate_bias=False)
-    dataset = 'fully_connected_out_activation'
-    TESTDATA_SETS[dataset] = FullyConnectedSettings(dataset, type_of_test, args, in_ch=10, out_ch=4,
-                                                    out_activation_min=-70, out_activation_max=100)
-    dataset = 'fully_connected_int16'
-    TESTDATA_SETS[dataset] = FullyConnectedSettings(dataset, type_of_test, args, in_ch=7, out_ch=11, x_in=3, y_in=3,
-                                                    batches=2, randmin=INT16_MIN, randmax=INT16_MAX,
-                                                    out_activation_min=-9999, out_activation_max=32767,
-                                                    int16xint8=True)
-    dataset = 'fully_connected_int16_big'
-    TESTDATA_SETS[dataset] = FullyConnectedSettings(dataset, type_of_test, args, in_ch=7, out_ch=11, x_in=10,
-                                                    y_in=10, batches=3, out_activation_min=-1444,
-                                                    out_activation_max=32767, int16xint8=True)
-    dataset = 'fc_int16_slow'
-    TESTDATA_SETS[dataset] = FullyConnectedSettings(dataset, type_of_test, args, in_ch=7, out_ch=11, x_in=10,
-                                                    y_in=8, batches=3, randmin=(INT16_MAX-100), randmax=INT16_MAX,
-                                                    int16xint8=True)
-
-    type_of_test = 'avgpool'
-    dataset = 'avgpooling'
-    TESTDATA_SETS[dataset] = PoolingSettings(dataset, type_of_test, args, channels=8, x_in=22, y_in=12, stride_x=9,
-                                             stride_y=5, w_x=6, w_y=5, pad=True)
-    dataset = 'avgpooling_1'
-    TESTDATA_SETS[dataset] = PoolingSettings(dataset, type_of_test, args, channels=3, x_in=9, y_in=5, stride_x=1,
-                                             stride_y=2, w_x=9, w_y=5, pad=False)
-    dataset = 'avgpooling_2'
-    TESTDATA_SETS[dataset] = PoolingSettings(dataset, type_of_test, args, channels=5, x_in=12, y_in=1, stride_x=1,
-                                             stride_y=2, w_x=3, w_y=1, pad=True)
-    dataset = 'avgpooling_3'
-    TESTDATA_SETS[dataset] = PoolingSettings(dataset, type_of_test, args, channels=2, x_in=9, y_in=1, stride_x=2,
-                                             stride_y=1, w_x=1, w_y=1, pad=False)
-    dataset = 'avgpooling_4'
-    TESTDATA_SETS[dataset] = PoolingSettings(dataset, type_of_test, args, channels=2, x_in=1, y_in=20, stride_x=1,
-                                             stride_y=3, w_x=1, w_y=3, pad=True)
-    dataset = 'avgpooling_5'
-    TESTDATA_SETS[dataset] = PoolingSettings(dataset, type_of_test, args, channels=1, x_in=3, y_in=3,
-                                             stride_x=1, stride_y=1, w_x=1, w_y=3, pad=True, relu6=True)
-    dataset = 'avgpooling_int16'
-    TESTDATA_SETS[dataset] = PoolingSettings(dataset, type_of_test, args, channels=2, x_in=6, y_in=4,
-                                             stride_x=2, stride_y=1, w_x=2, w_y=3, pad=True,
-                                             randmin=INT16_MIN, randmax=INT16_MAX, int16xint8=True)
-
-    type_of_test = 'maxpool'
-    dataset = 'maxpooling'
-    TESTDATA_SETS[dataset] = PoolingSettings(dataset, type_of_test, args, channels=8, x_in=22, y_in=12, stride_x=9,
-                                             stride_y=5, w_x=6, w_y=5, pad=True)
-    dataset = 'maxpooling_1'
-    TESTDATA_SETS[dataset] = PoolingSettings(dataset, type_of_test, args, channels=3, x_in=9, y_in=5, stride_x=1,
-                                             stride_y=2, w_x=9, w_y=5, pad=False)
-    dataset = 'maxpooling_2'
-    TESTDATA_SETS[dataset] = PoolingSettings(dataset, type_of_test, args, channels=5, x_in=12, y_in=1, stride_x=1,
-                                             stride_y=2, w_x=3, w_y=1, pad=True)
-    dataset = 'maxpooling_3'
-    TESTDATA_SETS[dataset] = PoolingSettings(dataset, type_of_test, args, channels=2, x_in=9, y_in=1, stride_x=2,
-                                             stride_y=1, w_x=1, w_y=1, pad=False)
-    dataset = 'maxpooling_4'
-    TESTDATA_SETS[dataset] = PoolingSettings(dataset, type_of_test, args, channels=2, x_in=1, y_in=20, stride_x=1,
-                                             stride_y=3, w_x=1, w_y=3, pad=True)
-    dataset = 'maxpooling_5'
-    TESTDATA_SETS[dataset] = PoolingSettings(dataset, type_of_test, args, channels=20, x_in=1, y_in=1, stride_x=1,
-                                             stride_y=1, w_x=1, w_y=1, pad=True)
-    dataset = 'maxpooling_6'
-    TESTDATA_SETS[dataset] = PoolingSettings(dataset, type_of_test, args, channels=17, x_in=1, y_in=5, stride_x=1,
-                                             stride_y=3, w_x=3, w_y=4, pad=True)
-    dataset = 'maxpooling_7'
-    TESTDATA_SETS[dataset] = PoolingSettings(dataset, type_of_test, args, channels=1, x_in=4, y_in=2, stride_x=2,
-                                             stride_y=2, w_x=2, w_y=2, pad=False, relu6=True)
-    dataset = 'maxpool_int16'
-    TESTDATA_SETS[dataset] = PoolingSettings(dataset, type_of_test, args, channels=2, x_in=4, y_in=3, stride_x=2,
-                                             stride_y=2, w_x=2, w_y=2, pad=False, randmin=INT16_MIN,
-                                             randmax=INT16_MAX, int16xint8=True)
-    dataset = 'maxpool_int16_1'
-    TESTDATA_SETS[dataset] = PoolingSettings(dataset, type_of_test, args, channels=2, x_in=4, y_in=5, stride_x=2,
-                                             stride_y=1, w_x=3, w_y=3, pad=True, randmin=INT16_MIN,
-                                             randmax=INT16_MAX, out_activation_min=-30000, out_activation_max=30000,
-                                             int16xint8=True)
-    dataset = 'maxpool_int16_2'
-    TESTDATA_SETS[dataset] = PoolingSettings(dataset, type_of_test, args, channels=3, x_in=7, y_in=7, stride_x=1,
-                                             stride_y=1, w_x=3, w_y=3, pad=False, randmin=INT16_MIN,
-                                             randmax=INT16_MAX, out_activation_min=-30000, out_activation_max=30000,
-                                             int16xint8=True)
-
-    type_of_test = 'softmax'
-    dataset = 'softmax'
-    TESTDATA_SETS[dataset] = SoftmaxSettings(dataset, type_of_test, args, x_in=5, y_in=2)
-    dataset = 'softmax_s16'
-    TESTDATA_SETS[dataset] = SoftmaxSettings(dataset, type_of_test, args, x_in=10, y_in=3, int16xint8=True,
-                                             randmin=INT16_MIN, randmax=INT16_MAX)
-    dataset = 'softmax_s8_s16'
-    TESTDATA_SETS[dataset] = SoftmaxSettings(dataset, type_of_test, args, x_in=12, y_in=2, inInt8outInt16=True)
-
-    type_of_test = 'svdf'
-    dataset = 'svdf'
-    TESTDATA_SETS[dataset] = SVDFSettings(dataset, type_of_test, args, batches=2, number_inputs=2, rank=8,
-                                          memory_size=8, input_size=3, number_units=3)
-    dataset = 'svdf_1'
-    TESTDATA_SETS[dataset] = SVDFSettings(dataset, type_of_test, args, batches=3, number_inputs=2, rank=1,
-                                          memory_size=2, input_size=7, number_units=5)
-    dataset = 'svdf_2'
-    TESTDATA_SETS[dataset] = SVDFSettings(dataset, type_of_test, args, batches=3, number_inputs=2, rank=2,
-                                          memory_size=2, input_size=7, number_units=5, generate_bias=False)
-    dataset = 'svdf_3'
-    TESTDATA_SETS[dataset] = SVDFSettings(dataset, type_of_test, args, batches=1, number_inputs=2, rank=1,
-                                          memory_size=2, input_size=20, number_units=12, generate_bias=False)
-
-    type_of_test = 'add'
-    dataset = 'add'
-    TESTDATA_SETS[dataset] = AddMulSettings(dataset, type_of_test, args, channels=8, x_in=4, y_in=4,
-                                            randmin=INT8_MIN, randmax=INT8_MAX)
-    dataset = 'add_s16'
-    ALL_TESTDATA_SETS[dataset] = AddMulSettings(dataset, type_of_test, args, channels=8, x_in=4, y_in=4,
-                                                randmin=INT16_MIN, randmax=INT16_MAX, out_activation_min=INT16_MIN,
-                                                out_activation_max=INT16_MAX, int16xint8=True)
-    dataset = 'add_s16_spill'
-    ALL_TESTDATA_SETS[dataset] = AddMulSettings(dataset, type_of_test, args, channels=7, x_in=5, y_in=3,
-                                                randmin=INT16_MIN, randmax=INT16_MAX, out_activation_min=-2000,
-                                                out_activation_max=INT16_MAX, int16xint8=True)
-
-    type_of_test = 'mul'
-    dataset = 'mul'
-    TESTDATA_SETS[dataset] = AddMulSettings(dataset, type_of_test, args, channels=8, x_in=4, y_in=5,
-                                            randmin=INT8_MIN, randmax=INT8_MAX)
-    dataset = 'mul_s16'
-    ALL_TESTDATA_SETS[dataset] = AddMulSettings(dataset, type_of_test, args, channels=8, x_in=5, y_in=4,
-                                                randmin=INT16_MIN, randmax=INT16_MAX, out_activation_min=INT16_MIN,
-                                                out_activation_max=INT16_MAX, int16xint8=True)
-    dataset = 'mul_s16_spill'
-    ALL_TESTDATA_SETS[dataset] = AddMulSettings(dataset, type_of_test, args, channels=7, x_in=5, y_in=7,
-                                                randmin=INT16_MIN, randmax=INT16_MAX, out_activation_min=INT16_MIN,
-                                                out_activation_max=1000, int16xint8=True)
+    # Keys of a test set that are not constructor parameters.
+    SPEC_KEYS = ['type', 'stress']
 
+    CONSTANTS = {
+        'INT32_MAX': INT32_MAX,
+        'INT32_MIN': INT32_MIN,
+        'INT16_MAX': INT16_MAX,
+        'INT16_MIN': INT16_MIN,
+        'INT8_MAX': INT8_MAX,
+        'INT8_MIN': INT8_MIN,
+    }
 
-if __name__ == '__main__':
-    if version.parse(tf.__version__) < REQUIRED_MINIMUM_TENSORFLOW_VERSION:
-        print("Unsupported tensorflow version, ", version.parse(tf.__version__))
-        sys.exit(0)
+    def __init__(self):
+        self.specs = {}
+        self.settings = {}
+
+    def load(self, filepath):
+        with open(filepath, 'r') as f:
+            specs = json.load(f)
+        for name, spec in specs.items():
+            if spec.get('type') not in SETTINGS_CLASSES:
+                raise RuntimeError("Invalid test type {} of test set {} in {}".format(spec.get('type'), name, filepath))
+            self.specs[name] = {key: self.CONSTANTS.get(value, value) if isinstance(value, str) else value
+                                for key, value in spec.items()}
+
+    def get_test_type(self, name):
+        return self.specs[name]['type']
+
+    def is_stress(self, name):
+        return self.specs[name].get('stress', False)
+
+    def __getitem__(self, name):
+        if name not in self.settings:
+            params = {key: value for key, value in self.specs[name].items() if key not in self.SPEC_KEYS}
+            test_type = self.get_test_type(name)
+            self.settings[name] = SETTINGS_CLASSES[test_type](name, test_type, args, **params)
+        return self.settings[name]
+
+    def __contains__(self, name):
+        return name in self.specs
 
+    def __iter__(self):
+        return iter(self.specs)
+
+    def __len__(self):
+        return len(self.specs)
+
+
+TESTDATA_SETS = TestDataSets()
+
+
+def init_worker(worker_args):
+    """
+    Initializer for the worker processes used by --jobs. Each worker gets its own copy of the test sets.
+    """
+    global args
+    args = worker_args
+    PROFILER.enabled = args.profile is not None
+    load_all_testdatasets()
+
+
+def import_reference(*settings):
+    """
+    Import TensorFlow if any of the test sets has a TFLite reference.
+    """
+    if not all(testset.uses_numpy_reference for testset in settings):
+        import_tensorflow()
+
+
+def generate_testset(testset_name):
+    """
+    Generate a single test set and return (name, error, seconds, phases), where error is None on success and phases
+    are the phases recorded by --profile.
+    """
+    print("Generating testset {}..".format(testset_name))
+    start = time.monotonic()
+    error = None
+    try:
+        import_reference(TESTDATA_SETS[testset_name])
+        TESTDATA_SETS[testset_name].generate_data()
+    except Exception:
+        error = traceback.format_exc()
+    print()
+    return (testset_name, error, time.monotonic() - start, PROFILER.take(testset_name))
+
+
+def split_batched_model(tflite_model, input_names):
+    """
+    Split a converted multi-input, multi-output model into one model per branch, where input_names has the names of
+    the Keras inputs of each branch. The converter does not keep the order of the inputs and outputs, so a branch is
+    found by following its operators from its inputs. The tensors of a branch are ordered as the operands of its
+    operators and the buffers of the other branches are left empty.
+    """
+    model = schema_fb.ModelT.InitFromPackedBuf(bytearray(tflite_model), 0)
+    subgraph = model.subgraphs[0]
+    names = [tensor.name.decode().split(':')[0] for tensor in subgraph.tensors]
+    kept_buffers = {0} | {metadata.buffer for metadata in model.metadata or []}
+
+    models = []
+    for branch_input_names in input_names:
+        inputs = []
+        for name in branch_input_names:
+            matches = [index for index in subgraph.inputs if names[index] == name or names[index].endswith('_' + name)]
+            if len(matches) != 1:
+                raise RuntimeError("Input {} not found in batched model".format(name))
+            inputs.append(matches[0])
+
+        tensors = list(inputs)
+        operators = []
+        for operator in subgraph.operators:
+            if any(index in tensors for index in operator.inputs):
+                operators.append(operator)
+                tensors += [index for index in list(operator.inputs) + list(operator.outputs)
+                            if index >= 0 and index not in tensors]
+        new_index = {index: new_index for new_index, index in enumerate(tensors)}
+        new_index[-1] = -1
+
+        branch = copy.copy(subgraph)
+        branch.tensors = [subgraph.tensors[index] for index in tensors]
+        branch.inputs = [new_index[index] for index in inputs]
+        branch.outputs = [new_index[index] for index in subgraph.outputs if index in new_index]
+        branch.operators = []
+        for operator in operators:
+            operator = copy.copy(operator)
+            operator.inputs = [new_index[index] for index in operator.inputs]
+            operator.outputs = [new_index[index] for index in operator.outputs]
+            branch.operators.append(operator)
+
+        used_buffers = kept_buffers | {tensor.buffer for tensor in branch.tensors}
+        branch_model = copy.copy(model)
+        branch_model.subgraphs = [branch]
+        branch_model.buffers = [buffer if index in used_buffers else schema_fb.BufferT()
+                                for index, buffer in enumerate(model.buffers)]
+        branch_model.signatureDefs = None
+
+        builder = flatbuffers.Builder(1024)
+        builder.Finish(branch_model.Pack(builder), file_identifier=TFLiteModelBuilder.FILE_IDENTIFIER)
+        models.append(bytes(builder.Output()))
+    return models
+
+
+def convert_batched_models(batch):
+    """
+    Convert the models of several test sets as one multi-input, multi-output Keras model, with one branch per test set,
+    and store the model of each test set in the model cache. batch is a list of (settings, ModelRequest). The test sets
+    must have the same input type.
+    """
+    inputs = []
+    outputs = []
+    input_names = []
+    batched = []
+    for i, (settings, request) in enumerate(batch):
+        try:
+            model = request.create_model()
+        except Exception:
+            # Left to the second pass, which reports the error.
+            continue
+        batched.append((settings, request))
+        names = ['batch_input_{}_{}'.format(i, j) for j in range(len(model.inputs))]
+        branch_inputs = [tf.keras.layers.Input(shape=model_input.shape[1:], batch_size=model_input.shape[0], name=name)
+                         for name, model_input in zip(names, model.inputs)]
+        outputs.append(model(branch_inputs if len(branch_inputs) > 1 else branch_inputs[0]))
+        inputs += branch_inputs
+        input_names.append(names)
+    if not batched:
+        return
+    print("Converting batched model of {}..".format(', '.join(settings.testdataset for settings, request in batched)))
+    batched_model = tf.keras.models.Model(inputs=inputs, outputs=outputs)
+
+    def representative_data_gen():
+        # All ones for every input, the same as get_convolving_calib_data_func(). The converter does not keep the
+        # order of the inputs, so the data is given by input name.
+        yield {name: np.ones([dim or 1 for dim in model_input.shape], dtype=np.float32)
+               for name, model_input in zip(sum(input_names, []), batched_model.inputs)}
+
+    (settings, request) = batched[0]
+    try:
+        tflite_model = settings.convert_model(batched_model, request.inttype, representative_data_gen)
+        models = split_batched_model(tflite_model, input_names)
+    except Exception:
+        print("WARNING: Converting the batched model failed, the models are converted one by one instead:\n{}".
+              format(traceback.format_exc()))
+        return
+
+    for (settings, request), tflite_model in zip(batched, models):
+        interpreter = Interpreter(model_content=tflite_model, experimental_op_resolver_type=OpResolverType.BUILTIN_REF)
+        interpreter.allocate_tensors()
+        settings.model_cache.store(request.cache_key, tflite_model, settings.get_model_quantization(interpreter))
+
+
+def generate_batched_models(testset_names):
+    """
+    First pass of --batch-models. The test sets are generated until they need to convert a model, then the models of
+    all test sets with the same input type are converted together and stored in the model cache, where the second
+    pass finds them. Test sets that do not convert a model are completed. Returns the results of the completed test
+    sets and the names of the test sets left for the second pass.
+    """
+    results = []
+    remaining = []
+    batches = {}
+    for testset_name in testset_names:
+        settings = TESTDATA_SETS[testset_name]
+        print("Generating testset {}..".format(testset_name))
+        start = time.monotonic()
+        settings.model_request_only = True
+        try:
+            settings.generate_data()
+            results.append((testset_name, None, time.monotonic() - start, PROFILER.take(testset_name)))
+        except ModelRequest as request:
+            batches.setdefault((request.inttype, settings.is_int16xint8), []).append((settings, request))
+            remaining.append(testset_name)
+        except Exception:
+            results.append((testset_name, traceback.format_exc(), time.monotonic() - start,
+                            PROFILER.take(testset_name)))
+        settings.model_request_only = False
+        print()
+
+    for batch in batches.values():
+        convert_batched_models(batch)
+
+    # The data of the remaining test sets has been stored, the second pass must use the same data.
+    args.regenerate_weights = args.regenerate_input = args.regenerate_biases = args.regenerate_all = False
+    for testset_name in remaining:
+        settings = TESTDATA_SETS[testset_name]
+        settings.regenerate_new_weights = settings.regenerate_new_input = settings.regenerate_new_bias = False
+    return results, remaining
+
+
+def is_out_of_date(manifest, testset_name, state, settings):
+    """
+    Used by --incremental. Returns whether the test set needs to be generated and prints why.
+    """
+    reasons = manifest.get_rebuild_reasons(testset_name, state, settings)
+    if reasons:
+        print("Rebuilding testset {}: {}".format(testset_name, ', '.join(reasons)))
+    else:
+        print("Testset {} is up to date".format(testset_name))
+    return bool(reasons)
+
+
+def print_dry_run(testset_name, settings):
+    """
+    Print what generating the test set would use and where it would be written.
+    """
+    print("Testset {} ({})".format(testset_name, type(settings).__name__))
+    if testset_name in TESTDATA_SETS:
+        print("    Parameters: {}".format(', '.join("{}={}".format(name, value)
+                                                    for name, value in TESTDATA_SETS.specs[testset_name].items())))
+    directory = settings.pregenerated_data_dir + testset_name
+    files = sorted(os.listdir(directory)) if os.path.isdir(directory) else []
+    print("    Pregenerated data: {}".format("{}/ ({})".format(directory, ', '.join(files)) if files else "none"))
+    regenerated = [data for data, regenerate in (('weights', settings.regenerate_new_weights),
+                                                 ('input', settings.regenerate_new_input),
+                                                 ('biases', settings.regenerate_new_bias)) if regenerate]
+    if regenerated:
+        print("    Regenerated: {}".format(', '.join(regenerated)))
+    print("    Output: {}".format(settings.headers_dir))
+
+
+def generate_testsets(testset_names, jobs):
+    """
+    Generate the given test sets, in a pool of worker processes if jobs > 1, and print a report per test set.
+    The manifest is updated with the test sets that were generated. Returns the number of test sets that failed.
+    """
+    manifest = TestDataManifest(TestSettings.OUTDIR)
+    states = {testset_name: TESTDATA_SETS[testset_name].get_manifest_state() for testset_name in testset_names}
+    if args.incremental:
+        testset_names = [testset_name for testset_name in testset_names
+                         if is_out_of_date(manifest, testset_name, states[testset_name], TESTDATA_SETS[testset_name])]
+        print()
+
+    results = []
+    if args.batch_models:
+        (results, testset_names) = generate_batched_models(testset_names)
+
+    if jobs > 1:
+        # Use spawn so that no TensorFlow state is inherited from this process.
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs,
+                                                    mp_context=multiprocessing.get_context('spawn'),
+                                                    initializer=init_worker,
+                                                    initargs=(args, )) as executor:
+            results += list(executor.map(generate_testset, testset_names))
+    else:
+        results += [generate_testset(testset_name) for testset_name in testset_names]
+
+    for testset_name, error, seconds, phases in results:
+        if not error:
+            manifest.update(testset_name, states[testset_name], TESTDATA_SETS[testset_name])
+    manifest.save()
+
+    if args.profile:
+        write_profile_report(results, args.profile)
+
+    failed = 0
+    print("{:<40} {:<8} {:>10}".format("Testset", "Result", "Time (s)"))
+    for testset_name, error, seconds, phases in results:
+        print("{:<40} {:<8} {:>10.2f}".format(testset_name, "FAILED" if error else "OK", seconds))
+    for testset_name, error, seconds, phases in results:
+        if error:
+            failed += 1
+            print("\nERROR: Testset {} failed:\n{}".format(testset_name, error))
+    return failed
+
+
+def write_profile_report(results, filepath):
+    """
+    Write the phases recorded by --profile for the results of generate_testset() to a JSON or CSV report and print
+    the slowest test sets and phases. The time of a test set that is not spent in any phase is reported as 'other'.
+    """
+    testsets = {}
+    for testset_name, error, seconds, phases in results:
+        phases = copy.deepcopy(phases)
+        # Phases recorded in this process, e.g. by the first pass of --batch-models.
+        for phase, record in PROFILER.take(testset_name).items():
+            total = phases.setdefault(phase, {'seconds': 0.0, 'peak_rss': 0, 'calls': 0})
+            total['seconds'] += record['seconds']
+            total['peak_rss'] = max(total['peak_rss'], record['peak_rss'])
+            total['calls'] += record['calls']
+        phases['other'] = {
+            'seconds': max(0.0, seconds - sum(record['seconds'] for record in phases.values())),
+            'peak_rss': 0,
+            'calls': 1
+        }
+        testsets[testset_name] = {
+            'result': "FAILED" if error else "OK",
+            'seconds': seconds,
+            'peak_rss': max(record['peak_rss'] for record in phases.values()),
+            'phases': phases
+        }
+
+    with open(filepath, 'w', newline='') as f:
+        if filepath.endswith('.csv'):
+            writer = csv.writer(f)
+            writer.writerow(['testset', 'result', 'phase', 'seconds', 'peak_rss', 'calls'])
+            for testset_name, testset in testsets.items():
+                for phase, record in testset['phases'].items():
+                    writer.writerow([testset_name, testset['result'], phase, '{:.6f}'.format(record['seconds']),
+                                     record['peak_rss'], record['calls']])
+        else:
+            json.dump({'tensorflow': tf.__version__ if tf else None, 'backend': args.backend, 'jobs': args.jobs,
+                       'testsets': testsets}, f, indent=4)
+            f.write('\n')
+    print("Wrote profile report {}".format(filepath))
+
+    megabyte = 1024 * 1024
+    print("\n{:<40} {:>10} {:>14}  {}".format("Slowest testsets", "Time (s)", "Peak RSS (MB)", "Slowest phase"))
+    for testset_name, testset in sorted(testsets.items(), key=lambda item: -item[1]['seconds'])[:PROFILE_SUMMARY_ROWS]:
+        slowest_phase = max(testset['phases'], key=lambda phase: testset['phases'][phase]['seconds'])
+        print("{:<40} {:>10.2f} {:>14.1f}  {}".format(testset_name, testset['seconds'], testset['peak_rss'] / megabyte,
+                                                      slowest_phase))
+
+    phases = {}
+    for testset in testsets.values():
+        for phase, record in testset['phases'].items():
+            total = phases.setdefault(phase, {'seconds': 0.0, 'peak_rss': 0, 'calls': 0})
+            total['seconds'] += record['seconds']
+            total['peak_rss'] = max(total['peak_rss'], record['peak_rss'])
+            total['calls'] += record['calls']
+    print("\n{:<40} {:>10} {:>14} {:>8}".format("Slowest phases", "Time (s)", "Peak RSS (MB)", "Calls"))
+    for phase, total in sorted(phases.items(), key=lambda item: -item[1]['seconds'])[:PROFILE_SUMMARY_ROWS]:
+        print("{:<40} {:>10.2f} {:>14.1f} {:>8}".format(phase, total['seconds'], total['peak_rss'] / megabyte,
+                                                       total['calls']))
+    print()
+
+
+def remove_unused_pooled_arrays():
+    """
+    Remove the pooled arrays that no test set refers to anymore, e.g. as the test set was generated again with other
+    data. The pooled arrays of a test set are included by its test_data.h, see write_c_header_wrapper().
+    """
+    directory = TestSettings.OUTDIR + TestSettings.POOL_DIR
+    if not os.path.isdir(directory):
+        return
+    reference = re.compile(r'#include "\.\./{}(\w+)_data\.h"'.format(TestSettings.POOL_DIR))
+    used = set()
+    for testset_dir in next(os.walk(TestSettings.OUTDIR))[1]:
+        filepath = os.path.join(TestSettings.OUTDIR, testset_dir, 'test_data.h')
+        if os.path.exists(filepath):
+            with open(filepath, 'r') as f:
+                used.update(reference.findall(f.read()))
+    unused = [filename for filename in os.listdir(directory) if filename.split('_')[0] not in used]
+    for filename in unused:
+        os.remove(directory + filename)
+    if unused:
+        print("Removed {} unused files from {}".format(len(unused), directory))
+    if not os.listdir(directory):
+        os.rmdir(directory)
+
+
+def check_pooled_arrays_link(compiler=None):
+    """
+    Check that the test sets sharing pooled arrays can be linked into one image. The test_data.h of each of them is
+    compiled in a translation unit of its own, as by the unit tests of different kernels, and the objects are linked
+    with the host C compiler, CC or cc by default. The program checks that each test set refers to the same copy of
+    the arrays it shares. Returns True if the check passes.
+    """
+    reference = re.compile(r'#include "\.\./{}(\w+)_data\.h"'.format(TestSettings.POOL_DIR))
+    pooled = {}
+    for testset_dir in sorted(next(os.walk(TestSettings.OUTDIR))[1]):
+        filepath = os.path.join(TestSettings.OUTDIR, testset_dir, 'test_data.h')
+        if os.path.exists(filepath):
+            with open(filepath, 'r') as f:
+                for stem in reference.findall(f.read()):
+                    pooled.setdefault(stem, []).append(testset_dir)
+    shared = {stem: testsets for stem, testsets in pooled.items() if len(testsets) > 1}
+    if not shared:
+        print("No pooled arrays are shared by test sets")
+        return True
+    testsets = sorted(set(itertools.chain.from_iterable(shared.values())))
+    # The shared pooled arrays of each test set, in the order of the array of pointers to them its object defines.
+    stems = {testset: [stem for stem in sorted(shared) if testset in shared[stem]] for testset in testsets}
+
+    outdir = os.path.abspath(TestSettings.OUTDIR)
+    with tempfile.TemporaryDirectory() as build_dir:
+        sources = []
+        for index, testset in enumerate(testsets):
+            symbols = ["cmsis_nn_pool_" + stem for stem in stems[testset]]
+            sources.append(os.path.join(build_dir, testset + '.c'))
+            with open(sources[-1], 'w') as f:
+                f.write("#include <stdint.h>\n"
+                        "typedef int8_t q7_t;\ntypedef int16_t q15_t;\ntypedef int32_t q31_t;\ntypedef int64_t q63_t;\n"
+                        '#include "{}"\n\n'.format(os.path.join(outdir, testset, 'test_data.h')))
+                f.write("const void *const pooled_{}[] = {{{}}};\n".format(index, ", ".join(symbols)))
+        sources.append(os.path.join(build_dir, 'main.c'))
+        with open(sources[-1], 'w') as f:
+            f.write("#include <stdio.h>\n\n")
+            for index in range(len(testsets)):
+                f.write("extern const void *const pooled_{}[];\n".format(index))
+            f.write("\nint main(void)\n{\n    int failed = 0;\n")
+            for stem, users in sorted(shared.items()):
+                (first, *others) = [(testsets.index(testset), stems[testset].index(stem)) for testset in users]
+                for other in others:
+                    f.write("    if (pooled_{}[{}] != pooled_{}[{}]) {{\n".format(*first, *other))
+                    f.write('        printf("{} and {} refer to different copies of cmsis_nn_pool_{}\\n");\n'.format(
+                        testsets[first[0]], testsets[other[0]], stem))
+                    f.write("        failed = 1;\n    }\n")
+            f.write("    return failed;\n}\n")
+
+        program = os.path.join(build_dir, 'check_pooled_arrays_link')
+        command = [compiler or os.environ.get('CC', 'cc'), '-DCMSIS_NN_TEST_DATA_DIR="{}"'.format(outdir), '-o',
+                   program] + sources
+        if subprocess.run(command).returncode != 0 or subprocess.run([program]).returncode != 0:
+            print("ERROR: The {} test sets sharing pooled arrays cannot be linked together".format(len(testsets)))
+            return False
+    print("The {} test sets sharing {} pooled arrays link together".format(len(testsets), len(shared)))
+    return True
+
+
+def load_all_testdatasets():
+    """
+    Add all new testdata sets to TESTDATA_SETS_FILE
+    """
+    TESTDATA_SETS.load(TESTDATA_SETS_FILE)
+
+
+if __name__ == '__main__':
     args = parse_args()
+    PROFILER.enabled = args.profile is not None
     testdataset = args.dataset
     test_type = args.testtype
 
     load_all_testdatasets()
 
-    if (args.run_all_testsets):
-        for testset_name, testset_generator in TESTDATA_SETS.items():
-            if test_type and testset_generator.test_type != test_type:
-                continue
-            print("Generating testset {}..".format(testset_name))
-            testset_generator.generate_data()
-            print()
+    if args.list:
+        for testset_name in TESTDATA_SETS:
+            if (not test_type or TESTDATA_SETS.get_test_type(testset_name) == test_type) and \
+               (args.stress or not TESTDATA_SETS.is_stress(testset_name)):
+                print("{:<40} {}".format(testset_name, TESTDATA_SETS.get_test_type(testset_name)))
+    elif args.check_pool_link:
+        if not check_pooled_arrays_link():
+            sys.exit(1)
+    elif args.convert_pregenerated_data:
+        for testset_generator in TESTDATA_SETS.values():
+            testset_generator.convert_pregenerated_data()
+    elif (args.run_all_testsets):
+        testset_names = [testset_name for testset_name in TESTDATA_SETS
+                         if (not test_type or TESTDATA_SETS.get_test_type(testset_name) == test_type)
+                         and (args.stress or not TESTDATA_SETS.is_stress(testset_name))]
+        if args.dry_run:
+            if args.incremental:
+                import_reference(*[TESTDATA_SETS[testset_name] for testset_name in testset_names])
+                manifest = TestDataManifest(TestSettings.OUTDIR)
+                testset_names = [testset_name for testset_name in testset_names
+                                 if is_out_of_date(manifest, testset_name,
+                                                   TESTDATA_SETS[testset_name].get_manifest_state(),
+                                                   TESTDATA_SETS[testset_name])]
+            for testset_name in testset_names:
+                print_dry_run(testset_name, TESTDATA_SETS[testset_name])
+            sys.exit(0)
+
+        import_reference(*[TESTDATA_SETS[testset_name] for testset_name in testset_names])
+        failed_testsets = generate_testsets(testset_names, args.jobs)
+        remove_unused_pooled_arrays()
 
         # Check that all testsets have been loaded.
         found_test_data_sets = []
         directory = 'TestCases/TestData'
         for dir in next(os.walk(directory))[1]:
-            found_test_data_sets.append(dir)
+            if dir + '/' != TestSettings.POOL_DIR:
+                found_test_data_sets.append(dir)
         for testset_name in found_test_data_sets:
             if testset_name not in TESTDATA_SETS:
                 print("WARNING: Testset {} in {} was not loaded".format(testset_name, directory))
+        if failed_testsets:
+            sys.exit(1)
     else:
         try:
             if not testdataset:
@@ -1487,18 +3352,25 @@ if __name__ == '__main__':
             generator = TESTDATA_SETS[testdataset]
         except KeyError:
             print("WARNING: testset {} not in testset list".format(testdataset))
-            if args.testtype == 'conv' or args.testtype == 'depthwise_conv':
-                generator = ConvSettings(testdataset, test_type, args)
-            elif args.testtype == 'fully_connected':
-                generator = FullyConnectedSettings(testdataset, test_type, args)
-            elif args.testtype == 'avgpool' or args.testtype == 'maxpool':
-                generator = PoolingSettings(testdataset, test_type, args)
-            elif args.testtype == 'softmax':
-                generator = SoftmaxSettings(testdataset, test_type, args)
-            elif args.testtype == 'svdf':
-                generator = SVDFSettings(testdataset, test_type, args)
-            elif args.testtype == 'add' or args.testtype == 'mul':
-                generator = AddMulSettings(testdataset, test_type, args)
-            else:
+            if test_type not in SETTINGS_CLASSES:
                 raise RuntimeError("Please specify type of test with -t")
-        generator.generate_data()
+            generator = SETTINGS_CLASSES[test_type](testdataset, test_type, args)
+        if args.dry_run and not args.incremental:
+            print_dry_run(testdataset, generator)
+            sys.exit(0)
+
+        import_reference(generator)
+        manifest = TestDataManifest(TestSettings.OUTDIR)
+        state = generator.get_manifest_state()
+        if not args.incremental or is_out_of_date(manifest, testdataset, state, generator):
+            if args.dry_run:
+                print_dry_run(testdataset, generator)
+            else:
+                start = time.monotonic()
+                generator.generate_data()
+                seconds = time.monotonic() - start
+                manifest.update(testdataset, state, generator)
+                manifest.save()
+                remove_unused_pooled_arrays()
+                if args.profile:
+                    write_profile_report([(testdataset, None, seconds, PROFILER.take(testdataset))], args.profile)